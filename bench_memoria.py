@@ -0,0 +1,112 @@
+# bench_memoria.py
+# mede quanta memória cada movimentação carregada do banco ocupa: como lista de objetos, com as classes de
+# registro "com __slots__" (as de models.py) e com as mesmas classes sem slots (como eram antes), e no
+# HistoricoColunar que o carregamento normal usa.
+# uso: python bench_memoria.py [quantidade de movimentos]   (padrão: 100000)
+
+import dataclasses
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+import models
+import repositorios
+from database import DatabaseManager
+from manager import GerenciadorEstoque
+from repositorios import RepositorioHistorico
+
+# os tipos de registro que existem aos montes (um objeto por linha do banco)
+CLASSES_REGISTRO = ('HistoricoMovimento', 'ItemVenda', 'Venda', 'ItemOrdemCompra', 'ItemDevolucao', 'Transacao')
+
+
+def _sem_slots(classe):
+    """a mesma dataclass, com os mesmos campos e métodos, mas com __dict__ por instância"""
+    campos = [(f.name, f.type, f) for f in dataclasses.fields(classe)]
+    metodos = {nome: valor for nome, valor in vars(classe).items()
+               if isinstance(valor, property) or (callable(valor) and not nome.startswith('__')) or nome == '__str__'}
+    return dataclasses.make_dataclass(classe.__name__, campos, namespace=metodos)
+
+
+def _popular_banco(caminho: str, quantidade: int) -> None:
+    """cria um banco com alguns produtos e `quantidade` movimentações no histórico"""
+    db = DatabaseManager(caminho)
+    db.connect()
+    db.create_tables()
+    gerenciador = GerenciadorEstoque(db)
+    gerenciador.carregar_dados_do_banco()
+    fornecedor = gerenciador.adicionar_fornecedor(nome="Bench", empresa="Bench", telefone="", email="", morada="")
+    locais = [gerenciador.adicionar_localizacao(nome=f"Local {i}") for i in range(4)]
+    produtos = [gerenciador.adicionar_produto(fornecedor_id=fornecedor.id, nome=f"Produto {i}", codigo_barras=f"B{i:05d}",
+                                              descricao="", categoria=f"C{i % 5}", preco_compra=1.0, preco_venda=2.0,
+                                              ponto_ressuprimento=0) for i in range(50)]
+    # direto no banco: o que interessa aqui é o carregamento, não o caminho da movimentação
+    inicio = datetime(2024, 1, 1)
+    linhas = [(produtos[i % len(produtos)].id, locais[i % len(locais)].id, "Entrada de estoque", 1,
+               models.para_epoca(inicio + timedelta(seconds=i))) for i in range(quantidade)]
+    with db.transacao():
+        db.cursor.executemany("INSERT INTO historico_movimentos (produto_id, localizacao_id, tipo, quantidade, data) VALUES (?, ?, ?, ?, ?)", linhas)
+    db.close()
+
+
+def _bytes_por_movimento(caminho: str, quantidade: int, colunar: bool = False) -> float:
+    """carrega o histórico inteiro e divide a memória alocada pelo número de movimentos"""
+    db = DatabaseManager(caminho)
+    db.connect()
+    db.create_tables()
+    gerenciador = GerenciadorEstoque(db, carregamento_preguicoso=True)
+    gerenciador.carregar_dados_do_banco()
+    repositorio = RepositorioHistorico(db, gerenciador.produtos, gerenciador.localizacoes)
+    gc.collect()
+    tracemalloc.start()
+    movimentos = repositorio.carregar_colunar() if colunar else repositorio.carregar_todos()
+    alocado, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(movimentos) == quantidade
+    db.close()
+    return alocado / quantidade
+
+
+def _bytes_por_objeto(classe, valores, quantidade: int = 10_000) -> float:
+    gc.collect()
+    tracemalloc.start()
+    objetos = [classe(*valores) for _ in range(quantidade)]
+    alocado, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objetos
+    return alocado / quantidade
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "bench.db")
+        _popular_banco(caminho, quantidade)
+
+        colunar = _bytes_por_movimento(caminho, quantidade, colunar=True)
+        depois = _bytes_por_movimento(caminho, quantidade)
+        # troca a classe usada pelo carregador pela versão sem slots e mede de novo
+        original = repositorios.HistoricoMovimento
+        repositorios.HistoricoMovimento = _sem_slots(original)
+        try:
+            antes = _bytes_por_movimento(caminho, quantidade)
+        finally:
+            repositorios.HistoricoMovimento = original
+
+    print(f"\nMovimentações carregadas: {quantidade}")
+    print(f"  sem __slots__: {antes:8.1f} bytes por movimento")
+    print(f"  com __slots__: {depois:8.1f} bytes por movimento ({1 - depois / antes:.0%} a menos)")
+    print(f"  colunar:       {colunar:8.1f} bytes por movimento ({antes / colunar:.1f}x menos)")
+
+    # só o objeto de registro (os valores são compartilhados, então não entram na conta)
+    print("\nMemória de cada objeto de registro (sem contar o que ele referencia):")
+    for nome in CLASSES_REGISTRO:
+        classe = getattr(models, nome)
+        valores = [None] * len(dataclasses.fields(classe))
+        print(f"  {nome:<18} {_bytes_por_objeto(_sem_slots(classe), valores):6.1f} -> "
+              f"{_bytes_por_objeto(classe, valores):6.1f} bytes")
+
+if __name__ == "__main__":
+    main()
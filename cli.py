@@ -6,10 +6,11 @@
 # daí vem o nome "peba" do repositório
 
 import os
+import sys
 from datetime import datetime, time
 
-from manager import GerenciadorEstoque
-from models import Produto, Localizacao, OrdemCompra, Devolucao # Para type hints e checagens de instância
+from manager import GerenciadorEstoque, FORMATOS_RELATORIO
+from models import Produto, Localizacao, OrdemCompra, Devolucao, Dinheiro # Para type hints e checagens de instância
 from config import REPORTLAB_DISPONIVEL # Flag para saber se pode gerar PDF
 
 # Condicional para importar o ReportLab apenas se disponível.
@@ -45,7 +46,7 @@ class CliApp:
         print("=" * (len(titulo) + 4))
         print()
 
-    def _obter_input(self, prompt: str, obrigatorio=True, tipo='str') -> str | int | float | None:
+    def _obter_input(self, prompt: str, obrigatorio=True, tipo='str') -> str | int | float | Dinheiro | None:
         """Pede um input ao usuário com validação."""
         while True:
             valor = input(prompt).strip()
@@ -66,6 +67,12 @@ class CliApp:
                     return float(valor.replace(',', '.'))
                 except ValueError:
                     print("Erro: Por favor, insira um número válido (ex: 12.34).")
+            elif tipo == 'dinheiro':
+                try:
+                    # direto do texto pros centavos, sem passar por float
+                    return Dinheiro.de_reais(valor.replace(',', '.'))
+                except (ValueError, ArithmeticError):
+                    print("Erro: Por favor, insira um valor válido (ex: 12.34).")
             else: # str
                 return valor
 
@@ -103,14 +110,16 @@ class CliApp:
     def run(self):
         """Inicia o loop principal da aplicação CLI."""
         while True:
+            # traz o que outros terminais gravaram no banco enquanto este estava num submenu
+            self.gerenciador.recarregar_incremental()
             self._imprimir_cabecalho("Sistema de Gerenciamento de Estoque")
 
             # Dashboard rápido
-            alertas = self.gerenciador.verificar_alertas_ressuprimento()
+            alertas = self.gerenciador.contar_alertas_ressuprimento()
             print(f"Itens Únicos: {len(self.gerenciador.produtos)}")
             print(f"Valor Total do Estoque: R$ {self.gerenciador.calcular_valor_total_estoque():,.2f}")
             if alertas:
-                print(f"\nATENÇÃO: Existem {len(alertas)} produtos com baixo estoque!")
+                print(f"\nATENÇÃO: Existem {alertas} produtos com baixo estoque!")
 
             print("\n--- MENU PRINCIPAL ---")
             print("1. Gerenciar Produtos e Kits")
@@ -309,10 +318,10 @@ class CliApp:
                     self._gerar_relatorio_devolucoes()
                 elif nome_relatorio == "Relatório de Kits Mais Vendidos":
                     self._imprimir_cabecalho(nome_relatorio)
-                    print(self.gerenciador.gerar_relatorio_kits_mais_vendidos())
+                    self._exibir_relatorio(self.gerenciador.linhas_relatorio_kits_mais_vendidos())
                 elif nome_relatorio == "Relatório de Componentes Limitantes de Kits":
                     self._imprimir_cabecalho(nome_relatorio)
-                    print(self.gerenciador.gerar_relatorio_componente_limitante())
+                    self._exibir_relatorio(self.gerenciador.linhas_relatorio_componente_limitante())
                 elif nome_relatorio == "Histórico de Movimentação":
                     self._menu_historico_movimentacoes()
                 elif nome_relatorio == "Relatório de Vendas por Período":
@@ -331,12 +340,14 @@ class CliApp:
             print("1. Por Produto")
             print("2. Por Fornecedor")
             print("3. Por Localização")
+            print("4. Exportar Histórico Completo (CSV/JSON/NDJSON)")
             print("0. Voltar")
 
             escolha = self._obter_input("\nEscolha o tipo de filtro para o histórico: ", tipo='int')
             if escolha == 1: self._exibir_historico_por_produto()
             elif escolha == 2: self._exibir_historico_por_fornecedor()
             elif escolha == 3: self._exibir_historico_por_localizacao()
+            elif escolha == 4: self._exportar_historico_completo(); self._esperar_enter()
             elif escolha == 0: break
             else: print("Opção inválida!"); self._esperar_enter()
 
@@ -345,7 +356,7 @@ class CliApp:
         produto_id = self._selecionar_em_lista("Selecione o produto", self.gerenciador.produtos)
         if produto_id:
             self._imprimir_cabecalho(f"Histórico do Produto: {self.gerenciador.produtos[produto_id].nome}")
-            print(self.gerenciador.gerar_relatorio_movimentacao_item(produto_id))
+            self._exibir_relatorio(self.gerenciador.linhas_relatorio_movimentacao_item(produto_id))
             self._esperar_enter()
 
     def _exibir_historico_por_fornecedor(self):
@@ -354,7 +365,7 @@ class CliApp:
         if fornecedor_id:
             fornecedor = self.gerenciador.fornecedores[fornecedor_id]
             self._imprimir_cabecalho(f"Histórico do Fornecedor: {fornecedor.nome} ({fornecedor.empresa})")
-            print(self.gerenciador.gerar_relatorio_movimentacao_fornecedor(fornecedor_id))
+            self._exibir_relatorio(self.gerenciador.linhas_relatorio_movimentacao_fornecedor(fornecedor_id))
             self._esperar_enter()
     
     def _exibir_historico_por_localizacao(self):
@@ -363,10 +374,25 @@ class CliApp:
         if localizacao_id:
             localizacao = self.gerenciador.localizacoes[localizacao_id]
             self._imprimir_cabecalho(f"Histórico da Localização: {localizacao.nome}")
-            print(self.gerenciador.gerar_relatorio_movimentacao_localizacao(localizacao_id))
+            self._exibir_relatorio(self.gerenciador.linhas_relatorio_movimentacao_localizacao(localizacao_id))
             self._esperar_enter()
 
 
+    def _exportar_historico_completo(self):
+        """Exporta todas as movimentações para um arquivo, escrevendo linha a linha."""
+        formato = (self._obter_input("Formato (csv/json/ndjson) [csv]: ", obrigatorio=False) or 'csv').lower()
+        if formato not in FORMATOS_RELATORIO or formato == 'texto':
+            print("Formato inválido. Operação cancelada.")
+            return
+        filename = self._obter_input("Nome do arquivo: ", obrigatorio=False) or f"historico_movimentacoes.{formato}"
+        try:
+            with open(filename, 'w', encoding='utf-8', newline='') as f:
+                self.gerenciador.exportar_relatorio(self.gerenciador.dados_relatorio_historico_completo(), f, formato)
+            print(f"\nHistórico exportado com sucesso em '{filename}'")
+        except Exception as e:
+            print(f"\nErro ao exportar histórico: {e}")
+
+
     # --- NOVO SUBMENU E MÉTODOS PARA DEVOLUÇÕES E TROCAS ---
     def _menu_devolucoes(self):
         """Exibe o submenu para gerenciamento de devoluções e trocas."""
@@ -466,10 +492,10 @@ class CliApp:
                 print("\nO preço de compra do kit será a soma dos componentes.")
                 print("O ponto de ressuprimento não se aplica diretamente a kits.")
             else:
-                preco_compra = self._obter_input("Preço de Compra: ", tipo='float')
+                preco_compra = self._obter_input("Preço de Compra: ", tipo='dinheiro')
                 ponto_ressuprimento = self._obter_input("Ponto de Ressuprimento (estoque mínimo): ", tipo='int')
 
-            preco_venda = self._obter_input("Preço de Venda: ", tipo='float')
+            preco_venda = self._obter_input("Preço de Venda: ", tipo='dinheiro')
 
 
             novo_produto = self.gerenciador.adicionar_produto(
@@ -525,7 +551,7 @@ class CliApp:
             
             # Preços e ressuprimento
             if p.tipoProduto == 'individual':
-                 preco_compra = self._obter_input(f"Preço Compra [R${p.preco_compra:.2f}]: ", obrigatorio=False, tipo='float') or p.preco_compra
+                 preco_compra = self._obter_input(f"Preço Compra [R${p.preco_compra:.2f}]: ", obrigatorio=False, tipo='dinheiro') or p.preco_compra
                  ponto_ressuprimento = self._obter_input(f"Ponto Ressupr. [{p.ponto_ressuprimento}]: ", obrigatorio=False, tipo='int') or p.ponto_ressuprimento
             else:
                 # Mantém os valores zerados para kits, pois são calculados
@@ -533,7 +559,7 @@ class CliApp:
                 ponto_ressuprimento = p.ponto_ressuprimento
                 print(f"Preço de compra de kit é calculado: R$ {p.preco_compra:,.2f}")
 
-            preco_venda = self._obter_input(f"Preço Venda [R${p.preco_venda:.2f}]: ", obrigatorio=False, tipo='float') or p.preco_venda
+            preco_venda = self._obter_input(f"Preço Venda [R${p.preco_venda:.2f}]: ", obrigatorio=False, tipo='dinheiro') or p.preco_venda
             
             dados = {
                 'nome': nome, 'descricao': descricao, 'categoria': categoria, 'codigo_barras': codigo_barras,
@@ -830,7 +856,7 @@ class CliApp:
                 print(f"Cliente: {nome_cliente}")
 
                 # Exibe o carrinho de compras atual
-                total_parcial = 0
+                total_parcial = Dinheiro()
                 if itens_venda:
                     print("\n--- Carrinho Atual ---")
                     for item in itens_venda:
@@ -1147,19 +1173,25 @@ class CliApp:
             print(f"\nErro ao salvar PDF: {e}")
 
     # Relatórios
+    def _exibir_relatorio(self, linhas):
+        """escreve o relatório no terminal pedaço por pedaço, sem montar o texto inteiro antes"""
+        for pedaco in linhas:
+            sys.stdout.write(pedaco)
+        sys.stdout.write("\n")
+
     def _gerar_relatorio_detalhado(self, tipo_relatorio):
         """Chama a função de geração de relatório correspondente no gerenciador e exibe o resultado."""
         self._imprimir_cabecalho(f"Relatório: {tipo_relatorio}")
-        report_text = ""
+        linhas = ()
         try:
             if tipo_relatorio == "Inventário Completo (Simplificado)":
-                report_text = self.gerenciador.gerar_relatorio_estoque_simplificado()
+                linhas = self.gerenciador.linhas_relatorio_estoque_simplificado()
             elif tipo_relatorio == "Valor Total do Inventário":
-                report_text = self.gerenciador.gerar_relatorio_valor_total()
+                linhas = self.gerenciador.linhas_relatorio_valor_total()
             elif tipo_relatorio == "Produtos com Baixo Estoque":
-                report_text = self.gerenciador.gerar_relatorio_baixo_estoque()
+                linhas = self.gerenciador.linhas_relatorio_baixo_estoque()
             elif tipo_relatorio == "Produtos Mais Vendidos":
-                report_text = self.gerenciador.gerar_relatorio_mais_vendidos()
+                linhas = self.gerenciador.linhas_relatorio_mais_vendidos()
             elif tipo_relatorio == "Relatório de Vendas por Período":
                 self._gerar_relatorio_vendas_por_periodo()
                 return
@@ -1167,7 +1199,7 @@ class CliApp:
                 self._gerar_relatorio_devolucoes()
                 return
             
-            print(report_text)
+            self._exibir_relatorio(linhas)
         except Exception as e:
             print(f"Erro ao gerar relatório: {e}")
 
@@ -1313,8 +1345,7 @@ class CliApp:
     def _gerar_relatorio_devolucoes(self):
         """chama o relatório de devoluções"""
         self._imprimir_cabecalho("Relatório de Devoluções por Motivo")
-        report = self.gerenciador.gerar_relatorio_devolucoes_por_motivo()
-        print(report)
+        self._exibir_relatorio(self.gerenciador.linhas_relatorio_devolucoes_por_motivo())
 
     def _gerar_relatorio_vendas_por_periodo(self):
         """Método para solicitar e gerar o relatório de vendas por período."""
@@ -1325,7 +1356,7 @@ class CliApp:
                 data_inicio = datetime.strptime(str_inicio, "%d/%m/%Y")
                 data_fim = datetime.combine(datetime.strptime(str_fim, "%d/%m/%Y"), time.max)
                 self._imprimir_cabecalho("Relatório de Vendas por Período")
-                print(self.gerenciador.gerar_relatorio_vendas_periodo(data_inicio, data_fim))
+                self._exibir_relatorio(self.gerenciador.linhas_relatorio_vendas_periodo(data_inicio, data_fim))
             else:
                 print("Datas inválidas. Operação cancelada.")
         except ValueError as e:
@@ -2,12 +2,81 @@
 # config.py
 # contém as variáveis de configuração e constantes do projeto.
 
+import os
 import sys
 
 # --- Constantes de Configuração ---
 
 DB_FILE = "estoque_database.db"
 
+# Carregamento preguiçoso: com ESTOQUE_CARREGAMENTO_PREGUICOSO=1 o histórico, as vendas, as OCs e as devoluções
+# não são carregados na inicialização, e sim lidos do banco aos poucos quando alguém precisa deles
+CARREGAMENTO_PREGUICOSO = os.environ.get("ESTOQUE_CARREGAMENTO_PREGUICOSO", "0").strip().lower() in ("1", "true", "sim")
+
+# Snapshot de inicialização: ao sair normalmente, o estado carregado em memória é gravado ao lado do banco
+# e reaproveitado na próxima abertura se o banco não mudou desde então. ESTOQUE_SNAPSHOT=0 desliga.
+USAR_SNAPSHOT = os.environ.get("ESTOQUE_SNAPSHOT", "1").strip().lower() in ("1", "true", "sim")
+ARQUIVO_SNAPSHOT = DB_FILE + ".snapshot"
+
+# --- Perfil de Desempenho do SQLite ---
+
+# cada perfil é um conjunto de PRAGMAs que o DatabaseManager aplica ao conectar
+# cache_size negativo = tamanho em KiB (ex: -65536 = 64 MB), mmap_size em bytes, busy_timeout em ms
+PERFIS_SQLITE = {
+    # nada de perder venda: fsync a cada commit, cache padrão e sem mmap
+    "durable": {
+        "journal_mode": "WAL", "synchronous": "FULL", "cache_size": -2000,
+        "mmap_size": 0, "temp_store": "DEFAULT", "busy_timeout": 5000,
+    },
+    # o dia a dia do PDV: com WAL, NORMAL só pode perder o último commit se faltar energia
+    "balanced": {
+        "journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -65536,
+        "mmap_size": 268435456, "temp_store": "MEMORY", "busy_timeout": 5000,
+    },
+    # importações e cargas grandes, quando dá pra refazer a carga se algo der errado
+    "bulk-load": {
+        "journal_mode": "WAL", "synchronous": "OFF", "cache_size": -262144,
+        "mmap_size": 1073741824, "temp_store": "MEMORY", "busy_timeout": 30000,
+    },
+}
+
+# perfil usado quando nenhum é informado; pode ser trocado pela variável de ambiente ESTOQUE_SQLITE_PERFIL
+PERFIL_SQLITE_PADRAO = os.environ.get("ESTOQUE_SQLITE_PERFIL", "balanced")
+
+# valores aceitos para os PRAGMAs de texto (eles vão direto para o SQL, então não dá pra aceitar qualquer coisa)
+_VALORES_VALIDOS_SQLITE = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+
+
+def obter_perfil_sqlite(nome: str | None = None) -> dict:
+    """
+    Retorna os PRAGMAs do perfil pedido (ou do padrão), já com as sobrescritas das variáveis
+    de ambiente ESTOQUE_SQLITE_<PRAGMA>, ex: ESTOQUE_SQLITE_SYNCHRONOUS=FULL.
+    """
+    nome = nome or PERFIL_SQLITE_PADRAO
+    if nome not in PERFIS_SQLITE:
+        raise ValueError(f"Perfil SQLite '{nome}' não existe. Perfis válidos: {', '.join(PERFIS_SQLITE)}")
+
+    perfil = dict(PERFIS_SQLITE[nome])
+    for pragma, valor_padrao in perfil.items():
+        valor_env = os.environ.get(f"ESTOQUE_SQLITE_{pragma.upper()}")
+        if valor_env is None:
+            continue
+        if isinstance(valor_padrao, int):
+            try:
+                perfil[pragma] = int(valor_env)
+            except ValueError:
+                raise ValueError(f"ESTOQUE_SQLITE_{pragma.upper()} deve ser um número inteiro.")
+        else:
+            valor_env = valor_env.strip().upper()
+            if valor_env not in _VALORES_VALIDOS_SQLITE[pragma]:
+                raise ValueError(f"Valor inválido para ESTOQUE_SQLITE_{pragma.upper()}: '{valor_env}'.")
+            perfil[pragma] = valor_env
+    return perfil
+
 # --- Verificação de Dependências Opcionais ---
 
 # nisso aqui vamos tentar import o ReportLab, se não der certo, vamos deixar a variável REPORTLAB_DISPONIVEL como False
@@ -21,3 +90,11 @@ except ImportError:
     # se caso o ReportLab não esteja instalado, define a flag como False
     # o programa vai rodar normal, só vai desabilitar a opção de salvar pdf (sim, temos uma)
     REPORTLAB_DISPONIVEL = False
+
+# NumPy é opcional: se estiver instalado, o histórico colunar (repositorios.HistoricoColunar) usa ele
+# para filtrar e somar as colunas de uma vez; sem ele, as mesmas contas são feitas em Python puro
+try:
+    import numpy
+    NUMPY_DISPONIVEL = True
+except ImportError:
+    NUMPY_DISPONIVEL = False
@@ -3,31 +3,492 @@
 
 import sqlite3
 import sys
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from config import obter_perfil_sqlite
+from models import Dinheiro, TipoMovimento, classificar_tipo_movimento, nome_local_transferencia, para_epoca
+
+# Dinheiro passado como parâmetro de query vai pro banco em centavos (as colunas de dinheiro são INTEGER desde a versão 8)
+sqlite3.register_adapter(Dinheiro, lambda valor: valor.centavos)
+
+# --- Migrações de Esquema ---
+
+# O esquema base é o que create_tables() cria (versão 0). Cada migração leva o banco da versão
+# anterior para a sua, e a versão aplicada fica gravada no próprio arquivo em PRAGMA user_version.
+# Assim um estoque_database.db antigo é atualizado no lugar, sem perder dados.
+# Para mudar o esquema: adicione uma nova entrada no FIM de MIGRACOES, nunca edite uma que já foi lançada.
+
+def _migracao_indices_consultas(cursor):
+    """índices secundários para as colunas usadas em filtros, ordenações e chaves estrangeiras"""
+    indices = [
+        # histórico: extratos por produto/localização ordenados por data, e filtros por período
+        "CREATE INDEX IF NOT EXISTS idx_historico_produto_data ON historico_movimentos (produto_id, data)",
+        "CREATE INDEX IF NOT EXISTS idx_historico_localizacao_data ON historico_movimentos (localizacao_id, data)",
+        "CREATE INDEX IF NOT EXISTS idx_historico_data ON historico_movimentos (data)",
+        # itens pelo cabeçalho
+        "CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_ordem_compra_ordem ON itens_ordem_compra (ordem_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_devolucao_devolucao ON itens_devolucao (devolucao_id)",
+        "CREATE INDEX IF NOT EXISTS idx_transacoes_devolucao ON transacoes (devolucao_id)",
+        # vendas por período
+        "CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data)",
+        # colunas filhas de ON DELETE CASCADE; sem índice, apagar um produto varre essas tabelas inteiras
+        "CREATE INDEX IF NOT EXISTS idx_produtos_fornecedor ON produtos (fornecedor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_componentes_kit_componente ON componentes_kit (componente_produto_id)",
+        "CREATE INDEX IF NOT EXISTS idx_estoque_localizacao ON estoque (localizacao_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_venda_produto ON itens_venda (produto_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_ordem_compra_produto ON itens_ordem_compra (produto_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_devolucao_produto ON itens_devolucao (produto_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ordens_compra_fornecedor ON ordens_compra (fornecedor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_devolucoes_venda ON devolucoes (venda_original_id)",
+    ]
+    for query in indices:
+        cursor.execute(query)
+
+
+def _migracao_codigo_barras_unico(cursor):
+    """código de barras único (ignorando espaços nas pontas); vazio e 'N/A' significam 'sem código' e podem repetir"""
+    duplicados = cursor.execute(
+        """SELECT trim(codigo_barras), COUNT(*) FROM produtos
+           WHERE trim(codigo_barras) NOT IN ('', 'N/A')
+           GROUP BY trim(codigo_barras) HAVING COUNT(*) > 1"""
+    ).fetchall()
+    if duplicados:
+        lista = ", ".join(f"'{codigo}' ({qtd}x)" for codigo, qtd in duplicados)
+        raise sqlite3.IntegrityError(f"Existem códigos de barras repetidos no cadastro: {lista}. Corrija-os antes de atualizar o banco.")
+    cursor.execute(
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_codigo_barras ON produtos (trim(codigo_barras))
+           WHERE trim(codigo_barras) NOT IN ('', 'N/A')"""
+    )
+
+
+# tabelas de dados do sistema; toda escrita nelas conta como alteração do banco
+TABELAS_DADOS = (
+    "fornecedores", "localizacoes", "produtos", "componentes_kit", "estoque", "historico_movimentos",
+    "ordens_compra", "itens_ordem_compra", "vendas", "itens_venda", "devolucoes", "itens_devolucao", "transacoes",
+)
+
+
+def _migracao_contador_alteracoes(cursor):
+    """contador de alterações mantido por triggers; junto com a versão do esquema forma a impressão digital do banco"""
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS controle_alteracoes (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               contador INTEGER NOT NULL
+           )"""
+    )
+    cursor.execute("INSERT OR IGNORE INTO controle_alteracoes (id, contador) VALUES (1, 0)")
+    # qualquer INSERT/UPDATE/DELETE, venha do programa ou de fora dele (sqlite3 na mão, script), incrementa o contador
+    for tabela in TABELAS_DADOS:
+        for operacao in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS trg_contador_{tabela}_{operacao.lower()}
+                    AFTER {operacao} ON {tabela}
+                    BEGIN
+                        UPDATE controle_alteracoes SET contador = contador + 1 WHERE id = 1;
+                    END"""
+            )
+
+
+# tabela -> (entidade que ela compõe, coluna com o id dessa entidade); itens, estoque e componentes
+# são registrados pelo id do "dono", porque é ele que precisa ser relido na recarga incremental
+ENTIDADES_LOG_ALTERACOES = {
+    "fornecedores": ("fornecedor", "id"),
+    "localizacoes": ("localizacao", "id"),
+    "produtos": ("produto", "id"),
+    "estoque": ("estoque", "produto_id"),
+    "componentes_kit": ("kit", "kit_produto_id"),
+    "historico_movimentos": ("historico", "id"),
+    "ordens_compra": ("ordem_compra", "id"),
+    "itens_ordem_compra": ("ordem_compra", "ordem_id"),
+    "vendas": ("venda", "id"),
+    "itens_venda": ("venda", "venda_id"),
+    "devolucoes": ("devolucao", "id"),
+    "itens_devolucao": ("devolucao", "devolucao_id"),
+    "transacoes": ("devolucao", "devolucao_id"),
+}
+
+# quantas entradas do log são mantidas; quem ficar mais atrasado que isso faz uma recarga completa
+TAMANHO_LOG_ALTERACOES = 100000
+
+
+def _migracao_log_alteracoes(cursor):
+    """log de alterações por entidade, alimentado por triggers, para a recarga incremental"""
+    # AUTOINCREMENT garante que seq nunca é reaproveitado, então "tudo depois de seq X" é sempre confiável
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS log_alteracoes (
+               seq INTEGER PRIMARY KEY AUTOINCREMENT,
+               entidade TEXT NOT NULL,
+               chave INTEGER NOT NULL
+           )"""
+    )
+    for tabela, (entidade, coluna) in ENTIDADES_LOG_ALTERACOES.items():
+        acoes = {
+            "INSERT": f"INSERT INTO log_alteracoes (entidade, chave) VALUES ('{entidade}', NEW.{coluna});",
+            "DELETE": f"INSERT INTO log_alteracoes (entidade, chave) VALUES ('{entidade}', OLD.{coluna});",
+            # se o UPDATE trocou o dono (ex: item mudou de venda), os dois precisam ser relidos
+            "UPDATE": f"""INSERT INTO log_alteracoes (entidade, chave)
+                          SELECT '{entidade}', NEW.{coluna} UNION SELECT '{entidade}', OLD.{coluna};""",
+        }
+        for operacao, acao in acoes.items():
+            cursor.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS trg_log_{tabela}_{operacao.lower()}
+                    AFTER {operacao} ON {tabela}
+                    BEGIN
+                        {acao}
+                    END"""
+            )
+    # poda o log de tempos em tempos pra ele não crescer pra sempre
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS trg_log_alteracoes_poda
+            AFTER INSERT ON log_alteracoes WHEN NEW.seq % 1000 = 0
+            BEGIN
+                DELETE FROM log_alteracoes WHERE seq <= NEW.seq - {int(TAMANHO_LOG_ALTERACOES)};
+            END"""
+    )
+
+
+# custo de uma unidade do produto `p` com os preços que estão no banco: o preço de compra, ou nos kits a
+# soma dos componentes (o preco_compra gravado de um kit pode estar zerado), como o registrar_venda faz
+SQL_CUSTO_ATUAL_PRODUTO = """CASE WHEN p.tipo_produto = 'kit' THEN
+        COALESCE((SELECT SUM(ck.quantidade * c.preco_compra) FROM componentes_kit ck
+                  JOIN produtos c ON c.id = ck.componente_produto_id WHERE ck.kit_produto_id = p.id), 0)
+    ELSE p.preco_compra END"""
+
+# preço unitário pelo qual o item devolvido `idv` (da devolução `d`) foi vendido; se a venda original
+# não tiver o item, cai no preço de venda atual (a mesma regra de Venda.preco_vendido em models)
+SQL_PRECO_VENDIDO_DEVOLUCAO = """COALESCE((SELECT iv.preco_venda_unitario FROM itens_venda iv
+        WHERE iv.venda_id = d.venda_original_id AND iv.produto_id = idv.produto_id ORDER BY iv.rowid LIMIT 1),
+    p.preco_venda)"""
+
+
+def _migracao_resumo_vendas_diario(cursor):
+    """resumos diários de vendas e devoluções por produto e por localização, já preenchidos com o histórico existente"""
+    # a venda passa a guardar de qual localização saiu; as antigas descobrem isso pelo histórico de movimentos
+    colunas_vendas = [linha[1] for linha in cursor.execute("PRAGMA table_info(vendas)").fetchall()]
+    if "localizacao_id" not in colunas_vendas:
+        cursor.execute("ALTER TABLE vendas ADD COLUMN localizacao_id INTEGER REFERENCES localizacoes(id)")
+    # o texto do tipo é lido pelo classificar_tipo_movimento de models, o mesmo das movimentações novas
+    local_da_venda, local_da_devolucao = {}, {}
+    for tipo, localizacao_id in cursor.execute("SELECT tipo, localizacao_id FROM historico_movimentos").fetchall():
+        codigo, documento_id = classificar_tipo_movimento(tipo)
+        if documento_id is None:
+            continue
+        if codigo in (TipoMovimento.VENDA, TipoMovimento.VENDA_COMPONENTE_KIT):
+            local_da_venda.setdefault(documento_id, localizacao_id)
+        elif codigo in (TipoMovimento.DEVOLUCAO, TipoMovimento.DEVOLUCAO_COMPONENTE_KIT):
+            local_da_devolucao.setdefault(documento_id, localizacao_id)
+    cursor.executemany("UPDATE vendas SET localizacao_id = ? WHERE id = ? AND localizacao_id IS NULL",
+                       [(localizacao_id, venda_id) for venda_id, localizacao_id in local_da_venda.items()])
+
+    for chave, referencia in (("produto_id", "produtos"), ("localizacao_id", "localizacoes")):
+        tabela = "resumo_vendas_diario_produto" if chave == "produto_id" else "resumo_vendas_diario_local"
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {tabela} (
+                   dia TEXT NOT NULL,
+                   {chave} INTEGER NOT NULL,
+                   quantidade INTEGER NOT NULL DEFAULT 0,
+                   receita REAL NOT NULL DEFAULT 0,
+                   custo REAL NOT NULL DEFAULT 0,
+                   quantidade_devolvida INTEGER NOT NULL DEFAULT 0,
+                   valor_devolvido REAL NOT NULL DEFAULT 0,
+                   PRIMARY KEY (dia, {chave}),
+                   FOREIGN KEY ({chave}) REFERENCES {referencia} (id) ON DELETE CASCADE
+               )"""
+        )
+
+    # vendas: o banco não guarda o custo do momento das vendas antigas, então elas entram com os preços de
+    # compra do momento da migração (kits pela soma dos componentes, igual às vendas feitas depois)
+    cursor.execute(
+        f"""INSERT INTO resumo_vendas_diario_produto (dia, produto_id, quantidade, receita, custo)
+            SELECT substr(v.data, 1, 10), iv.produto_id, SUM(iv.quantidade),
+                   SUM(iv.quantidade * iv.preco_venda_unitario), SUM(iv.quantidade * ({SQL_CUSTO_ATUAL_PRODUTO}))
+            FROM itens_venda iv JOIN vendas v ON v.id = iv.venda_id JOIN produtos p ON p.id = iv.produto_id
+            GROUP BY 1, 2"""
+    )
+    cursor.execute(
+        f"""INSERT INTO resumo_vendas_diario_local (dia, localizacao_id, quantidade, receita, custo)
+            SELECT substr(v.data, 1, 10), v.localizacao_id, SUM(iv.quantidade),
+                   SUM(iv.quantidade * iv.preco_venda_unitario), SUM(iv.quantidade * ({SQL_CUSTO_ATUAL_PRODUTO}))
+            FROM itens_venda iv JOIN vendas v ON v.id = iv.venda_id JOIN produtos p ON p.id = iv.produto_id
+            WHERE v.localizacao_id IN (SELECT id FROM localizacoes)
+            GROUP BY 1, 2"""
+    )
+
+    # devoluções concluídas entram no dia em que foram processadas (data da transação financeira),
+    # valendo o preço pelo qual o item foi vendido
+    devolvidos = cursor.execute(
+        f"""SELECT d.id, substr(COALESCE((SELECT MIN(t.data) FROM transacoes t WHERE t.devolucao_id = d.id), d.data), 1, 10),
+                  idv.produto_id, idv.quantidade, idv.quantidade * {SQL_PRECO_VENDIDO_DEVOLUCAO}
+           FROM itens_devolucao idv JOIN devolucoes d ON d.id = idv.devolucao_id
+           JOIN produtos p ON p.id = idv.produto_id
+           WHERE d.status = 'concluida'"""
+    ).fetchall()
+    upsert = """INSERT INTO {tabela} (dia, {chave}, quantidade_devolvida, valor_devolvido) VALUES (?, ?, ?, ?)
+                ON CONFLICT(dia, {chave}) DO UPDATE SET
+                    quantidade_devolvida = quantidade_devolvida + excluded.quantidade_devolvida,
+                    valor_devolvido = valor_devolvido + excluded.valor_devolvido"""
+    cursor.executemany(upsert.format(tabela="resumo_vendas_diario_produto", chave="produto_id"),
+                       [(dia, produto_id, qtd, valor) for _, dia, produto_id, qtd, valor in devolvidos])
+    locais_existentes = {linha[0] for linha in cursor.execute("SELECT id FROM localizacoes").fetchall()}
+    cursor.executemany(upsert.format(tabela="resumo_vendas_diario_local", chave="localizacao_id"),
+                       [(dia, local_da_devolucao[dev_id], qtd, valor) for dev_id, dia, _, qtd, valor in devolvidos
+                        if local_da_devolucao.get(dev_id) in locais_existentes])
+
+
+def _migracao_tipo_movimento_codificado(cursor):
+    """código do tipo de movimento e id do documento de origem no histórico, preenchidos a partir do texto"""
+    colunas = [linha[1] for linha in cursor.execute("PRAGMA table_info(historico_movimentos)").fetchall()]
+    if "tipo_codigo" not in colunas:
+        cursor.execute("ALTER TABLE historico_movimentos ADD COLUMN tipo_codigo INTEGER NOT NULL DEFAULT 0")
+    if "documento_id" not in colunas:
+        cursor.execute("ALTER TABLE historico_movimentos ADD COLUMN documento_id INTEGER")
+
+    # as regras são as de models.classificar_tipo_movimento, as mesmas das movimentações gravadas pelo
+    # programa, então um prefixo novo vale igual pras linhas migradas e pras novas.
+    # Nas transferências o "documento" é a localização do outro lado, que o texto só traz pelo nome
+    locais_por_nome = dict(cursor.execute("SELECT nome, id FROM localizacoes").fetchall())
+    classificados = {}
+
+    def classificar(tipo):
+        codigo, documento_id = classificar_tipo_movimento(tipo)
+        if (nome_local := nome_local_transferencia(tipo)) is not None:
+            documento_id = locais_por_nome.get(nome_local)
+        return int(codigo), documento_id
+
+    # atualiza pelo id (a coluna tipo não tem índice); textos repetidos, como "Carga Inicial", são classificados uma vez
+    atualizacoes = []
+    for movimento_id, tipo in cursor.execute("SELECT id, tipo FROM historico_movimentos").fetchall():
+        if tipo not in classificados:
+            classificados[tipo] = classificar(tipo)
+        codigo, documento_id = classificados[tipo]
+        if codigo:
+            atualizacoes.append((codigo, documento_id, movimento_id))
+    cursor.executemany("UPDATE historico_movimentos SET tipo_codigo = ?, documento_id = ? WHERE id = ?", atualizacoes)
+
+    # agrupar por tipo e achar os movimentos de uma venda/OC/devolução passam a usar índice em vez de LIKE
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_tipo_documento ON historico_movimentos (tipo_codigo, documento_id)")
+
+
+# colunas de data que deixam de ser texto ISO e passam a ser inteiro: microssegundos desde 1970-01-01 UTC
+COLUNAS_DATA = (
+    ("historico_movimentos", "data"), ("vendas", "data"), ("ordens_compra", "data_criacao"),
+    ("devolucoes", "data"), ("transacoes", "data"),
+)
+
+
+def _substituir_coluna(cursor, tabela: str, coluna: str, definicao: str, converter):
+    """
+    troca o tipo de uma coluna no lugar: cria a nova ao lado, preenche com converter(valor antigo),
+    apaga a antiga e dá o nome dela à nova. DROP TABLE/RENAME TABLE mexeriam nas chaves estrangeiras
+    (e no ON DELETE CASCADE dos filhos), por isso não dá pra recriar a tabela
+    """
+    # os índices que usam a coluna saem antes do DROP COLUMN e voltam iguais depois
+    indices = [(nome, sql) for nome, sql in cursor.execute(
+                   "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (tabela,)
+               ).fetchall()
+               if any(info[2] == coluna for info in cursor.execute(f"PRAGMA index_info({nome})").fetchall())]
+    nova = f"{coluna}_nova"
+    cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {nova} {definicao}")
+    cursor.executemany(f"UPDATE {tabela} SET {nova} = ? WHERE rowid = ?",
+                       [(converter(valor), rowid)
+                        for rowid, valor in cursor.execute(f"SELECT rowid, {coluna} FROM {tabela}").fetchall()])
+    for nome, _ in indices:
+        cursor.execute(f"DROP INDEX {nome}")
+    cursor.execute(f"ALTER TABLE {tabela} DROP COLUMN {coluna}")
+    cursor.execute(f"ALTER TABLE {tabela} RENAME COLUMN {nova} TO {coluna}")
+    for _, sql in indices:
+        cursor.execute(sql)
+
+
+def _suspender_triggers_update(cursor, tabela: str):
+    """
+    a troca de formato não é alteração de dados: sem os triggers de UPDATE o log_alteracoes não recebe
+    uma linha por registro (a versão do esquema já muda a impressão digital do banco). Quem chama
+    recria os triggers no fim com _migracao_contador_alteracoes e _migracao_log_alteracoes
+    """
+    for trigger in (f"trg_contador_{tabela}_update", f"trg_log_{tabela}_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def _tipo_coluna(cursor, tabela: str, coluna: str) -> str:
+    return {linha[1]: linha[2] for linha in cursor.execute(f"PRAGMA table_info({tabela})").fetchall()}[coluna].upper()
+
+
+def _migracao_datas_epoca(cursor):
+    """datas em inteiro (microssegundos UTC): filtros por período viram comparação de inteiros no índice"""
+    for tabela, coluna in COLUNAS_DATA:
+        if _tipo_coluna(cursor, tabela, coluna) == "INTEGER":
+            continue
+        _suspender_triggers_update(cursor, tabela)
+        # o texto gravado pelo programa era o datetime.now().isoformat() (horário local sem fuso),
+        # e o para_epoca de models é o mesmo que converte as datas novas
+        _substituir_coluna(cursor, tabela, coluna, "INTEGER NOT NULL DEFAULT 0",
+                           lambda texto: para_epoca(datetime.fromisoformat(texto)))
+    # recria os triggers de UPDATE que saíram (os dois são IF NOT EXISTS, então o resto fica como está)
+    _migracao_contador_alteracoes(cursor)
+    _migracao_log_alteracoes(cursor)
+
+
+# colunas de dinheiro; a partir da versão 8 guardam centavos inteiros
+COLUNAS_DINHEIRO = (
+    ("produtos", "preco_compra"),
+    ("produtos", "preco_venda"),
+    ("itens_ordem_compra", "preco_unitario"),
+    ("itens_venda", "preco_venda_unitario"),
+    ("transacoes", "valor"),
+    ("resumo_vendas_diario_produto", "receita"),
+    ("resumo_vendas_diario_produto", "custo"),
+    ("resumo_vendas_diario_produto", "valor_devolvido"),
+    ("resumo_vendas_diario_local", "receita"),
+    ("resumo_vendas_diario_local", "custo"),
+    ("resumo_vendas_diario_local", "valor_devolvido"),
+)
+
+
+def _reais_para_centavos(valor) -> int:
+    """arredonda como as contas de dinheiro do programa (meio centavo pra cima), pelo texto do float e não pelo binário"""
+    return int((Decimal(str(valor)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _migracao_dinheiro_centavos(cursor):
+    """preços, valores e somas dos resumos em centavos inteiros: SUM no banco e nas contas em memória sem erro de float"""
+    for tabela, coluna in COLUNAS_DINHEIRO:
+        if _tipo_coluna(cursor, tabela, coluna) == "INTEGER":
+            continue
+        _suspender_triggers_update(cursor, tabela)
+        _substituir_coluna(cursor, tabela, coluna, "INTEGER NOT NULL DEFAULT 0", _reais_para_centavos)
+    _migracao_contador_alteracoes(cursor)
+    _migracao_log_alteracoes(cursor)
+
+
+def _migracao_custo_itens_venda(cursor):
+    """
+    itens_venda.custo_unitario: o custo congelado no momento da venda, o mesmo que vai pros resumos diários.
+    As vendas já gravadas recebem os preços de compra do momento da migração (o banco não sabe os de antes)
+    """
+    colunas = [linha[1] for linha in cursor.execute("PRAGMA table_info(itens_venda)").fetchall()]
+    if "custo_unitario" in colunas:
+        return
+    cursor.execute("ALTER TABLE itens_venda ADD COLUMN custo_unitario INTEGER NOT NULL DEFAULT 0")
+    _suspender_triggers_update(cursor, "itens_venda")
+    cursor.execute(
+        f"""UPDATE itens_venda SET custo_unitario = (
+                SELECT {SQL_CUSTO_ATUAL_PRODUTO} FROM produtos p WHERE p.id = itens_venda.produto_id)
+            WHERE produto_id IN (SELECT id FROM produtos)"""
+    )
+    _migracao_contador_alteracoes(cursor)
+    _migracao_log_alteracoes(cursor)
+
+
+# (versão, descrição, função que recebe o cursor)
+MIGRACOES = [
+    (1, "índices nas colunas de consulta", _migracao_indices_consultas),
+    (2, "índice único de código de barras", _migracao_codigo_barras_unico),
+    (3, "contador de alterações", _migracao_contador_alteracoes),
+    (4, "log de alterações", _migracao_log_alteracoes),
+    (5, "resumos diários de vendas", _migracao_resumo_vendas_diario),
+    (6, "tipo de movimento codificado", _migracao_tipo_movimento_codificado),
+    (7, "datas em microssegundos desde 1970 (UTC)", _migracao_datas_epoca),
+    (8, "dinheiro em centavos", _migracao_dinheiro_centavos),
+    (9, "custo unitário nos itens de venda", _migracao_custo_itens_venda),
+]
 
 # --- Classe de Gerenciamento do Banco de Dados ---
 
 class DatabaseManager:
     """aqui a gente vai gerenciar nossa conexão com o diabo do banco de dados"""
-    def __init__(self, db_file):
+    def __init__(self, db_file, perfil: str | None = None):
         self.db_file = db_file
+        # nome do perfil de desempenho (ver PERFIS_SQLITE em config.py); None = perfil padrão
+        self.perfil = perfil
         self.conn = None
         self.cursor = None
+        # profundidade das transações abertas (0 = fora de transação, >1 = savepoints aninhados)
+        self._nivel_transacao = 0
+        # callbacks para desfazer alterações em memória, um nível da pilha por transação/savepoint
+        self._desfazer: list[list] = []
 
     def connect(self):
         """Estabelece a conexão com o banco de dados SQLite"""
         try:
-            self.conn = sqlite3.connect(self.db_file)
+            # isolation_level=None desliga o BEGIN implícito do módulo sqlite3,
+            # quem controla as transações agora é o método transacao()
+            self.conn = sqlite3.connect(self.db_file, isolation_level=None)
             self.conn.execute("PRAGMA foreign_keys = ON;") # pra garantir que as chaves estrangeiras funcionem
+            self._aplicar_perfil(obter_perfil_sqlite(self.perfil))
             self.cursor = self.conn.cursor()
         except sqlite3.Error as e:
             print(f"Erro ao conectar ao banco de dados: {e}")
             sys.exit(1)
 
+    def _aplicar_perfil(self, perfil: dict):
+        """aplica os PRAGMAs de desempenho do perfil (journal, synchronous, cache, mmap, temp_store, busy_timeout)"""
+        # busy_timeout primeiro: trocar o journal_mode para WAL precisa de lock no arquivo
+        self.conn.execute(f"PRAGMA busy_timeout = {int(perfil['busy_timeout'])};")
+        self.conn.execute(f"PRAGMA journal_mode = {perfil['journal_mode']};")
+        self.conn.execute(f"PRAGMA synchronous = {perfil['synchronous']};")
+        self.conn.execute(f"PRAGMA cache_size = {int(perfil['cache_size'])};")
+        self.conn.execute(f"PRAGMA mmap_size = {int(perfil['mmap_size'])};")
+        self.conn.execute(f"PRAGMA temp_store = {perfil['temp_store']};")
+
     def close(self):
         """fecha o satanas da conexão com o banco de dados, isso se estiver aberta ainda"""
         if self.conn:
             self.conn.close()
 
+    @property
+    def em_transacao(self) -> bool:
+        """True se existe uma transação (unidade de trabalho) aberta"""
+        return self._nivel_transacao > 0
+
+    @contextmanager
+    def transacao(self):
+        """
+        Unidade de trabalho: tudo que for executado dentro do bloco 'with' vira um único commit.
+        Pode ser aninhada; os níveis internos viram SAVEPOINTs, então um erro num nível interno
+        desfaz só aquele pedaço (se a exceção for tratada por quem chamou).
+        Se o bloco levantar exceção, o banco volta ao estado anterior e os callbacks de
+        desfazer registrados com registrar_desfazer() são executados em ordem reversa.
+        """
+        nivel = self._nivel_transacao
+        savepoint = f"sp_nivel_{nivel}"
+        if nivel == 0:
+            self.conn.execute("BEGIN")
+        else:
+            self.conn.execute(f"SAVEPOINT {savepoint}")
+        self._nivel_transacao += 1
+        self._desfazer.append([])
+        try:
+            yield self
+        except BaseException:
+            self._nivel_transacao -= 1
+            callbacks = self._desfazer.pop()
+            if nivel == 0:
+                self.conn.rollback()
+            else:
+                self.conn.execute(f"ROLLBACK TO {savepoint}")
+                self.conn.execute(f"RELEASE {savepoint}")
+            for callback in reversed(callbacks):
+                callback()
+            raise
+        else:
+            self._nivel_transacao -= 1
+            callbacks = self._desfazer.pop()
+            if nivel == 0:
+                self.conn.commit()
+            else:
+                self.conn.execute(f"RELEASE {savepoint}")
+                # se a transação de fora falhar depois, esses callbacks ainda precisam rodar
+                self._desfazer[-1].extend(callbacks)
+
+    def registrar_desfazer(self, callback):
+        """registra uma função que desfaz uma alteração em memória caso a transação atual sofra rollback"""
+        if self._desfazer:
+            self._desfazer[-1].append(callback)
+
     def execute_query(self, query, params=(), fetch=None):
         """se for preciso, executa uma query no banco de dados e retorna o resultado"""
         try:
@@ -36,16 +497,44 @@ class DatabaseManager:
                 return self.cursor.fetchone()
             if fetch == 'all':
                 return self.cursor.fetchall()
-            # se não for uma query de busca , faz o commit das alterações
-            self.conn.commit()
+            # se não for uma query de busca e não estivermos numa transação, faz o commit das alterações
+            # (dentro de uma transação o commit só acontece no fim do bloco 'with db.transacao()')
+            if not self.em_transacao:
+                self.conn.commit()
             # retorna o ID da última linha inserida, o que pode ser útil para obter o ID de novos registros
             return self.cursor.lastrowid
         except sqlite3.Error as e:
             print(f"Erro ao executar query: {e}")
             print(f"Query: {query}")
+            # dentro de uma transação o erro precisa subir, senão a operação seguiria pela metade
+            if self.em_transacao:
+                raise
             # retonra None em caso de erro para que a lógica da aplicação possa tratar
             return None
 
+    def execute_many(self, query, linhas):
+        """executa a mesma query para uma lista de parâmetros numa única chamada (executemany)"""
+        linhas = list(linhas)
+        if not linhas:
+            return 0
+        try:
+            self.cursor.executemany(query, linhas)
+            if not self.em_transacao:
+                self.conn.commit()
+            # retorna quantas linhas foram afetadas no total
+            return self.cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Erro ao executar query em lote: {e}")
+            print(f"Query: {query}")
+            if self.em_transacao:
+                raise
+            return None
+
+    def insert_rows(self, tabela, colunas, linhas):
+        """insere várias linhas de uma vez em uma tabela; 'colunas' e 'tabela' vêm do código, nunca do usuário"""
+        marcadores = ", ".join("?" for _ in colunas)
+        query = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({marcadores})"
+        return self.execute_many(query, linhas)
 
     def create_tables(self):
         """cria todas as tabelas necessárias no banco de dados, isso se elasainda não existirem"""
@@ -192,3 +681,73 @@ class DatabaseManager:
         # Zzzzz
         for query in queries:
             self.execute_query(query)
+        # depois das tabelas base, leva o esquema até a versão mais nova
+        self.aplicar_migracoes()
+        self._rastrear_alteracoes_locais()
+
+    def _rastrear_alteracoes_locais(self):
+        """
+        Anota (numa tabela TEMP, que só esta conexão enxerga) as entradas do log_alteracoes geradas por esta conexão.
+        A recarga incremental pula essas entradas, porque a memória deste processo já tem essas alterações.
+        """
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS alteracoes_locais (seq INTEGER PRIMARY KEY)")
+        self.conn.execute(
+            """CREATE TEMP TRIGGER IF NOT EXISTS trg_alteracoes_locais
+               AFTER INSERT ON main.log_alteracoes
+               BEGIN
+                   INSERT INTO alteracoes_locais (seq) VALUES (NEW.seq);
+               END"""
+        )
+
+    def ultima_alteracao(self) -> int:
+        """seq da alteração mais recente do log (0 se o log está vazio)"""
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM log_alteracoes").fetchone()[0]
+
+    def alteracoes_desde(self, seq: int, ate_seq: int) -> list[tuple[str, int]] | None:
+        """
+        (entidade, chave) das alterações feitas por OUTRAS conexões com seq em (seq, ate_seq], em ordem.
+        Retorna None se parte desse intervalo já foi podada do log (aí só uma recarga completa resolve).
+        """
+        primeira = self.conn.execute("SELECT MIN(seq) FROM log_alteracoes").fetchone()[0]
+        if primeira is None or primeira > seq + 1:
+            return None
+        return self.conn.execute(
+            """SELECT entidade, chave FROM log_alteracoes
+               WHERE seq > ? AND seq <= ? AND seq NOT IN (SELECT seq FROM temp.alteracoes_locais)
+               ORDER BY seq""",
+            (seq, ate_seq)
+        ).fetchall()
+
+    def esquecer_alteracoes_locais(self, ate_seq: int):
+        """descarta as anotações de alterações locais que já ficaram para trás da sincronização"""
+        self.conn.execute("DELETE FROM temp.alteracoes_locais WHERE seq <= ?", (ate_seq,))
+
+    def versao_esquema(self) -> int:
+        """retorna a versão do esquema gravada no arquivo do banco (PRAGMA user_version)"""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def impressao_digital(self) -> tuple[int, int]:
+        """(versão do esquema, contador de alterações); se qualquer um mudar, o que estava em memória ficou velho"""
+        contador = self.conn.execute("SELECT contador FROM controle_alteracoes WHERE id = 1").fetchone()
+        return self.versao_esquema(), contador[0] if contador else 0
+
+    def versao_dados(self) -> int:
+        """PRAGMA data_version: muda quando OUTRA conexão faz commit no arquivo (os commits desta conexão não contam)"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def aplicar_migracoes(self):
+        """aplica, em ordem, as migrações que ainda não rodaram neste banco; cada uma é uma transação"""
+        versao_atual = self.versao_esquema()
+        for versao, descricao, migracao in MIGRACOES:
+            if versao <= versao_atual:
+                continue
+            try:
+                with self.transacao():
+                    migracao(self.cursor)
+                    # user_version faz parte do cabeçalho do arquivo e entra na mesma transação
+                    self.conn.execute(f"PRAGMA user_version = {int(versao)}")
+                print(f"Banco de dados atualizado para a versão {versao} ({descricao}).")
+            except sqlite3.Error as e:
+                print(f"Erro ao aplicar a migração {versao} ({descricao}): {e}")
+                sys.exit(1)
+            versao_atual = versao
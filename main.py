@@ -2,7 +2,7 @@
 # main.py
 
 # Importa as classes principais de cada módulo do sistema.
-from config import DB_FILE
+from config import DB_FILE, CARREGAMENTO_PREGUICOSO, USAR_SNAPSHOT, ARQUIVO_SNAPSHOT
 from database import DatabaseManager
 from manager import GerenciadorEstoque
 from cli import CliApp
@@ -21,8 +21,10 @@ if __name__ == "__main__":
     db.create_tables()
 
     # 4. inicializar o gerenciador da lógica de negócios, passando o gerenciador do DB
-    gerenciador = GerenciadorEstoque(db)
+    gerenciador = GerenciadorEstoque(db, carregamento_preguicoso=CARREGAMENTO_PREGUICOSO,
+                                     arquivo_snapshot=ARQUIVO_SNAPSHOT if USAR_SNAPSHOT else None)
     # 5. earregar todos os dados existentes do banco para a memória
+    # (se o snapshot da última saída ainda bater com o banco, vem dele e nem precisa ler as tabelas)
     gerenciador.carregar_dados_do_banco()
 
     # 6. e verifica se o banco de dados está vazio (sem fornecedores)
@@ -73,21 +75,28 @@ if __name__ == "__main__":
             # registra uma venda
             gerenciador.registrar_venda([{'produto_id': p1.id, 'quantidade': 2}], 'João da Silva', loja_a.id)
 
-            print("Dados iniciais populados. Recarregando...")
-            # recarrega os dados para que a memória reflita exatamente o que foi salvo no DB
-            gerenciador.carregar_dados_do_banco()
+            print("Dados iniciais populados.")
+            # a memória já foi atualizada junto com o banco; a recarga incremental só traz
+            # o que outro processo possa ter gravado nesse meio tempo
+            gerenciador.recarregar_incremental()
         except Exception as e:
             print(f"Ocorreu um erro ao popular os dados iniciais: {e}")
 
     # 7. inicializa e executa a aplicação de terminal
     app = CliApp(gerenciador)
+    saida_normal = False
     try:
         # esse método método run() inicia o loop principal da interface
         app.run()
+        saida_normal = True
     except KeyboardInterrupt:
         # e aqui é permitido que o usuário saia do programa com Ctrl+C bem bonitinho
         print("\nSaindo a pedido do usuário...")
+        saida_normal = True
     finally:
+        # só grava o snapshot se saiu direitinho; depois de um erro a memória pode não bater com o banco
+        if saida_normal:
+            gerenciador.salvar_snapshot()
         # esse diabo desse bloco SEMPRE vai ser executado no final, seja por saída normal ou por erro
         # gaarante que a conexão com o banco de dados seja fechada ao sair
         print("Fechando conexão com o banco de dados...")
@@ -3,15 +3,32 @@
 # Contém a classe GerenciadorEstoque, que lida com toda a lógica de negócios
 # e gerenciamento de dados da aplicação.
 
+import os
+import pickle
 import sqlite3
-from collections import Counter
-from datetime import datetime, time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from functools import wraps
+from itertools import groupby
+from datetime import datetime
 
 # Importa as classes de modelo e o gerenciador de banco de dados
-from models import (Fornecedor, Localizacao, Produto, HistoricoMovimento,
+from models import (Fornecedor, Localizacao, Produto, HistoricoMovimento, TipoMovimento, classificar_tipo_movimento, para_epoca, Dinheiro,
                     ItemOrdemCompra, OrdemCompra, ItemVenda, Venda,
-                    Devolucao, ItemDevolucao, Transacao, ComponenteKit)
-from database import DatabaseManager
+                    Devolucao, ItemDevolucao, Transacao, ComponenteKit, MatrizEstoque,
+                    AdaptadorRelatorio, RelatorioTexto, RelatorioCSV, RelatorioJSON,
+                    RelatorioNDJSON, RelatorioComCabecalho, RelatorioComRodape, DadosRelatorio, LinhasSobDemanda,
+                    LinhaEstoqueProduto, LinhaValor, LinhaBaixoEstoque, LinhaRanking, LinhaMovimento,
+                    LinhaItemVendido, LinhaComponenteKit, LinhaMotivoDevolucao)
+from database import DatabaseManager, SQL_PRECO_VENDIDO_DEVOLUCAO
+from repositorios import (RepositorioPaginado, RepositorioHistorico, HistoricoColunar, RepositorioVendas,
+                          VendasIndexadas, RepositorioOrdensCompra, RepositorioDevolucoes)
+
+# quantos resultados de relatório ficam guardados (os menos usados recentemente saem primeiro)
+TAMANHO_CACHE_RELATORIOS = 32
+
+# muda sempre que o formato do que vai no snapshot mudar (atributos novos, classes renomeadas...)
+VERSAO_FORMATO_SNAPSHOT = 11
 
 class GerenciadorEstoqueError(Exception):
     """Exceção base para erros do gerenciador de estoque"""
@@ -33,24 +50,120 @@ class EstoqueInsuficienteError(GerenciadorEstoqueError):
     """Estoque insuficiente para a operação"""
     pass
 
+class CodigoBarrasDuplicadoError(GerenciadorEstoqueError):
+    """Já existe outro produto com esse código de barras"""
+    pass
+
+# formatos aceitos por formatar_relatorio/exportar_relatorio
+FORMATOS_RELATORIO = {'texto': RelatorioTexto, 'csv': RelatorioCSV, 'json': RelatorioJSON, 'ndjson': RelatorioNDJSON}
+
+# soma (ou cria) a linha do dia nos resumos de vendas; {chave} é produto_id ou localizacao_id
+SQL_SOMAR_RESUMO_VENDAS = """INSERT INTO {tabela} (dia, {chave}, quantidade, receita, custo, quantidade_devolvida, valor_devolvido)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dia, {chave}) DO UPDATE SET
+        quantidade = quantidade + excluded.quantidade,
+        receita = receita + excluded.receita,
+        custo = custo + excluded.custo,
+        quantidade_devolvida = quantidade_devolvida + excluded.quantidade_devolvida,
+        valor_devolvido = valor_devolvido + excluded.valor_devolvido"""
+
+# colunas de produtos na ordem em que o carregamento desempacota; a migração 8 mudou a posição física
+# das colunas de preço, então nada de SELECT * aqui
+SQL_COLUNAS_PRODUTO = ("id, nome, descricao, categoria, codigo_barras, preco_compra, preco_venda, "
+                       "ponto_ressuprimento, fornecedor_id, tipo_produto")
+
+# valores que significam "produto sem código de barras"; podem repetir e não entram no índice
+CODIGOS_BARRAS_VAZIOS = ('', 'N/A')
+
+def _normalizar_codigo_barras(codigo_barras) -> str | None:
+    """chave do índice de códigos de barras: sem espaços nas pontas; None se o produto não tem código"""
+    if codigo_barras is None:
+        return None
+    codigo = str(codigo_barras).strip()
+    return None if codigo in CODIGOS_BARRAS_VAZIOS else codigo
+
+def _relatorio_em_cache(*entidades):
+    """
+    Decorador dos dados_relatorio_*: guarda o resultado por (relatório, parâmetros) junto com a versão
+    de cada entidade da qual ele depende ('produto', 'estoque', 'venda'...). Enquanto nenhuma delas mudar
+    (ver _invalidar_relatorios), o mesmo pedido devolve o resultado guardado sem recalcular.
+    """
+    def decorar(metodo):
+        @wraps(metodo)
+        def em_cache(self, *args, **kwargs):
+            chave = (metodo.__name__, args, tuple(sorted(kwargs.items())))
+            versoes = tuple(self._versoes_entidades[entidade] for entidade in entidades)
+            cache = self._cache_relatorios
+            guardado = cache.get(chave)
+            if guardado is not None and guardado[0] == versoes:
+                cache.move_to_end(chave)
+                return guardado[1]
+            dados = metodo(self, *args, **kwargs)
+            cache[chave] = (versoes, dados)
+            cache.move_to_end(chave)
+            if len(cache) > TAMANHO_CACHE_RELATORIOS:
+                cache.popitem(last=False)
+            return dados
+        return em_cache
+    return decorar
+
 #  classe principal de lógica de negócios
 
 class GerenciadorEstoque:
     """cheguemos na classe principal agora"""
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, carregamento_preguicoso: bool = False,
+                 arquivo_snapshot: str | None = None):
 
         if not isinstance(db_manager, DatabaseManager):  ## <--- Conferir se é uma instância válida
             raise ValueError("Um DatabaseManager válido deve ser fornecido.")
         
         self.db = db_manager
+        # no modo preguiçoso só catálogo, fornecedores, localizações, estoque e kits ficam inteiros em memória;
+        # histórico, vendas, OCs e devoluções viram repositórios (ver repositorios.py) lidos do banco sob demanda
+        self.carregamento_preguicoso = carregamento_preguicoso
+        # arquivo com o estado em memória gravado na última saída normal (None = não usa snapshot)
+        self.arquivo_snapshot = arquivo_snapshot
+        # PRAGMA data_version de quando os dados foram carregados, pra saber se outra conexão mexeu no banco
+        self._versao_dados_carregada = None
+        # seq do log_alteracoes até onde a memória está em dia (ver recarregar_incremental)
+        self._ultima_alteracao_sincronizada = None
         # dicionários para armazenar os objetos em memória para acesso rápido
         self.produtos: dict[int, Produto] = {}
         self.fornecedores: dict[int, Fornecedor] = {}
         self.localizacoes: dict[int, Localizacao] = {}
-        self.historico: list[HistoricoMovimento] = []
-        self.ordens_compra: dict[int, OrdemCompra] = {}
-        self.vendas: dict[int, Venda] = {}
-        self.devolucoes: dict[int, Devolucao] = {} # dicionário para devoluções
+        self.historico: HistoricoColunar | RepositorioHistorico = HistoricoColunar(self.produtos, self.localizacoes)
+        self.ordens_compra: dict[int, OrdemCompra] | RepositorioOrdensCompra = {}
+        self.vendas: VendasIndexadas | RepositorioVendas = VendasIndexadas()
+        self.devolucoes: dict[int, Devolucao] | RepositorioDevolucoes = {} # dicionário para devoluções
+        # estoque de todos os produtos por (produto_id, localizacao_id); o estoque_por_local de cada produto é uma visão dela
+        self.estoque = MatrizEstoque()
+        # código de barras normalizado -> produto, para a leitura no caixa não varrer o catálogo
+        self._indice_codigo_barras: dict[str, Produto] = {}
+        # id do componente -> ids dos kits que o usam (índice reverso de componentes_kit)
+        self._kits_por_componente: dict[int, set[int]] = {}
+        # produtos individuais no ponto de ressuprimento ou abaixo, como chaves (estoque - mínimo, id)
+        # em ordem crescente, ou seja, quem está mais abaixo do mínimo vem primeiro
+        self._baixo_estoque: list[tuple[int, int]] = []
+        self._chave_baixo_estoque: dict[int, tuple[int, int]] = {}
+        # valor do inventário (preço de compra x estoque dos individuais), somado no total, por local e por categoria;
+        # _contribuicao_valor guarda quanto cada produto soma hoje, pra descontar antes de somar o valor novo.
+        # Tudo em centavos inteiros: somar e descontar milhões de vezes não deixa resíduo
+        self._valor_estoque_total = 0
+        # (por local é pelo id da localização, então renomear não mexe nos agregados)
+        self._valor_por_local: dict[int, int] = {}
+        self._valor_por_categoria: dict[str, int] = {}
+        self._contribuicao_valor: dict[int, tuple[str, dict[int, int]]] = {}
+        # versão de cada entidade (mesmos nomes do log_alteracoes) e os relatórios calculados com elas
+        self._versoes_entidades: Counter = Counter()
+        self._cache_relatorios: OrderedDict = OrderedDict()
+
+    def _invalidar_relatorios(self, *entidades: str):
+        """Avisa que essas entidades mudaram: os relatórios que dependem delas serão recalculados no próximo pedido."""
+        for entidade in entidades:
+            self._versoes_entidades[entidade] += 1
+        # se a transação for desfeita a memória volta atrás, e o que foi calculado no meio tempo também não vale
+        if self.db.em_transacao:
+            self.db.registrar_desfazer(lambda: self._versoes_entidades.update(entidades))
 
     def get_todas_categorias(self) -> list[str]:
         """Busca no banco de dados e retorna uma lista de todas as categorias de produtos distintas."""
@@ -63,10 +176,22 @@ class GerenciadorEstoque:
 # =============================================
 
     def carregar_dados_do_banco(self):
-        """Carrega todos os dados do banco de dados para a memória (dicionários)."""
+        """
+        Carrega os dados do banco de dados para a memória (dicionários).
+        No modo preguiçoso, histórico, vendas, OCs e devoluções não são carregados aqui, só ligados aos repositórios.
+        """
         print("Carregando dados do banco...")
+        # tudo vai ser relido: nada do que foi calculado antes vale mais
+        self._cache_relatorios.clear()
+        if self.arquivo_snapshot and self._carregar_snapshot():
+            self._marcar_sincronizacao(self.db.versao_dados(), self.db.ultima_alteracao())
+            print("Dados carregados do snapshot.")
+            return
         # Limpa os dicionários em memória antes de recarregar
         try: 
+            # o ponto de sincronização é lido ANTES dos dados: o que outro processo gravar durante a carga
+            # aparece de novo na próxima recarga incremental (reler uma linha duas vezes não faz mal)
+            versao_dados, ultima_alteracao = self.db.versao_dados(), self.db.ultima_alteracao()
             self.produtos.clear()
             self.fornecedores.clear()
             self.localizacoes.clear()
@@ -74,6 +199,7 @@ class GerenciadorEstoque:
             self.ordens_compra.clear()
             self.vendas.clear()
             self.devolucoes.clear()
+            self.estoque = MatrizEstoque()
         
         
             # carrega fornecedores
@@ -90,12 +216,13 @@ class GerenciadorEstoque:
                 if localizacoes_data:
                     for row in localizacoes_data:
                         self.localizacoes[row[0]] = Localizacao(*row)
+                        self.estoque.adicionar_localizacao(row[0], row[1])
             except Exception as e:
                 raise GerenciadorEstoqueError("Erro ao carregar localizações.") from e
 
             # carrega produtos e associa o fornecedor correspondente
             try:
-                produtos_data = self.db.execute_query("SELECT * FROM produtos", fetch='all')
+                produtos_data = self.db.execute_query(f"SELECT {SQL_COLUNAS_PRODUTO} FROM produtos", fetch='all')
                 if produtos_data:
                     for row in produtos_data:
                         prod_id, nome, desc, cat, cod, p_compra, p_venda, p_ress, forn_id, tipo_prod = row
@@ -104,20 +231,21 @@ class GerenciadorEstoque:
                             self.produtos[prod_id] = Produto(
                                 id=prod_id, nome=nome, descricao=desc, categoria=cat, 
                                 fornecedor=fornecedor_obj, codigo_barras=cod, 
-                                preco_compra=p_compra, preco_venda=p_venda, 
-                                ponto_ressuprimento=p_ress, tipoProduto=tipo_prod
+                                preco_compra=Dinheiro(p_compra), preco_venda=Dinheiro(p_venda), 
+                                ponto_ressuprimento=p_ress, tipoProduto=tipo_prod,
+                                estoque_por_local=self.estoque.visao(prod_id)
                             )
+                self._reconstruir_indice_codigo_barras()
             except Exception as e:
                 raise GerenciadorEstoqueError("Erro ao carregar produtos: {e}") from e   
 
             # carrega o estoque de cada produto em cada localização
             try:
-                query_estoque = "SELECT p.id, l.nome, e.quantidade FROM estoque e JOIN produtos p ON e.produto_id = p.id JOIN localizacoes l ON e.localizacao_id = l.id"
-                estoque_data = self.db.execute_query(query_estoque, fetch='all')
+                estoque_data = self.db.execute_query("SELECT produto_id, localizacao_id, quantidade FROM estoque", fetch='all')
                 if estoque_data:
-                    for prod_id, local_nome, qtd in estoque_data:
-                        if prod_id in self.produtos:
-                            self.produtos[prod_id].estoque_por_local[local_nome] = qtd
+                    for prod_id, loc_id, qtd in estoque_data:
+                        if prod_id in self.produtos and loc_id in self.localizacoes:
+                            self.estoque.definir(prod_id, loc_id, qtd)
             except Exception as e:
                 raise GerenciadorEstoqueError("Erro ao carregar estoque.") from e
             
@@ -132,95 +260,319 @@ class GerenciadorEstoque:
                     for produto in self.produtos.values():
                         if produto.tipoProduto == 'kit':
                             produto.recalcular_preco_compra()
+                self._reconstruir_indice_kits()
             except Exception as e:
                 raise GerenciadorEstoqueError("Erro ao carregar componentes de kits.") from e
+            self._reconstruir_agregados()
+
+
+            # histórico, OCs, vendas e devoluções: no modo preguiçoso ficam só os repositórios,
+            # no modo normal os mesmos repositórios carregam as tabelas inteiras para listas/dicionários
+            if self.carregamento_preguicoso:
+                self._ligar_repositorios()
+            else:
+                historico = RepositorioHistorico(self.db, self.produtos, self.localizacoes)
+                ordens_compra = RepositorioOrdensCompra(self.db, self.produtos, self.fornecedores)
+                vendas = RepositorioVendas(self.db, self.produtos)
+                # carrega o histórico de movimentações
+                try :
+                    self.historico = historico.carregar_colunar()
+                except Exception as e:
+                    raise GerenciadorEstoqueError("Erro ao carregar histórico de movimentações.") from e
+
+                # carrega as Ordens de Compra (cabeçalho e itens)
+                try :
+                    self.ordens_compra = ordens_compra.carregar_todos()
+                except Exception as e:
+                    raise GerenciadorEstoqueError("Erro ao carregar ordens de compra.") from e
+
+                # carrega o histórico de Vendas (cabeçalho e itens)
+                try:
+                    self.vendas = VendasIndexadas(vendas.carregar_todos())
+                except Exception as e:
+                    raise GerenciadorEstoqueError("Erro ao carregar vendas.") from e
+
+                # Carrega as devoluções (cabeçalho, itens e transações)
+                try:
+                    self.devolucoes = RepositorioDevolucoes(self.db, self.produtos, self.vendas).carregar_todos()
+                except Exception as e:
+                    raise GerenciadorEstoqueError("Erro ao carregar devoluções.") from e
+
+            self._marcar_sincronizacao(versao_dados, ultima_alteracao)
+            print("Dados carregados com sucesso.")
+        except sqlite3.Error as e:
+            print(f"Erro ao acessar o banco de dados: {e}")
+            raise RuntimeError("Falha ao carregar dados do banco de dados.") from e
+        except Exception as e:
+            print(f"Erro inesperado: {e}")
+            raise RuntimeError("Erro inesperado ao carregar dados do banco de dados.") from e
 
+    def _marcar_sincronizacao(self, versao_dados: int, ultima_alteracao: int):
+        """registra até onde a memória está em dia com o banco"""
+        self._versao_dados_carregada = versao_dados
+        self._ultima_alteracao_sincronizada = ultima_alteracao
+        self.db.esquecer_alteracoes_locais(ultima_alteracao)
 
-            # carrega o histórico de movimentações
-            try :
-                query_hist = "SELECT produto_id, localizacao_id, tipo, quantidade, data FROM historico_movimentos"
-                hist_data = self.db.execute_query(query_hist, fetch='all')
-                if hist_data:
-                    for p_id, l_id, tipo, qtd, data_str in hist_data:
-                        if (produto := self.produtos.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
-                            self.historico.append(HistoricoMovimento(produto, tipo, qtd, localizacao, datetime.fromisoformat(data_str)))
-            except Exception as e:
-                raise GerenciadorEstoqueError("Erro ao carregar histórico de movimentações.") from e
+    def _ligar_repositorios(self):
+        """modo preguiçoso: histórico, OCs, vendas e devoluções passam a ser lidos do banco pelos repositórios"""
+        self.historico = RepositorioHistorico(self.db, self.produtos, self.localizacoes)
+        self.ordens_compra = RepositorioOrdensCompra(self.db, self.produtos, self.fornecedores)
+        self.vendas = RepositorioVendas(self.db, self.produtos)
+        self.devolucoes = RepositorioDevolucoes(self.db, self.produtos, self.vendas)
 
-            # carrega as Ordens de Compra (cabeçalho)
+# =============================================
+# SNAPSHOT DE INICIALIZAÇÃO
+# =============================================
 
-            try :
-                ocs_data = self.db.execute_query("SELECT * FROM ordens_compra", fetch='all')
-                if ocs_data:
-                    for row in ocs_data:
-                        oc_id, forn_id, status, data_str = row
-                        if fornecedor := self.fornecedores.get(forn_id):
-                            self.ordens_compra[oc_id] = OrdemCompra(oc_id, fornecedor, [], status, datetime.fromisoformat(data_str))
-            
-                # carrega os itens de cada Ordem de Compra
-                query_itens_oc = "SELECT ordem_id, produto_id, quantidade, preco_unitario FROM itens_ordem_compra"
-                itens_oc_data = self.db.execute_query(query_itens_oc, fetch='all')
-                if itens_oc_data:
-                    for oc_id, p_id, qtd, preco in itens_oc_data:
-                        if (oc := self.ordens_compra.get(oc_id)) and (produto := self.produtos.get(p_id)):
-                            item = ItemOrdemCompra(produto, qtd, preco)
-                            oc.itens.append(item)
-            except Exception as e:
-                raise GerenciadorEstoqueError("Erro ao carregar ordens de compra.") from e
+    def _estado_snapshot(self) -> dict:
+        """o que vai para o snapshot; no modo preguiçoso os repositórios ficam de fora (eles leem do banco)"""
+        estado = {
+            'fornecedores': self.fornecedores,
+            'localizacoes': self.localizacoes,
+            'produtos': self.produtos,
+            'estoque': self.estoque,
+        }
+        if not self.carregamento_preguicoso:
+            estado.update(historico=self.historico, ordens_compra=self.ordens_compra,
+                          vendas=self.vendas, devolucoes=self.devolucoes)
+        return estado
+
+    def salvar_snapshot(self) -> bool:
+        """
+        Grava o estado em memória no arquivo de snapshot, junto com a impressão digital do banco.
+        Chamado na saída normal do programa. Se outra conexão alterou o banco depois do carregamento,
+        a memória não bate mais com o banco e o snapshot não é gravado.
+        """
+        if not self.arquivo_snapshot:
+            return False
+        try:
+            if self._versao_dados_carregada is None or self.db.versao_dados() != self._versao_dados_carregada:
+                print("O banco foi alterado por outro processo; snapshot não gravado.")
+                return False
+            cabecalho = (VERSAO_FORMATO_SNAPSHOT, self.db.impressao_digital(), self.carregamento_preguicoso)
+            # grava num temporário e troca no fim, pra nunca deixar um snapshot pela metade
+            temporario = self.arquivo_snapshot + ".tmp"
+            with open(temporario, 'wb') as arquivo:
+                pickle.dump(cabecalho, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self._estado_snapshot(), arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporario, self.arquivo_snapshot)
+            return True
+        except (OSError, pickle.PicklingError, sqlite3.Error) as e:
+            print(f"Não foi possível gravar o snapshot: {e}")
+            return False
 
-            try:
-            # carrega o histórico de Vendas (cabeçalho)
-                vendas_data = self.db.execute_query("SELECT id, cliente_nome, data FROM vendas", fetch='all')
-                if vendas_data:
-                    for row in vendas_data:
-                        venda_id, cliente, data_str = row
-                        self.vendas[venda_id] = Venda(venda_id, cliente, [], datetime.fromisoformat(data_str))
-
-                # carrega os itens de cada venda
-                query_itens_venda = "SELECT venda_id, produto_id, quantidade, preco_venda_unitario FROM itens_venda"
-                itens_venda_data = self.db.execute_query(query_itens_venda, fetch='all')
-                if itens_venda_data:
-                    for v_id, p_id, qtd, preco in itens_venda_data:
-                        if (venda := self.vendas.get(v_id)) and (produto := self.produtos.get(p_id)):
-                            item = ItemVenda(produto, qtd, preco)
-                            venda.itens.append(item)
-            except Exception as e:
-                raise GerenciadorEstoqueError("Erro ao carregar vendas.") from e
-            try:
-                # Carrega as devoluções (cabeçalho)
-                devolucoes_data = self.db.execute_query("SELECT id, venda_original_id, cliente_nome, status, data, observacoes FROM devolucoes", fetch='all')
-                if devolucoes_data:
-                    for row in devolucoes_data:
-                        dev_id, venda_id, cliente, status, data_str, obs = row
-                        if venda_original := self.vendas.get(venda_id):
-                            self.devolucoes[dev_id] = Devolucao(
-                                id=dev_id, venda_original=venda_original, cliente_nome=cliente, itens=[],
-                                status=status, data=datetime.fromisoformat(data_str), observacoes=obs
-                            )
+    def _carregar_snapshot(self) -> bool:
+        """
+        Tenta carregar o estado do snapshot. Só aceita se a impressão digital gravada for igual à atual do banco
+        (mesma versão de esquema e nenhuma escrita desde a gravação). Retorna False para cair no carregamento completo.
+        """
+        try:
+            with open(self.arquivo_snapshot, 'rb') as arquivo:
+                # o cabeçalho vem primeiro, então um snapshot velho é descartado sem desserializar o resto
+                cabecalho = pickle.load(arquivo)
+                if cabecalho != (VERSAO_FORMATO_SNAPSHOT, self.db.impressao_digital(), self.carregamento_preguicoso):
+                    return False
+                estado = pickle.load(arquivo)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            # arquivo corrompido, de outra versão do programa etc.: não é erro, só não dá pra usar
+            print(f"Snapshot ignorado: {e}")
+            return False
 
-                # Carrega os itens de cada devolução
-                itens_dev_data = self.db.execute_query("SELECT devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto FROM itens_devolucao", fetch='all')
-                if itens_dev_data:
-                    for dev_id, p_id, qtd, motivo, condicao in itens_dev_data:
-                        if (devolucao := self.devolucoes.get(dev_id)) and (produto := self.produtos.get(p_id)):
-                            devolucao.itens.append(ItemDevolucao(produto, qtd, motivo, condicao))
-
-                # Carrega as transações de cada devolução
-                transacoes_data = self.db.execute_query("SELECT id, devolucao_id, tipo, valor, data FROM transacoes", fetch='all')
-                if transacoes_data:
-                    for t_id, dev_id, tipo, valor, data_str in transacoes_data:
-                        if devolucao := self.devolucoes.get(dev_id):
-                            devolucao.transacao = Transacao(t_id, dev_id, tipo, valor, datetime.fromisoformat(data_str))
-            except Exception as e:
-                raise GerenciadorEstoqueError("Erro ao carregar devoluções.") from e
+        self.fornecedores = estado['fornecedores']
+        self.localizacoes = estado['localizacoes']
+        self.produtos = estado['produtos']
+        # os produtos do snapshot apontam para esta mesma matriz (o pickle preserva a referência)
+        self.estoque = estado['estoque']
+        self._reconstruir_indice_codigo_barras()
+        self._reconstruir_indice_kits()
+        self._reconstruir_agregados()
+        if self.carregamento_preguicoso:
+            self._ligar_repositorios()
+        else:
+            self.historico = estado['historico']
+            self.ordens_compra = estado['ordens_compra']
+            self.vendas = estado['vendas']
+            self.devolucoes = estado['devolucoes']
+        return True
 
-            print("Dados carregados com sucesso.")
+# =============================================
+# RECARGA INCREMENTAL
+# =============================================
+
+    def recarregar_incremental(self) -> int:
+        """
+        Aplica na memória só o que outros processos gravaram no banco desde a última sincronização,
+        lendo o log_alteracoes (alimentado por triggers). Cada entidade alterada é relida pelo id:
+        se a linha sumiu, sai da memória; se existe, é atualizada (ou criada).
+        Retorna quantas entidades foram relidas. Se o log já foi podado além do ponto de sincronização,
+        faz uma recarga completa.
+        """
+        if self._ultima_alteracao_sincronizada is None:
+            self.carregar_dados_do_banco()
+            return 0
+        try:
+            # data_version só muda com commit de outra conexão: se não mudou, não tem nada pra buscar
+            versao_dados = self.db.versao_dados()
+            if versao_dados == self._versao_dados_carregada:
+                return 0
+            ate = self.db.ultima_alteracao()
+            alteracoes = self.db.alteracoes_desde(self._ultima_alteracao_sincronizada, ate)
+            if alteracoes is None:
+                print("O log de alterações não cobre mais a última sincronização; recarregando tudo...")
+                self.carregar_dados_do_banco()
+                return 0
+
+            # agrupa por entidade, sem repetir chave
+            alteradas: dict[str, set[int]] = {}
+            for entidade, chave in alteracoes:
+                alteradas.setdefault(entidade, set()).add(chave)
+
+            self._invalidar_relatorios(*alteradas)
+            # ordem importa: quem é referenciado vem antes de quem referencia
+            self._sincronizar_localizacoes(alteradas.get('localizacao', set()))
+            self._sincronizar_fornecedores(alteradas.get('fornecedor', set()))
+            self._sincronizar_produtos(alteradas.get('produto', set()))
+            self._sincronizar_estoque(alteradas.get('estoque', set()))
+            self._sincronizar_kits(alteradas.get('kit', set()))
+            if alteradas.keys() & {'produto', 'kit'}:
+                # preço de compra de kit depende do preço dos componentes
+                for produto in self.produtos.values():
+                    if produto.tipoProduto == 'kit':
+                        produto.recalcular_preco_compra()
+                self._reconstruir_indice_kits()
+            elif 'estoque' in alteradas:
+                self._atualizar_kits_dos_componentes(alteradas['estoque'])
+            for produto_id in alteradas.get('produto', set()) | alteradas.get('estoque', set()):
+                if produto := self.produtos.get(produto_id):
+                    self._atualizar_agregados(produto)
+            self._sincronizar_historico(alteradas.get('historico', set()),
+                                        removidos=bool(alteradas.keys() & {'produto', 'localizacao'}))
+            self._sincronizar_registros(self.ordens_compra, alteradas.get('ordem_compra', set()),
+                                        lambda: RepositorioOrdensCompra(self.db, self.produtos, self.fornecedores))
+            self._sincronizar_registros(self.vendas, alteradas.get('venda', set()),
+                                        lambda: RepositorioVendas(self.db, self.produtos))
+            self._sincronizar_registros(self.devolucoes, alteradas.get('devolucao', set()),
+                                        lambda: RepositorioDevolucoes(self.db, self.produtos, self.vendas))
+
+            self._marcar_sincronizacao(versao_dados, ate)
+            return sum(len(chaves) for chaves in alteradas.values())
         except sqlite3.Error as e:
             print(f"Erro ao acessar o banco de dados: {e}")
-            raise RuntimeError("Falha ao carregar dados do banco de dados.") from e
-        except Exception as e:
-            print(f"Erro inesperado: {e}")
-            raise RuntimeError("Erro inesperado ao carregar dados do banco de dados.") from e
+            raise RuntimeError("Falha na recarga incremental.") from e
+
+    def _linhas_por_ids(self, query: str, ids) -> list[tuple]:
+        """executa 'query' (com {marcadores} no lugar da lista do IN) em lotes de ids"""
+        ids = list(ids)
+        linhas = []
+        for inicio in range(0, len(ids), 500):
+            lote = ids[inicio:inicio + 500]
+            marcadores = ", ".join("?" for _ in lote)
+            linhas.extend(self.db.execute_query(query.format(marcadores=marcadores), tuple(lote), fetch='all') or [])
+        return linhas
+
+    def _sincronizar_localizacoes(self, ids: set[int]):
+        if not ids:
+            return
+        encontrados = set()
+        for loc_id, nome, endereco in self._linhas_por_ids("SELECT id, nome, endereco FROM localizacoes WHERE id IN ({marcadores})", ids):
+            encontrados.add(loc_id)
+            # na matriz a localização é uma coluna: criar ou renomear é O(1)
+            self.estoque.adicionar_localizacao(loc_id, nome)
+            if not (localizacao := self.localizacoes.get(loc_id)):
+                self.localizacoes[loc_id] = Localizacao(loc_id, nome, endereco)
+                continue
+            localizacao.nome, localizacao.endereco = nome, endereco
+        for loc_id in ids - encontrados:
+            if self.localizacoes.pop(loc_id, None):
+                self.estoque.remover_localizacao(loc_id)
+
+    def _sincronizar_fornecedores(self, ids: set[int]):
+        if not ids:
+            return
+        encontrados = set()
+        for row in self._linhas_por_ids("SELECT * FROM fornecedores WHERE id IN ({marcadores})", ids):
+            encontrados.add(row[0])
+            if fornecedor := self.fornecedores.get(row[0]):
+                # atualiza no lugar: os produtos apontam para este mesmo objeto
+                _, fornecedor.nome, fornecedor.empresa, fornecedor.telefone, fornecedor.email, fornecedor.morada = row
+            else:
+                self.fornecedores[row[0]] = Fornecedor(*row)
+        for forn_id in ids - encontrados:
+            self.fornecedores.pop(forn_id, None)
+
+    def _sincronizar_produtos(self, ids: set[int]):
+        if not ids:
+            return
+        encontrados = set()
+        for row in self._linhas_por_ids(f"SELECT {SQL_COLUNAS_PRODUTO} FROM produtos WHERE id IN ({{marcadores}})", ids):
+            prod_id, nome, desc, cat, cod, p_compra, p_venda, p_ress, forn_id, tipo_prod = row
+            if not (fornecedor_obj := self.fornecedores.get(forn_id)):
+                continue
+            encontrados.add(prod_id)
+            if produto := self.produtos.get(prod_id):
+                self._desindexar_codigo_barras(produto)
+                produto.nome, produto.descricao, produto.categoria, produto.codigo_barras = nome, desc, cat, cod
+                produto.preco_compra, produto.preco_venda, produto.ponto_ressuprimento = Dinheiro(p_compra), Dinheiro(p_venda), p_ress
+                produto.fornecedor, produto.tipoProduto = fornecedor_obj, tipo_prod
+            else:
+                produto = self.produtos[prod_id] = Produto(
+                    id=prod_id, nome=nome, descricao=desc, categoria=cat,
+                    fornecedor=fornecedor_obj, codigo_barras=cod,
+                    preco_compra=Dinheiro(p_compra), preco_venda=Dinheiro(p_venda),
+                    ponto_ressuprimento=p_ress, tipoProduto=tipo_prod,
+                    estoque_por_local=self.estoque.visao(prod_id)
+                )
+            self._indexar_codigo_barras(produto)
+        for prod_id in ids - encontrados:
+            if produto := self.produtos.pop(prod_id, None):
+                self._esquecer_produto(produto)
+
+    def _sincronizar_estoque(self, produto_ids: set[int]):
+        produto_ids = {pid for pid in produto_ids if pid in self.produtos}
+        if not produto_ids:
+            return
+        for pid in produto_ids:
+            self.estoque.limpar_produto(pid)
+        query = "SELECT produto_id, localizacao_id, quantidade FROM estoque WHERE produto_id IN ({marcadores})"
+        for prod_id, loc_id, qtd in self._linhas_por_ids(query, produto_ids):
+            if loc_id in self.localizacoes:
+                self.estoque.definir(prod_id, loc_id, qtd)
+
+    def _sincronizar_kits(self, kit_ids: set[int]):
+        kit_ids = {kid for kid in kit_ids if kid in self.produtos}
+        if not kit_ids:
+            return
+        for kid in kit_ids:
+            self.produtos[kid].componentes.clear()
+        query = "SELECT kit_produto_id, componente_produto_id, quantidade FROM componentes_kit WHERE kit_produto_id IN ({marcadores})"
+        for kit_id, comp_id, qtd in self._linhas_por_ids(query, kit_ids):
+            if componente_prod := self.produtos.get(comp_id):
+                self.produtos[kit_id].componentes.append(ComponenteKit(produto=componente_prod, quantidade=qtd))
+
+    def _sincronizar_historico(self, ids: set[int], removidos: bool):
+        """o histórico só recebe linhas novas; linhas somem apenas em cascata quando um produto/localização é apagado"""
+        if isinstance(self.historico, RepositorioHistorico):
+            return
+        if removidos:
+            self.historico.descartar_orfaos()
+        if ids:
+            self.historico.carregar_linhas(RepositorioHistorico(self.db, self.produtos, self.localizacoes).linhas_por_ids(ids))
+
+    def _sincronizar_registros(self, registros, ids: set[int], criar_repositorio):
+        """vendas, OCs e devoluções: no modo preguiçoso basta limpar o cache; no normal, relê cada registro pelo id"""
+        if not ids:
+            return
+        if isinstance(registros, RepositorioPaginado):
+            registros.esquecer(ids)
+            return
+        relidos = criar_repositorio().obter_varios(ids)
+        for chave in ids:
+            if chave in relidos:
+                registros[chave] = relidos[chave]
+            else:
+                registros.pop(chave, None)
 
     def registrar_venda(self, itens_info: list[dict], nome_cliente: str, localizacao_id: int) -> tuple[Venda, list[Produto]]:
         """Registra uma nova venda, atualiza o estoque e retorna a venda e produtos que atingiram o ponto de ressuprimento."""
@@ -234,11 +586,12 @@ class GerenciadorEstoque:
 
             # Validação de estoque antes de qualquer alteração no banco
             for item_info in itens_info:
-                produto = self.produtos[item_info['produto_id']]
+                produto_id = item_info['produto_id']
                 quantidade_vendida = item_info['quantidade']
 
                 if not produto_id or produto_id not in self.produtos: # <-- Aqui
                     raise ProdutoNaoEncontradoError(f"Produto com ID {produto_id} não encontrado.")
+                produto = self.produtos[produto_id]
 
                 if quantidade_vendida <= 0:
                     raise ValueError("A quantidade vendida deve ser maior que zero.")
@@ -248,59 +601,88 @@ class GerenciadorEstoque:
                     if estoque_montavel < quantidade_vendida:
                         raise ValueError(f"Estoque de componentes insuficiente para montar {quantidade_vendida} unidade(s) do kit '{produto.nome}'. Apenas {estoque_montavel} possível(is).")
                 else: # Produto individual
-                    estoque_local = produto.estoque_por_local.get(localizacao.nome, 0)
+                    estoque_local = self.estoque.get(produto_id, localizacao_id)
                     if estoque_local < quantidade_vendida:
                         raise ValueError(f"Estoque insuficiente para '{produto.nome}' na localização '{localizacao.nome}'.")
 
             agora = datetime.now()
-            query_venda = "INSERT INTO vendas (cliente_nome, data) VALUES (?, ?)"
-            nova_venda_id = self.db.execute_query(query_venda, (nome_cliente, agora.isoformat()))
-
-            produtos_para_alertar = []
             itens_venda_obj = []
-        
-            for item_info in itens_info:
-                produto_id = item_info['produto_id']
-                quantidade = item_info['quantidade']
-                produto_vendido = self.produtos[produto_id]
-                preco_unitario_venda = produto_vendido.preco_venda
 
-                query_item = "INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_venda_unitario) VALUES (?, ?, ?, ?)"
-                self.db.execute_query(query_item, (nova_venda_id, produto_id, quantidade, preco_unitario_venda))
-            
-                # Se for um kit, debita o estoque dos componentes. Se for individual, debita do produto.
-                if produto_vendido.tipoProduto == 'kit':
-                    for comp in produto_vendido.componentes:
-                        qtd_a_debitar = comp.quantidade * quantidade
-                        _, produto_alertado = self.movimentar_estoque(
-                            produto_id=comp.produto.id,
-                            localizacao_id=localizacao_id,
-                            quantidade=-qtd_a_debitar,
-                            tipo_movimento=f"Componente Venda Kit #{nova_venda_id}"
-                        )
-                        if produto_alertado and produto_alertado not in produtos_para_alertar:
-                            produtos_para_alertar.append(produto_alertado)
-                else: # Produto Individual
-                    _, produto_alertado = self.movimentar_estoque(
-                        produto_id=produto_id,
-                        localizacao_id=localizacao_id,
-                        quantidade=-quantidade,
-                        tipo_movimento=f"Venda #{nova_venda_id}"
-                    )
-                    if produto_alertado and produto_alertado not in produtos_para_alertar:
-                        produtos_para_alertar.append(produto_alertado)
-
-                item_obj = ItemVenda(produto_vendido, quantidade, preco_unitario_venda)
-                itens_venda_obj.append(item_obj)
-
-            # Atualiza o objeto de venda em memória
-            nova_venda = Venda(nova_venda_id, nome_cliente, itens_venda_obj, agora)
-            self.vendas[nova_venda_id] = nova_venda
+            # Tudo dentro do 'with' é um único commit: se qualquer passo falhar, a venda inteira é desfeita
+            with self.db.transacao():
+                query_venda = "INSERT INTO vendas (cliente_nome, data, localizacao_id) VALUES (?, ?, ?)"
+                nova_venda_id = self.db.execute_query(query_venda, (nome_cliente, para_epoca(agora), localizacao_id))
+
+                linhas_itens, movimentos = [], []
+                for item_info in itens_info:
+                    produto_id = item_info['produto_id']
+                    quantidade = item_info['quantidade']
+                    produto_vendido = self.produtos[produto_id]
+                    preco_unitario_venda = produto_vendido.preco_venda
+                    # o custo fica congelado no preço de compra do momento da venda (kits: soma dos componentes)
+                    custo_unitario = produto_vendido.preco_compra
+                    linhas_itens.append((nova_venda_id, produto_id, quantidade, preco_unitario_venda, custo_unitario))
+
+                    # Se for um kit, debita o estoque dos componentes. Se for individual, debita do produto.
+                    if produto_vendido.tipoProduto == 'kit':
+                        for comp in produto_vendido.componentes:
+                            qtd_a_debitar = comp.quantidade * quantidade
+                            movimentos.append((comp.produto.id, localizacao_id, -qtd_a_debitar, f"Componente Venda Kit #{nova_venda_id}",
+                                              TipoMovimento.VENDA_COMPONENTE_KIT, nova_venda_id))
+                    else: # Produto Individual
+                        movimentos.append((produto_id, localizacao_id, -quantidade, f"Venda #{nova_venda_id}", TipoMovimento.VENDA, nova_venda_id))
+
+                    item_obj = ItemVenda(produto_vendido, quantidade, preco_unitario_venda, custo_unitario)
+                    itens_venda_obj.append(item_obj)
+
+                # um executemany para os itens e outro (por tabela) para estoque e histórico
+                self.db.insert_rows("itens_venda", ("venda_id", "produto_id", "quantidade", "preco_venda_unitario", "custo_unitario"),
+                                    linhas_itens)
+                produtos_para_alertar = self.movimentar_estoque_em_lote(movimentos)
+                self._somar_resumo_vendas(agora, localizacao_id, [
+                    (item.produto.id, item.quantidade, item.subtotal, item.custo_unitario * item.quantidade, 0, Dinheiro())
+                    for item in itens_venda_obj
+                ])
+
+                # Atualiza o objeto de venda em memória
+                nova_venda = Venda(nova_venda_id, nome_cliente, itens_venda_obj, agora)
+                self.vendas[nova_venda_id] = nova_venda
+                self._invalidar_relatorios('venda')
+                self.db.registrar_desfazer(lambda: self.vendas.pop(nova_venda_id, None))
             return nova_venda, produtos_para_alertar
         except ValueError as ve:
             print(f"Erro ao registrar venda: {ve}")
             raise
 
+    def _somar_resumo_vendas(self, quando: datetime, localizacao_id: int, linhas: list[tuple]):
+        """soma nos resumos diários as linhas (produto_id, qtd, receita, custo, qtd_devolvida, valor_devolvido);
+        chamado de dentro da transação da venda/devolução, então entra ou sai junto com ela"""
+        if not linhas:
+            return
+        dia = quando.date().isoformat()
+        self.db.execute_many(SQL_SOMAR_RESUMO_VENDAS.format(tabela="resumo_vendas_diario_produto", chave="produto_id"),
+                             [(dia, *linha) for linha in linhas])
+        totais = [sum(coluna) for coluna in zip(*(linha[1:] for linha in linhas))]
+        self.db.execute_many(SQL_SOMAR_RESUMO_VENDAS.format(tabela="resumo_vendas_diario_local", chave="localizacao_id"),
+                             [(dia, localizacao_id, *totais)])
+
+    def _ranking_vendas_resumo(self, apenas_kits: bool = False, data_inicio: datetime | None = None,
+                               data_fim: datetime | None = None) -> list[tuple[str, int]]:
+        """(nome, quantidade) dos produtos mais vendidos, somando os resumos diários em vez de percorrer as vendas"""
+        query = """SELECT r.produto_id, SUM(r.quantidade) AS total FROM resumo_vendas_diario_produto r
+                   JOIN produtos p ON p.id = r.produto_id
+                   WHERE r.quantidade > 0 AND r.dia >= ? AND r.dia <= ?"""
+        if apenas_kits:
+            query += " AND p.tipo_produto = 'kit'"
+        query += " GROUP BY r.produto_id ORDER BY total DESC, r.produto_id"
+        inicio = data_inicio.date().isoformat() if data_inicio else ''
+        fim = data_fim.date().isoformat() if data_fim else '9999-12-31'
+        ranking = []
+        for produto_id, total in self.db.execute_query(query, (inicio, fim), fetch='all'):
+            if (produto := self.produtos.get(produto_id)) is not None:
+                ranking.append((produto.nome, total))
+        return ranking
+
     def adicionar_fornecedor(self, **kwargs) -> Fornecedor:
         """Adiciona um novo fornecedor ao banco de dados e à memória."""
         try :
@@ -312,6 +694,7 @@ class GerenciadorEstoque:
             novo_id = self.db.execute_query(query, params)
             novo_fornecedor = Fornecedor(id=novo_id, **kwargs)
             self.fornecedores[novo_id] = novo_fornecedor
+            self._invalidar_relatorios('fornecedor')
             return novo_fornecedor
         except Exception as e:
             raise FornecedorNaoEncontradoError("Erro ao adicionar fornecedor.") from e
@@ -332,6 +715,7 @@ class GerenciadorEstoque:
             fornecedor.nome, fornecedor.empresa = kwargs['nome'], kwargs.get('empresa', '')
             fornecedor.telefone, fornecedor.email = kwargs.get('telefone', ''), kwargs.get('email', '')
             fornecedor.morada = kwargs.get('morada', '')
+            self._invalidar_relatorios('fornecedor')
             return True
         except Exception as e: 
             raise FornecedorNaoEncontradoError("Erro ao atualizar fornecedor.") from e
@@ -347,7 +731,8 @@ class GerenciadorEstoque:
             # Remove os produtos associados da memória.
             produtos_a_remover = [pid for pid, p in self.produtos.items() if p.fornecedor.id == fornecedor_id]
             for pid in produtos_a_remover:
-                del self.produtos[pid]
+                self._esquecer_produto(self.produtos.pop(pid))
+            self._invalidar_relatorios('fornecedor', 'produto', 'estoque', 'kit', 'historico')
             return True
         return False
 
@@ -359,6 +744,8 @@ class GerenciadorEstoque:
             novo_id = self.db.execute_query(query, params)
             nova_localizacao = Localizacao(id=novo_id, **kwargs)
             self.localizacoes[novo_id] = nova_localizacao
+            self.estoque.adicionar_localizacao(novo_id, nova_localizacao.nome)
+            self._invalidar_relatorios('localizacao')
             return nova_localizacao
         except sqlite3.IntegrityError:
             # Captura erro de violação de constraint (UNIQUE no nome)
@@ -373,19 +760,16 @@ class GerenciadorEstoque:
             if localizacao_id not in self.localizacoes: return False
 
             local_antiga = self.localizacoes[localizacao_id]
-            nome_antigo, novo_nome = local_antiga.nome, kwargs['nome']
+            novo_nome = kwargs['nome']
 
             query = "UPDATE localizacoes SET nome=?, endereco=? WHERE id=?"
             params = (novo_nome, kwargs.get('endereco', ''), localizacao_id)
             self.db.execute_query(query, params)
 
             local_antiga.nome, local_antiga.endereco = novo_nome, kwargs.get('endereco', '')
-
-            # Se o nome mudou, atualiza a chave nos dicionários de estoque em memória.
-            if nome_antigo != novo_nome:
-                for produto in self.produtos.values():
-                    if nome_antigo in produto.estoque_por_local:
-                        produto.estoque_por_local[novo_nome] = produto.estoque_por_local.pop(nome_antigo)
+            # o estoque é indexado pelo id; o nome só muda no cabeçalho da coluna da matriz
+            self.estoque.renomear_localizacao(localizacao_id, novo_nome)
+            self._invalidar_relatorios('localizacao')
             return True
         except Exception as e:
             raise LocalizacaoNaoEncontradaError("Erro ao atualizar localização.") from e
@@ -400,21 +784,44 @@ class GerenciadorEstoque:
 
             self.db.execute_query("DELETE FROM localizacoes WHERE id=?", (localizacao_id,))
             del self.localizacoes[localizacao_id]
+            self.estoque.remover_localizacao(localizacao_id)
+            self.historico.esquecer_localizacao(localizacao_id)
+            self._invalidar_relatorios('localizacao', 'estoque', 'historico')
             return True
         return False
 
     def buscar_produto_por_codigo_barras(self, codigo_barras: str) -> Produto | None:
-        """Busca um produto em memória pelo seu código de barras."""
+        """Busca um produto em memória pelo seu código de barras (consulta direta no índice, sem varrer o catálogo)."""
         try:
-
-            for produto in self.produtos.values():
-                if produto.codigo_barras and produto.codigo_barras.strip() == codigo_barras.strip():
-                    return produto
-            return None
+            chave = _normalizar_codigo_barras(codigo_barras)
+            return self._indice_codigo_barras.get(chave) if chave else None
         except Exception as e:
             print(f"Erro ao buscar produto por código de barras: {e}")
             return None
 
+    # --- índice de códigos de barras ---
+    # mantido por adicionar/atualizar/remover_produto, remover_fornecedor e pelas recargas
+
+    def _reconstruir_indice_codigo_barras(self):
+        self._indice_codigo_barras = {}
+        for produto in self.produtos.values():
+            self._indexar_codigo_barras(produto)
+
+    def _indexar_codigo_barras(self, produto: Produto):
+        if chave := _normalizar_codigo_barras(produto.codigo_barras):
+            self._indice_codigo_barras.setdefault(chave, produto)
+
+    def _desindexar_codigo_barras(self, produto: Produto):
+        chave = _normalizar_codigo_barras(produto.codigo_barras)
+        if chave and self._indice_codigo_barras.get(chave) is produto:
+            del self._indice_codigo_barras[chave]
+
+    def _verificar_codigo_barras_livre(self, codigo_barras, produto_id: int | None = None):
+        """levanta CodigoBarrasDuplicadoError se outro produto já usa esse código"""
+        chave = _normalizar_codigo_barras(codigo_barras)
+        if chave and (dono := self._indice_codigo_barras.get(chave)) and dono.id != produto_id:
+            raise CodigoBarrasDuplicadoError(f"O código de barras '{chave}' já pertence ao produto '{dono.nome}' (ID {dono.id}).")
+
     def adicionar_produto(self, fornecedor_id, **kwargs):
         """Adiciona um novo produto."""
         try:
@@ -423,6 +830,8 @@ class GerenciadorEstoque:
 
             # CORRIGIDO: usa .get() para ter um valor padrão 'individual' caso 'tipoProduto' não seja passado
             tipo_produto = kwargs.get('tipoProduto', 'individual')
+            kwargs['preco_compra'], kwargs['preco_venda'] = Dinheiro.de_reais(kwargs['preco_compra']), Dinheiro.de_reais(kwargs['preco_venda'])
+            self._verificar_codigo_barras_livre(kwargs.get('codigo_barras', ''))
 
             query = """INSERT INTO produtos (nome, descricao, categoria, codigo_barras, preco_compra, preco_venda, ponto_ressuprimento, fornecedor_id, tipo_produto)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
@@ -436,9 +845,14 @@ class GerenciadorEstoque:
             # Garante que o kwargs tenha o tipo correto antes de criar o objeto
             kwargs['tipoProduto'] = tipo_produto
         
-            novo_produto = Produto(id=novo_id, fornecedor=fornecedor, **kwargs)
+            novo_produto = Produto(id=novo_id, fornecedor=fornecedor, estoque_por_local=self.estoque.visao(novo_id), **kwargs)
             self.produtos[novo_id] = novo_produto
+            self._indexar_codigo_barras(novo_produto)
+            self._atualizar_agregados(novo_produto)
+            self._invalidar_relatorios('produto')
             return novo_produto
+        except CodigoBarrasDuplicadoError:
+            raise
         except Exception as e:
             raise GerenciadorEstoqueError("Erro ao adicionar produto.") from e
 
@@ -453,6 +867,7 @@ class GerenciadorEstoque:
                 return False
 
             produto = self.produtos[produto_id]
+            preco_compra_antigo = produto.preco_compra
         
             query = """UPDATE produtos SET nome=?, descricao=?, categoria=?, codigo_barras=?,
                                         preco_compra=?, preco_venda=?, ponto_ressuprimento=?, fornecedor_id=?
@@ -460,6 +875,8 @@ class GerenciadorEstoque:
 
             fornecedor_id = int(kwargs.get('fornecedor_id'))
             if not (fornecedor_obj := self.fornecedores.get(fornecedor_id)): return False
+            self._verificar_codigo_barras_livre(kwargs['codigo_barras'], produto_id)
+            kwargs['preco_compra'], kwargs['preco_venda'] = Dinheiro.de_reais(kwargs['preco_compra']), Dinheiro.de_reais(kwargs['preco_venda'])
 
             params = (
                 kwargs['nome'], kwargs['descricao'], kwargs['categoria'], kwargs['codigo_barras'],
@@ -471,15 +888,29 @@ class GerenciadorEstoque:
             # Atualiza o objeto em memória
             kwargs['fornecedor'] = fornecedor_obj
             del kwargs['fornecedor_id']
+            self._desindexar_codigo_barras(produto)
             for key, value in kwargs.items():
                 if hasattr(produto, key):
                     setattr(produto, key, value)
+            self._indexar_codigo_barras(produto)
+            self._atualizar_agregados(produto)
         
-            # Se for um kit, o preço de compra deve ser recalculado
-            if produto.tipoProduto == 'kit':
-                produto.recalcular_preco_compra()
+            # Se for um kit, o preço de compra deve ser recalculado; se o custo de um componente mudou,
+            # o dos kits que o usam também (e vai pro banco, senão a próxima venda congela o custo velho)
+            kits_afetados = [produto] if produto.tipoProduto == 'kit' else []
+            if produto.preco_compra != preco_compra_antigo:
+                kits_afetados += [self.produtos[kit_id] for kit_id in self._kits_por_componente.get(produto_id, ())
+                                  if kit_id in self.produtos]
+            for kit in kits_afetados:
+                kit.recalcular_preco_compra()
+                self._atualizar_agregados(kit)
+            self.db.execute_many("UPDATE produtos SET preco_compra = ? WHERE id = ?",
+                                 [(kit.preco_compra, kit.id) for kit in kits_afetados])
+            self._invalidar_relatorios('produto')
             
             return True
+        except CodigoBarrasDuplicadoError:
+            raise
         except Exception as e:
             raise GerenciadorEstoqueError("Erro ao atualizar produto.") from e
 
@@ -491,7 +922,8 @@ class GerenciadorEstoque:
             if produto_id in self.produtos:
                 # A remoção em cascata cuidará das tabelas 'estoque', 'historico', etc.
                 self.db.execute_query("DELETE FROM produtos WHERE id=?", (produto_id,))
-                del self.produtos[produto_id]
+                self._esquecer_produto(self.produtos.pop(produto_id))
+                self._invalidar_relatorios('produto', 'estoque', 'kit', 'historico')
                 return True
             return False
         except Exception as e:
@@ -502,59 +934,134 @@ class GerenciadorEstoque:
         try:
             if produto_id not in self.produtos:
                 raise ProdutoNaoEncontradoError(f"Produto com ID {produto_id} não encontrado.")
-            kits_afetados = []
-            for kit in self.produtos.values():
-                if kit.tipoProduto == 'kit':
-                    for componente in kit.componentes:
-                        if componente.produto.id == produto_id:
-                            kits_afetados.append(kit.nome)
-                            break
-            return kits_afetados
+            return [self.produtos[kit_id].nome for kit_id in sorted(self._kits_por_componente.get(produto_id, ()))
+                    if kit_id in self.produtos]
         except Exception as e:
             raise GerenciadorEstoqueError("Erro ao verificar componentes de kits.") from e
 
+    # --- índice reverso componente -> kits ---
 
-    def movimentar_estoque(self, produto_id, localizacao_id, quantidade, tipo_movimento):
-        """Realiza uma movimentação de estoque (entrada/saída) e a registra no histórico."""
-
-        try:
-            produto = self.produtos.get(produto_id)
-            localizacao = self.localizacoes.get(localizacao_id)
-            if not all([produto, localizacao]):
-                raise ValueError("Produto ou Localização inválido.")
-        
+    def _reconstruir_indice_kits(self):
+        """remonta o índice a partir dos kits em memória e zera o estoque montável de todos"""
+        self._kits_por_componente = {}
+        for produto in self.produtos.values():
             if produto.tipoProduto == 'kit':
-                raise ValueError("Não é possível movimentar o estoque de um kit diretamente. A movimentação ocorre através dos seus componentes.")
-
-            estoque_anterior = produto.get_estoque_total()
-            estoque_local_anterior = produto.estoque_por_local.get(localizacao.nome, 0)
-
-            # Valida se há estoque suficiente para uma saída
-            if quantidade < 0 and estoque_local_anterior < abs(quantidade):
-                raise ValueError(f"Estoque insuficiente de '{produto.nome}' em '{localizacao.nome}'.")
+                self._indexar_kit(produto)
+                produto.recalcular_estoque_montavel()
+
+    def _indexar_kit(self, kit: Produto):
+        for componente in kit.componentes:
+            self._kits_por_componente.setdefault(componente.produto.id, set()).add(kit.id)
+
+    def _desindexar_kit(self, kit: Produto):
+        for componente in kit.componentes:
+            if (kits := self._kits_por_componente.get(componente.produto.id)) is not None:
+                kits.discard(kit.id)
+                if not kits:
+                    del self._kits_por_componente[componente.produto.id]
+
+    def _atualizar_kits_dos_componentes(self, produto_ids):
+        """recalcula o estoque montável só dos kits que usam algum desses produtos"""
+        kits_afetados = set()
+        for produto_id in produto_ids:
+            kits_afetados |= self._kits_por_componente.get(produto_id, set())
+        for kit_id in kits_afetados:
+            if kit := self.produtos.get(kit_id):
+                kit.recalcular_estoque_montavel()
+
+    def _esquecer_produto(self, produto: Produto):
+        """tira dos índices um produto que acabou de sair de self.produtos"""
+        self._desindexar_codigo_barras(produto)
+        self._retirar_dos_agregados(produto.id)
+        self.estoque.limpar_produto(produto.id)
+        self.historico.esquecer_produto(produto.id)
+        if produto.tipoProduto == 'kit':
+            self._desindexar_kit(produto)
+        # o banco apaga as linhas de componentes_kit em cascata; a memória dos kits acompanha
+        for kit_id in self._kits_por_componente.pop(produto.id, set()):
+            if kit := self.produtos.get(kit_id):
+                kit.componentes = [c for c in kit.componentes if c.produto.id != produto.id]
+                kit.recalcular_preco_compra()
+                kit.recalcular_estoque_montavel()
 
-            novo_estoque_local = estoque_local_anterior + quantidade
-            query_estoque = """
-            INSERT INTO estoque (produto_id, localizacao_id, quantidade) VALUES (?, ?, ?)
-            ON CONFLICT(produto_id, localizacao_id) DO UPDATE SET quantidade = ?;
-            """
-            self.db.execute_query(query_estoque, (produto_id, localizacao_id, novo_estoque_local, novo_estoque_local))
 
-            # Registra a movimentação no histórico
+    def movimentar_estoque(self, produto_id, localizacao_id, quantidade, tipo_movimento):
+        """Realiza uma movimentação de estoque (entrada/saída) e a registra no histórico."""
+        produtos_alertados = self.movimentar_estoque_em_lote([(produto_id, localizacao_id, quantidade, tipo_movimento)])
+        return True, (produtos_alertados[0] if produtos_alertados else None)
+
+    def movimentar_estoque_em_lote(self, movimentos: list[tuple]) -> list[Produto]:
+        """
+        Aplica várias movimentações (produto_id, localizacao_id, quantidade, tipo_movimento) de uma vez.
+        Cada movimentação pode trazer também (..., tipo_codigo, documento_id) com o TipoMovimento e o documento
+        de origem; sem eles, os dois são deduzidos do texto de tipo_movimento.
+        As linhas de 'estoque' e 'historico_movimentos' são montadas em listas e gravadas com um
+        executemany por tabela. Retorna os produtos que atingiram o ponto de ressuprimento.
+        """
+        try:
+            linhas_estoque, linhas_historico = [], []
+            produtos_para_alertar = []
             agora = datetime.now()
-            query_hist = "INSERT INTO historico_movimentos (produto_id, localizacao_id, tipo, quantidade, data) VALUES (?, ?, ?, ?, ?)"
-            self.db.execute_query(query_hist, (produto_id, localizacao_id, tipo_movimento, quantidade, agora.isoformat()))
-
-            # Atualiza os dados em memória
-            produto.estoque_por_local[localizacao.nome] = novo_estoque_local
-            self.historico.append(HistoricoMovimento(produto, tipo_movimento, quantidade, localizacao, agora))
 
-            # Verifica se o estoque total do produto caiu abaixo do ponto de ressuprimento.
-            produto_para_alertar = None
-            if estoque_anterior > produto.ponto_ressuprimento and produto.get_estoque_total() <= produto.ponto_ressuprimento:
-                produto_para_alertar = produto
-
-            return True, produto_para_alertar
+            with self.db.transacao():
+                for produto_id, localizacao_id, quantidade, tipo_movimento, *origem in movimentos:
+                    tipo_codigo, documento_id = origem or classificar_tipo_movimento(tipo_movimento)
+                    produto = self.produtos.get(produto_id)
+                    localizacao = self.localizacoes.get(localizacao_id)
+                    if not all([produto, localizacao]):
+                        raise ValueError("Produto ou Localização inválido.")
+
+                    if produto.tipoProduto == 'kit':
+                        raise ValueError("Não é possível movimentar o estoque de um kit diretamente. A movimentação ocorre através dos seus componentes.")
+
+                    estoque_anterior = produto.get_estoque_total()
+                    estoque_local_anterior = self.estoque.get(produto_id, localizacao_id)
+
+                    # Valida se há estoque suficiente para uma saída
+                    if quantidade < 0 and estoque_local_anterior < abs(quantidade):
+                        raise ValueError(f"Estoque insuficiente de '{produto.nome}' em '{localizacao.nome}'.")
+
+                    # A memória é atualizada movimento a movimento, assim dois movimentos do mesmo
+                    # produto/local no mesmo lote enxergam o saldo um do outro
+                    novo_estoque_local = estoque_local_anterior + quantidade
+                    linhas_estoque.append((produto_id, localizacao_id, novo_estoque_local))
+                    linhas_historico.append((produto_id, localizacao_id, tipo_movimento, quantidade, para_epoca(agora),
+                                             int(tipo_codigo), documento_id))
+
+                    self.estoque.definir(produto_id, localizacao_id, novo_estoque_local)
+                    movimento = HistoricoMovimento(produto, tipo_movimento, quantidade, localizacao, agora,
+                                                   TipoMovimento(tipo_codigo), documento_id)
+                    self.historico.append(movimento)
+
+                    # se a transação que envolve essa movimentação for desfeita, a memória volta junto com o banco
+                    def desfazer_movimento(produto=produto, localizacao_id=localizacao_id, estoque_local_anterior=estoque_local_anterior, movimento=movimento):
+                        self.estoque.definir(produto.id, localizacao_id, estoque_local_anterior)
+                        self.historico.remove(movimento)
+                        self._atualizar_kits_dos_componentes((produto.id,))
+                        self._atualizar_agregados(produto)
+                    self.db.registrar_desfazer(desfazer_movimento)
+
+                    # Verifica se o estoque total do produto caiu abaixo do ponto de ressuprimento.
+                    if estoque_anterior > produto.ponto_ressuprimento and produto.get_estoque_total() <= produto.ponto_ressuprimento:
+                        if produto not in produtos_para_alertar:
+                            produtos_para_alertar.append(produto)
+
+                # só os kits que usam algum dos produtos movimentados têm o estoque montável refeito
+                self._atualizar_kits_dos_componentes({movimento[0] for movimento in movimentos})
+                for produto_id in {movimento[0] for movimento in movimentos}:
+                    self._atualizar_agregados(self.produtos[produto_id])
+                self._invalidar_relatorios('estoque', 'historico')
+
+                # as linhas de estoque ficam na ordem dos movimentos, então o último saldo de cada (produto, local) prevalece
+                query_estoque = """
+                INSERT INTO estoque (produto_id, localizacao_id, quantidade) VALUES (?, ?, ?)
+                ON CONFLICT(produto_id, localizacao_id) DO UPDATE SET quantidade = excluded.quantidade;
+                """
+                self.db.execute_many(query_estoque, linhas_estoque)
+                self.db.insert_rows("historico_movimentos", ("produto_id", "localizacao_id", "tipo", "quantidade", "data",
+                                                             "tipo_codigo", "documento_id"), linhas_historico)
+
+            return produtos_para_alertar
 
         except ValueError as e:
             print(f"Erro de validação ao movimentar estoque: {e}")
@@ -577,9 +1084,11 @@ class GerenciadorEstoque:
         if not all([origem, destino]):
             raise ValueError("Localização de origem ou destino inválida.")
 
-        # Realiza duas movimentações: uma de saída e uma de entrada.
-        self.movimentar_estoque(produto_id, origem_id, -quantidade, f"Transferência p/ {destino.nome}")
-        self.movimentar_estoque(produto_id, destino_id, quantidade, f"Transferência de {origem.nome}")
+        # Realiza duas movimentações: uma de saída e uma de entrada, no mesmo lote (e na mesma transação).
+        self.movimentar_estoque_em_lote([
+            (produto_id, origem_id, -quantidade, f"Transferência p/ {destino.nome}", TipoMovimento.TRANSFERENCIA_SAIDA, destino_id),
+            (produto_id, destino_id, quantidade, f"Transferência de {origem.nome}", TipoMovimento.TRANSFERENCIA_ENTRADA, origem_id),
+        ])
         return True
 
     def criar_ordem_compra(self, fornecedor_id: int, itens_info: list[dict]) -> OrdemCompra:
@@ -589,10 +1098,7 @@ class GerenciadorEstoque:
         if not itens_info:
             raise ValueError("A ordem de compra deve ter pelo menos um item.")
 
-        agora = datetime.now()
-        query_oc = "INSERT INTO ordens_compra (fornecedor_id, status, data_criacao) VALUES (?, ?, ?)"
-        novo_id_oc = self.db.execute_query(query_oc, (fornecedor_id, "Pendente", agora.isoformat()))
-
+        # valida e monta os itens antes de tocar no banco
         itens_oc_obj = []
         for item_info in itens_info:
             produto_id, quantidade = item_info['produto_id'], item_info['quantidade']
@@ -601,15 +1107,21 @@ class GerenciadorEstoque:
             if produto.fornecedor.id != fornecedor_id:
                 raise ValueError(f"Produto '{produto.nome}' não pertence ao fornecedor '{fornecedor.nome}'.")
 
-            preco_unitario = produto.preco_compra
-            query_item = "INSERT INTO itens_ordem_compra (ordem_id, produto_id, quantidade, preco_unitario) VALUES (?, ?, ?, ?)"
-            self.db.execute_query(query_item, (novo_id_oc, produto_id, quantidade, preco_unitario))
-
-            item_obj = ItemOrdemCompra(produto, quantidade, preco_unitario)
+            item_obj = ItemOrdemCompra(produto, quantidade, produto.preco_compra)
             itens_oc_obj.append(item_obj)
 
+        agora = datetime.now()
+        with self.db.transacao():
+            query_oc = "INSERT INTO ordens_compra (fornecedor_id, status, data_criacao) VALUES (?, ?, ?)"
+            novo_id_oc = self.db.execute_query(query_oc, (fornecedor_id, "Pendente", para_epoca(agora)))
+            self.db.insert_rows(
+                "itens_ordem_compra", ("ordem_id", "produto_id", "quantidade", "preco_unitario"),
+                [(novo_id_oc, item.produto.id, item.quantidade, item.preco_unitario) for item in itens_oc_obj]
+            )
+
         nova_ordem = OrdemCompra(novo_id_oc, fornecedor, itens_oc_obj, "Pendente", agora)
         self.ordens_compra[novo_id_oc] = nova_ordem
+        self._invalidar_relatorios('ordem_compra')
         return nova_ordem
 
     def atualizar_status_ordem(self, ordem_id: int, novo_status: str, localizacao_id: int | None = None):
@@ -623,15 +1135,17 @@ class GerenciadorEstoque:
             if not localizacao_id or not (localizacao := self.localizacoes.get(localizacao_id)):
                 raise ValueError("A localização é obrigatória e válida para receber uma ordem.")
 
-            # Para cada item na ordem, registra a entrada no estoque.
-            for item in ordem.itens:
-                self.movimentar_estoque(
-                    produto_id=item.produto.id, localizacao_id=localizacao_id,
-                    quantidade=item.quantidade, tipo_movimento=f"Entrada OC #{ordem.id}"
-                )
+        with self.db.transacao():
+            if novo_status == "Recebida":
+                # Para cada item na ordem, registra a entrada no estoque (tudo num único lote).
+                self.movimentar_estoque_em_lote([
+                    (item.produto.id, localizacao_id, item.quantidade, f"Entrada OC #{ordem.id}", TipoMovimento.ENTRADA_OC, ordem.id)
+                    for item in ordem.itens
+                ])
 
-        self.db.execute_query("UPDATE ordens_compra SET status = ? WHERE id = ?", (novo_status, ordem_id))
+            self.db.execute_query("UPDATE ordens_compra SET status = ? WHERE id = ?", (novo_status, ordem_id))
         ordem.status = novo_status # Atualiza o objeto em memória
+        self._invalidar_relatorios('ordem_compra')
         return True
 
     def definir_componentes_kit(self, kit_id: int, componentes_info: list[dict]):
@@ -639,9 +1153,7 @@ class GerenciadorEstoque:
         if not (kit := self.produtos.get(kit_id)) or kit.tipoProduto != 'kit':
             raise ValueError("Produto não é um kit válido.")
 
-        # Limpa componentes antigos do banco de dados
-        self.db.execute_query("DELETE FROM componentes_kit WHERE kit_produto_id = ?", (kit_id,))
-
+        # valida todos os componentes antes de mexer no banco
         novos_componentes_obj = []
         for comp_info in componentes_info:
             comp_id = comp_info['produto_id']
@@ -651,254 +1163,574 @@ class GerenciadorEstoque:
                 raise ValueError(f"Componente com ID {comp_id} não encontrado.")
             if componente_prod.tipoProduto == 'kit':
                 raise ValueError("Não é possível adicionar um kit como componente de outro kit.")
-
-            # Insere novo componente no banco
-            query = "INSERT INTO componentes_kit (kit_produto_id, componente_produto_id, quantidade) VALUES (?, ?, ?)"
-            self.db.execute_query(query, (kit_id, comp_id, quantidade))
             novos_componentes_obj.append(ComponenteKit(componente_prod, quantidade))
 
-        # Atualiza o objeto em memória
-        kit.componentes = novos_componentes_obj
-        kit.recalcular_preco_compra()
-        # Atualiza o preço de compra no banco também
-        self.db.execute_query("UPDATE produtos SET preco_compra = ? WHERE id = ?", (kit.preco_compra, kit_id))
+        with self.db.transacao():
+            # Limpa componentes antigos do banco de dados e insere os novos de uma vez
+            self.db.execute_query("DELETE FROM componentes_kit WHERE kit_produto_id = ?", (kit_id,))
+            self.db.insert_rows(
+                "componentes_kit", ("kit_produto_id", "componente_produto_id", "quantidade"),
+                [(kit_id, comp.produto.id, comp.quantidade) for comp in novos_componentes_obj]
+            )
 
-    #region Reports
-    def verificar_alertas_ressuprimento(self):
-        """Retorna uma lista de produtos cujo estoque total está no ponto de ressuprimento ou abaixo."""
+            # Atualiza o objeto em memória (e deixa como desfazer, caso o commit não aconteça)
+            componentes_antigos, preco_antigo = kit.componentes, kit.preco_compra
+            def desfazer_componentes():
+                self._desindexar_kit(kit)
+                kit.componentes, kit.preco_compra = componentes_antigos, preco_antigo
+                self._indexar_kit(kit)
+                kit.recalcular_estoque_montavel()
+            self.db.registrar_desfazer(desfazer_componentes)
+            self._desindexar_kit(kit)
+            kit.componentes = novos_componentes_obj
+            self._indexar_kit(kit)
+            kit.recalcular_preco_compra()
+            kit.recalcular_estoque_montavel()
+            self._invalidar_relatorios('kit', 'produto')
+            # Atualiza o preço de compra no banco também
+            self.db.execute_query("UPDATE produtos SET preco_compra = ? WHERE id = ?", (kit.preco_compra, kit_id))
+
+    # --- agregados mantidos incrementalmente (baixo estoque e valor do inventário) ---
+    # atualizados por movimentar_estoque, adicionar/atualizar/remover_produto e pelas recargas
+
+    def _reconstruir_agregados(self):
+        self._reconstruir_baixo_estoque()
+        self._reconstruir_valor_estoque()
+
+    def _atualizar_agregados(self, produto: Produto):
+        """chamado depois que o estoque, o preço de compra, a categoria ou o ponto de ressuprimento do produto mudou"""
+        self._reavaliar_baixo_estoque(produto)
+        self._reavaliar_valor_estoque(produto)
+
+    def _retirar_dos_agregados(self, produto_id: int):
+        self._retirar_baixo_estoque(produto_id)
+        self._retirar_valor_estoque(produto_id)
+
+    def _reconstruir_baixo_estoque(self):
+        self._baixo_estoque, self._chave_baixo_estoque = [], {}
+        for produto in self.produtos.values():
+            self._reavaliar_baixo_estoque(produto)
+
+    def _retirar_baixo_estoque(self, produto_id: int):
+        if (chave := self._chave_baixo_estoque.pop(produto_id, None)) is not None:
+            del self._baixo_estoque[bisect_left(self._baixo_estoque, chave)]
+
+    def _reavaliar_baixo_estoque(self, produto: Produto):
+        """coloca, tira ou reposiciona o produto no conjunto depois de mudar o estoque ou o ponto de ressuprimento"""
+        self._retirar_baixo_estoque(produto.id)
         # Alertas só se aplicam a produtos individuais com estoque físico.
-        return [p for p in self.produtos.values() if p.tipoProduto == 'individual' and p.get_estoque_total() <= p.ponto_ressuprimento]
+        if produto.tipoProduto == 'individual' and (falta := produto.get_estoque_total() - produto.ponto_ressuprimento) <= 0:
+            chave = (falta, produto.id)
+            insort(self._baixo_estoque, chave)
+            self._chave_baixo_estoque[produto.id] = chave
+
+    def _reconstruir_valor_estoque(self):
+        self._valor_estoque_total, self._valor_por_local, self._valor_por_categoria = 0, {}, {}
+        self._contribuicao_valor = {}
+        for produto in self.produtos.values():
+            self._somar_valor_estoque(produto)
+
+    def _retirar_valor_estoque(self, produto_id: int):
+        if (contribuicao := self._contribuicao_valor.pop(produto_id, None)) is None:
+            return
+        categoria, valor_por_local = contribuicao
+        for local, valor in valor_por_local.items():
+            self._valor_por_local[local] -= valor
+            self._valor_por_categoria[categoria] -= valor
+            self._valor_estoque_total -= valor
+
+    def _somar_valor_estoque(self, produto: Produto):
+        if produto.tipoProduto != 'individual':
+            return
+        preco = produto.preco_compra.centavos
+        valor_por_local = {loc_id: qtd * preco for loc_id, qtd in self.estoque.itens_produto(produto.id)}
+        for local, valor in valor_por_local.items():
+            self._valor_por_local[local] = self._valor_por_local.get(local, 0) + valor
+            self._valor_por_categoria[produto.categoria] = self._valor_por_categoria.get(produto.categoria, 0) + valor
+            self._valor_estoque_total += valor
+        self._contribuicao_valor[produto.id] = (produto.categoria, valor_por_local)
+
+    def _reavaliar_valor_estoque(self, produto: Produto):
+        """troca a contribuição antiga do produto pela atual; custa o número de locais do produto, não o catálogo"""
+        self._retirar_valor_estoque(produto.id)
+        self._somar_valor_estoque(produto)
+
+    def conferir_valor_estoque(self) -> bool:
+        """
+        Recalcula o valor do inventário do zero e compara com os agregados mantidos incrementalmente.
+        As contas são em centavos inteiros, então um desvio aqui é erro de quem mexeu no estoque ou no preço
+        sem chamar _atualizar_agregados. A conta nova sempre substitui a antiga. Retorna True se batia.
+        """
+        valor_mantido = self._valor_estoque_total
+        self._reconstruir_valor_estoque()
+        if (desvio := self._valor_estoque_total - valor_mantido) != 0:
+            print(f"Aviso: o valor do estoque tinha um desvio de R$ {Dinheiro(desvio):.2f}; agregados recalculados.")
+            return False
+        return True
 
-    def calcular_valor_total_estoque(self):
-        """Calcula o valor total do inventário com base no preço de compra dos produtos individuais."""
-        return sum(p.get_estoque_total() * p.preco_compra for p in self.produtos.values() if p.tipoProduto == 'individual')
+    def calcular_valor_por_localizacao(self) -> dict[str, Dinheiro]:
+        """Valor do inventário (preço de compra) por nome de localização."""
+        return {self.localizacoes[loc_id].nome: Dinheiro(valor) for loc_id, valor in self._valor_por_local.items()
+                if valor and loc_id in self.localizacoes}
 
-    def gerar_relatorio_estoque_simplificado(self):
-        """Gera um relatório textual com o status do estoque de todos os produtos."""
-        report = f"""RELATÓRIO DE ESTOQUE (SIMPLIFICADO)
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-Valor Total do Estoque (Individuais): R$ {self.calcular_valor_total_estoque():.2f}
-{'='*80}\n\n"""
+    def calcular_valor_por_categoria(self) -> dict[str, Dinheiro]:
+        """Valor do inventário (preço de compra) por categoria."""
+        return {categoria: Dinheiro(valor) for categoria, valor in self._valor_por_categoria.items() if valor}
+
+    def calcular_fluxo_liquido(self, data_inicio: datetime | None = None, data_fim: datetime | None = None) -> dict[int, int]:
+        """Entradas menos saídas de cada produto (id -> quantidade) no histórico, opcionalmente só no período."""
+        return self.historico.fluxo_liquido_por_produto(data_inicio, data_fim)
+
+    def calcular_quantidade_por_tipo_movimento(self, data_inicio: datetime | None = None,
+                                               data_fim: datetime | None = None) -> dict[TipoMovimento, int]:
+        """Quantidade movimentada por tipo de movimento (vendas, entradas de OC, transferências...)."""
+        return self.historico.quantidade_por_tipo(data_inicio, data_fim)
+
+    def movimentacoes_do_documento(self, tipo_codigo: TipoMovimento, documento_id: int) -> list[HistoricoMovimento]:
+        """Movimentações geradas por uma venda, OC ou devolução (ou, nas transferências, envolvendo a localização)."""
+        return self.historico.por_documento(tipo_codigo, documento_id)
+
+    #region Reports
+    def verificar_alertas_ressuprimento(self):
+        """Retorna os produtos cujo estoque total está no ponto de ressuprimento ou abaixo, os mais abaixo do mínimo primeiro."""
+        return [self.produtos[produto_id] for _, produto_id in self._baixo_estoque]
+
+    def contar_alertas_ressuprimento(self) -> int:
+        """Quantos produtos estão no ponto de ressuprimento ou abaixo (para o painel, sem montar a lista)."""
+        return len(self._baixo_estoque)
+
+    def calcular_valor_total_estoque(self) -> Dinheiro:
+        """Valor total do inventário com base no preço de compra dos produtos individuais (agregado mantido a cada movimentação)."""
+        return Dinheiro(self._valor_estoque_total)
+
+    # Cada relatório é calculado uma vez em dados_relatorio_* (DadosRelatorio: linhas tipadas + metadados).
+    # Dali sai o texto (linhas_relatorio_*, pedaço por pedaço, para escrever direto no terminal/arquivo)
+    # ou CSV/JSON pelo formatar_relatorio. Os gerar_relatorio_* continuam existindo para quem quer a string pronta.
+    # Os que não são do tamanho do histórico ficam em cache até alguma entidade da qual dependem mudar.
+
+    def _adaptador_relatorio(self, formato: str, cabecalho: bool, rodape: bool) -> AdaptadorRelatorio:
+        """adaptador com o formato pedido ('texto', 'csv', 'json' ou 'ndjson') e os decoradores opcionais"""
+        if formato not in FORMATOS_RELATORIO:
+            raise ValueError(f"Formato de relatório desconhecido: '{formato}'. Use um de: {', '.join(FORMATOS_RELATORIO)}.")
+        formatador = FORMATOS_RELATORIO[formato]()
+        if cabecalho:
+            formatador = RelatorioComCabecalho(formatador)
+        if rodape:
+            formatador = RelatorioComRodape(formatador)
+        return AdaptadorRelatorio(formatador)
+
+    def formatar_relatorio(self, dados: DadosRelatorio, formato: str = 'texto', cabecalho: bool = False, rodape: bool = False) -> str:
+        """Renderiza um DadosRelatorio numa string, no formato pedido, pelo adaptador de formatos."""
+        # o texto só é montado quando alguém vai usá-lo; no JSON as linhas já dizem tudo
+        return self._adaptador_relatorio(formato, cabecalho, rodape).gerar_relatorio(dados.para_dict(com_texto=formato == 'texto'))
+
+    def exportar_relatorio(self, dados: DadosRelatorio, destino, formato: str = 'csv', cabecalho: bool = False, rodape: bool = False):
+        """Escreve um DadosRelatorio num arquivo aberto linha a linha: nem as linhas nem o texto ficam inteiros na memória.
+        Para CSV o arquivo deve ser aberto com newline=''."""
+        self._adaptador_relatorio(formato, cabecalho, rodape).escrever_relatorio(dados.para_fluxo(com_texto=formato == 'texto'), destino)
+
+    @_relatorio_em_cache('produto', 'estoque', 'kit', 'localizacao')
+    def dados_relatorio_estoque_simplificado(self) -> DadosRelatorio:
+        """Status do estoque de todos os produtos, ordenados por nome."""
+        linhas = []
         for produto in sorted(self.produtos.values(), key=lambda p: p.nome):
-            report += f"ID: {produto.id} - {produto.nome} ({produto.categoria})"
-            if produto.tipoProduto == 'kit':
-                report += " [KIT]\n"
-                report += f"   Estoque Montável: {produto.get_estoque_total()} kits\n"
-                report += f"   Custo Componentes: R$ {produto.preco_compra:,.2f} | Preço Venda: R$ {produto.preco_venda:,.2f}\n"
-                if not produto.componentes:
-                    report += "   - Kit sem componentes definidos.\n"
+            linhas.append(LinhaEstoqueProduto(
+                produto.id, produto.nome, produto.categoria, produto.tipoProduto, produto.get_estoque_total(),
+                produto.ponto_ressuprimento, produto.preco_compra, produto.preco_venda,
+                {local: qtd for local, qtd in produto.estoque_por_local.items() if qtd > 0},
+                [(comp.quantidade, comp.produto.nome) for comp in produto.componentes],
+            ))
+        return DadosRelatorio("Relatório de Estoque (Simplificado)", linhas,
+                              {'valor_total': self.calcular_valor_total_estoque()},
+                              self._texto_estoque_simplificado)
+
+    def _texto_estoque_simplificado(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE ESTOQUE (SIMPLIFICADO)
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
+Valor Total do Estoque (Individuais): R$ {dados.metadados['valor_total']:.2f}
+{'='*80}\n\n"""
+        for linha in dados.linhas:
+            yield f"ID: {linha.id} - {linha.nome} ({linha.categoria})"
+            if linha.tipo_produto == 'kit':
+                yield " [KIT]\n"
+                yield f"   Estoque Montável: {linha.estoque_total} kits\n"
+                yield f"   Custo Componentes: R$ {linha.preco_compra:,.2f} | Preço Venda: R$ {linha.preco_venda:,.2f}\n"
+                if not linha.componentes:
+                    yield "   - Kit sem componentes definidos.\n"
                 else:
-                    for comp in produto.componentes:
-                        report += f"     -> {comp.quantidade}x {comp.produto.nome}\n"
+                    for quantidade, nome in linha.componentes:
+                        yield f"     -> {quantidade}x {nome}\n"
             else: # Individual
-                report += "\n"
-                report += f"   Estoque Total: {produto.get_estoque_total()} unidades\n"
-                report += f"   Ponto de Ressuprimento: {produto.ponto_ressuprimento}\n"
-                report += "   Estoque por Local:\n"
-                estoque_locais = "\n".join([f"    - {local}: {qtd} unidades" for local, qtd in produto.estoque_por_local.items() if qtd > 0])
+                yield "\n"
+                yield f"   Estoque Total: {linha.estoque_total} unidades\n"
+                yield f"   Ponto de Ressuprimento: {linha.ponto_ressuprimento}\n"
+                yield "   Estoque por Local:\n"
+                estoque_locais = "\n".join([f"    - {local}: {qtd} unidades" for local, qtd in linha.estoque_por_local.items()])
                 if not estoque_locais:
                     estoque_locais = "    - Sem estoque registrado"
-                report += estoque_locais + "\n"
-            report += f"{'-'*30}\n"
-        return report
+                yield estoque_locais + "\n"
+            yield f"{'-'*30}\n"
+
+    def linhas_relatorio_estoque_simplificado(self):
+        return self.dados_relatorio_estoque_simplificado().texto()
+
+    def gerar_relatorio_estoque_simplificado(self):
+        """Gera um relatório textual com o status do estoque de todos os produtos."""
+        return "".join(self.linhas_relatorio_estoque_simplificado())
+
+    @_relatorio_em_cache('produto', 'estoque', 'localizacao')
+    def dados_relatorio_valor_total(self) -> DadosRelatorio:
+        """Valor total do inventário, com uma linha por localização e por categoria."""
+        linhas = [LinhaValor('localizacao', local, valor) for local, valor in sorted(self.calcular_valor_por_localizacao().items())]
+        linhas += [LinhaValor('categoria', categoria, valor)
+                   for categoria, valor in sorted(self.calcular_valor_por_categoria().items(), key=lambda item: item[0] or '')]
+        return DadosRelatorio("Relatório de Valor Total do Inventário", linhas,
+                              {'valor_total': self.calcular_valor_total_estoque()},
+                              self._texto_valor_total)
+
+    def _texto_valor_total(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE VALOR TOTAL DO INVENTÁRIO (PRODUTOS INDIVIDUAIS)
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
+{'='*60}
+O valor total do seu inventário (baseado no preço de compra dos produtos individuais) é: R$ {dados.metadados['valor_total']:.2f}
+"""
+        agrupamento_atual = None
+        for linha in dados.linhas:
+            if linha.agrupamento != agrupamento_atual:
+                agrupamento_atual = linha.agrupamento
+                yield "\nPor localização:\n" if agrupamento_atual == 'localizacao' else "\nPor categoria:\n"
+            yield f"  - {linha.nome or 'Sem categoria'}: R$ {linha.valor:,.2f}\n"
+
+    def linhas_relatorio_valor_total(self):
+        return self.dados_relatorio_valor_total().texto()
 
     def gerar_relatorio_valor_total(self):
         """Gera um relatório simples com o valor total do inventário."""
-        valor_total = self.calcular_valor_total_estoque()
-        return f"""RELATÓRIO DE VALOR TOTAL DO INVENTÁRIO (PRODUTOS INDIVIDUAIS)
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-{'='*60}
-O valor total do seu inventário (baseado no preço de compra dos produtos individuais) é: R$ {valor_total:.2f}
+        return "".join(self.linhas_relatorio_valor_total())
+
+    @_relatorio_em_cache('produto', 'estoque')
+    def dados_relatorio_baixo_estoque(self) -> DadosRelatorio:
+        """Produtos individuais no ponto de ressuprimento ou abaixo dele."""
+        linhas = [LinhaBaixoEstoque(p.id, p.nome, p.get_estoque_total(), p.ponto_ressuprimento)
+                  for p in self.verificar_alertas_ressuprimento()]
+        return DadosRelatorio("Relatório de Produtos com Baixo Estoque", linhas, {},
+                              self._texto_baixo_estoque)
+
+    def _texto_baixo_estoque(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE PRODUTOS COM BAIXO ESTOQUE (INDIVIDUAIS)
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
+{'='*60}\n
 """
+        if not dados.linhas:
+            yield "Nenhum produto com baixo estoque no momento."
+            return
+
+        for linha in dados.linhas:
+            yield (f"ID: {linha.id} - {linha.nome}\n"
+                   f"     Estoque Atual: {linha.estoque_atual} | Mínimo Definido: {linha.ponto_ressuprimento}\n\n")
+
+    def linhas_relatorio_baixo_estoque(self):
+        return self.dados_relatorio_baixo_estoque().texto()
 
     def gerar_relatorio_baixo_estoque(self):
         """Gera um relatório listando todos os produtos individuais com baixo estoque."""
-        produtos_baixo_estoque = self.verificar_alertas_ressuprimento()
-        report = f"""RELATÓRIO DE PRODUTOS COM BAIXO ESTOQUE (INDIVIDUAIS)
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+        return "".join(self.linhas_relatorio_baixo_estoque())
+
+    @_relatorio_em_cache('venda', 'produto')
+    def dados_relatorio_mais_vendidos(self, data_inicio: datetime | None = None, data_fim: datetime | None = None) -> DadosRelatorio:
+        """Ranking de produtos e kits mais vendidos (opcionalmente só entre data_inicio e data_fim, por dia)."""
+        linhas = [LinhaRanking(i, nome, qtd)
+                  for i, (nome, qtd) in enumerate(self._ranking_vendas_resumo(data_inicio=data_inicio, data_fim=data_fim), 1)]
+        return DadosRelatorio("Relatório de Produtos e Kits Mais Vendidos", linhas,
+                              {'data_inicio': data_inicio, 'data_fim': data_fim},
+                              self._texto_mais_vendidos)
+
+    def _texto_mais_vendidos(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE PRODUTOS E KITS MAIS VENDIDOS
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
 {'='*60}\n
 """
-        if not produtos_baixo_estoque:
-            return report + "Nenhum produto com baixo estoque no momento."
-
-        for p in produtos_baixo_estoque:
-            report += (f"ID: {p.id} - {p.nome}\n"
-                        f"     Estoque Atual: {p.get_estoque_total()} | Mínimo Definido: {p.ponto_ressuprimento}\n\n")
-        return report
-
-    def gerar_relatorio_mais_vendidos(self):
-        """Gera um ranking de produtos mais vendidos."""
-        vendas = Counter()
-        for v in self.vendas.values():
-            for item in v.itens:
-                vendas[item.produto.nome] += item.quantidade
-
-        report = f"""RELATÓRIO DE PRODUTOS E KITS MAIS VENDIDOS
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-{'='*60}\n
+        if not dados.linhas:
+            yield "Nenhuma venda registrada até o momento."
+            return
+
+        for linha in dados.linhas:
+            yield f"{linha.posicao}º. {linha.nome} - {linha.quantidade} unidades vendidas\n"
+
+    def linhas_relatorio_mais_vendidos(self, data_inicio: datetime | None = None, data_fim: datetime | None = None):
+        return self.dados_relatorio_mais_vendidos(data_inicio, data_fim).texto()
+
+    def gerar_relatorio_mais_vendidos(self, data_inicio: datetime | None = None, data_fim: datetime | None = None):
+        """Gera um ranking de produtos mais vendidos (opcionalmente só entre data_inicio e data_fim, por dia)."""
+        return "".join(self.linhas_relatorio_mais_vendidos(data_inicio, data_fim))
+
+    def _dados_movimentacao(self, titulo: str, movimentos, metadados: dict, renderizador) -> DadosRelatorio:
+        """monta o DadosRelatorio dos extratos de movimentação (todos têm as mesmas colunas);
+        'movimentos' é uma função que devolve os movimentos, chamada a cada vez que as linhas são percorridas"""
+        linhas = LinhasSobDemanda(lambda: (LinhaMovimento(mov.data, mov.tipo, mov.produto.nome, mov.quantidade, mov.localizacao.nome)
+                                           for mov in movimentos()))
+        return DadosRelatorio(titulo, linhas, metadados, renderizador)
+
+    def dados_relatorio_historico_completo(self) -> DadosRelatorio:
+        """Todas as movimentações, da mais antiga para a mais recente (linhas geradas sob demanda, para exportar)."""
+        return self._dados_movimentacao("Histórico Completo de Movimentações", lambda: iter(self.historico), {},
+                                        self._texto_historico_completo)
+
+    def _texto_historico_completo(self, dados: DadosRelatorio):
+        yield f"""HISTÓRICO COMPLETO DE MOVIMENTAÇÕES
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
+{'='*80}\n
 """
-        if not vendas:
-            return report + "Nenhuma venda registrada até o momento."
-
-        for i, (nome_produto, qtd) in enumerate(vendas.most_common(), 1):
-            report += f"{i}º. {nome_produto} - {qtd} unidades vendidas\n"
-
-        return report
-
-    def gerar_relatorio_movimentacao_item(self, produto_id: int):
-        """Gera um extrato de todas as movimentações de um produto específico."""
+        vazio = True
+        for mov in dados.linhas:
+            vazio = False
+            sinal = '+' if mov.quantidade > 0 else ''
+            yield (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
+                   f"Produto: {mov.produto:<20} | "
+                   f"Qtd: {sinal}{mov.quantidade:<4} | "
+                   f"Tipo: {mov.tipo:<15} | "
+                   f"Local: {mov.localizacao}\n")
+        if vazio:
+            yield "Nenhuma movimentação registrada."
+
+    def dados_relatorio_movimentacao_item(self, produto_id: int) -> DadosRelatorio:
+        """Extrato das movimentações de um produto, da mais recente para a mais antiga."""
+        titulo = "Histórico de Movimentação do Produto"
         if not (produto := self.produtos.get(produto_id)):
-            return "Erro: Produto não encontrado."
-            
+            return DadosRelatorio(titulo, [], {'erro': "Erro: Produto não encontrado."})
         if produto.tipoProduto == 'kit':
-            return f"Erro: '{produto.nome}' é um kit. Kits não possuem histórico de movimentação direto. Verifique o histórico de seus componentes."
-
-        movimentos_produto = [m for m in self.historico if m.produto.id == produto_id]
+            return DadosRelatorio(titulo, [], {'erro': f"Erro: '{produto.nome}' é um kit. Kits não possuem histórico de movimentação direto. Verifique o histórico de seus componentes."})
+        return self._dados_movimentacao(titulo, lambda: self.historico.por_produto(produto_id),
+                                        {'produto_id': produto.id, 'produto': produto.nome}, self._texto_movimentacao_item)
 
-        report = f"""HISTÓRICO DE MOVIMENTAÇÃO DO PRODUTO: {produto.nome.upper()} (ID: {produto.id})
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+    def _texto_movimentacao_item(self, dados: DadosRelatorio):
+        yield f"""HISTÓRICO DE MOVIMENTAÇÃO DO PRODUTO: {dados.metadados['produto'].upper()} (ID: {dados.metadados['produto_id']})
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
 {'='*70}\n
 """
-        if not movimentos_produto:
-            return report + "Nenhuma movimentação registrada para este produto."
-
-        for mov in sorted(movimentos_produto, key=lambda m: m.data, reverse=True):
+        vazio = True
+        for mov in dados.linhas:
+            vazio = False
             sinal = '+' if mov.quantidade > 0 else ''
-            report += (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
-                        f"Tipo: {mov.tipo:<30} | "
-                        f"Qtd: {sinal}{mov.quantidade:<4} | "
-                        f"Local: {mov.localizacao.nome}\n")
-        return report
+            yield (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
+                   f"Tipo: {mov.tipo:<30} | "
+                   f"Qtd: {sinal}{mov.quantidade:<4} | "
+                   f"Local: {mov.localizacao}\n")
+        if vazio:
+            yield "Nenhuma movimentação registrada para este produto."
 
-    def gerar_relatorio_movimentacao_fornecedor(self, fornecedor_id: int):
-        """Gera um extrato de movimentações de todos os produtos de um fornecedor."""
-        if not (fornecedor := self.fornecedores.get(fornecedor_id)):
-            return "Erro: Fornecedor não encontrado."
+    def linhas_relatorio_movimentacao_item(self, produto_id: int):
+        return self.dados_relatorio_movimentacao_item(produto_id).texto()
 
-        produtos_do_fornecedor = [p.id for p in self.produtos.values() if p.fornecedor.id == fornecedor_id]
-        movimentos_fornecedor = [m for m in self.historico if m.produto.id in produtos_do_fornecedor]
+    def gerar_relatorio_movimentacao_item(self, produto_id: int):
+        """Gera um extrato de todas as movimentações de um produto específico."""
+        return "".join(self.linhas_relatorio_movimentacao_item(produto_id))
 
-        report = f"""HISTÓRICO DE MOVIMENTAÇÃO POR FORNECEDOR: {fornecedor.empresa.upper()} (ID: {fornecedor.id})
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+    def dados_relatorio_movimentacao_fornecedor(self, fornecedor_id: int) -> DadosRelatorio:
+        """Extrato das movimentações de todos os produtos de um fornecedor."""
+        titulo = "Histórico de Movimentação por Fornecedor"
+        if not (fornecedor := self.fornecedores.get(fornecedor_id)):
+            return DadosRelatorio(titulo, [], {'erro': "Erro: Fornecedor não encontrado."})
+        return self._dados_movimentacao(titulo, lambda: self.historico.por_fornecedor(fornecedor_id),
+                                        {'fornecedor_id': fornecedor.id, 'empresa': fornecedor.empresa},
+                                        self._texto_movimentacao_fornecedor)
+
+    def _texto_movimentacao_fornecedor(self, dados: DadosRelatorio):
+        yield f"""HISTÓRICO DE MOVIMENTAÇÃO POR FORNECEDOR: {dados.metadados['empresa'].upper()} (ID: {dados.metadados['fornecedor_id']})
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
 {'='*80}\n
 """
-        if not movimentos_fornecedor:
-            return report + "Nenhuma movimentação registrada para produtos deste fornecedor."
-
-        for mov in sorted(movimentos_fornecedor, key=lambda m: m.data, reverse=True):
+        vazio = True
+        for mov in dados.linhas:
+            vazio = False
             sinal = '+' if mov.quantidade > 0 else ''
-            report += (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
-                        f"Produto: {mov.produto.nome:<20} | "
-                        f"Qtd: {sinal}{mov.quantidade:<4} | "
-                        f"Tipo: {mov.tipo:<15} | "
-                        f"Local: {mov.localizacao.nome}\n")
-        return report
+            yield (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
+                   f"Produto: {mov.produto:<20} | "
+                   f"Qtd: {sinal}{mov.quantidade:<4} | "
+                   f"Tipo: {mov.tipo:<15} | "
+                   f"Local: {mov.localizacao}\n")
+        if vazio:
+            yield "Nenhuma movimentação registrada para produtos deste fornecedor."
 
-    def gerar_relatorio_movimentacao_localizacao(self, localizacao_id: int):
-        """Gera um extrato de movimentações de todos os produtos em uma localização."""
-        if not (localizacao := self.localizacoes.get(localizacao_id)):
-            return "Erro: Localização não encontrada."
+    def linhas_relatorio_movimentacao_fornecedor(self, fornecedor_id: int):
+        return self.dados_relatorio_movimentacao_fornecedor(fornecedor_id).texto()
 
-        movimentos_localizacao = [m for m in self.historico if m.localizacao.id == localizacao_id]
+    def gerar_relatorio_movimentacao_fornecedor(self, fornecedor_id: int):
+        """Gera um extrato de movimentações de todos os produtos de um fornecedor."""
+        return "".join(self.linhas_relatorio_movimentacao_fornecedor(fornecedor_id))
 
-        report = f"""HISTÓRICO DE MOVIMENTAÇÃO POR LOCALIZAÇÃO: {localizacao.nome.upper()} (ID: {localizacao.id})
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+    def dados_relatorio_movimentacao_localizacao(self, localizacao_id: int) -> DadosRelatorio:
+        """Extrato das movimentações de todos os produtos em uma localização."""
+        titulo = "Histórico de Movimentação por Localização"
+        if not (localizacao := self.localizacoes.get(localizacao_id)):
+            return DadosRelatorio(titulo, [], {'erro': "Erro: Localização não encontrada."})
+        return self._dados_movimentacao(titulo, lambda: self.historico.por_localizacao(localizacao_id),
+                                        {'localizacao_id': localizacao.id, 'localizacao': localizacao.nome},
+                                        self._texto_movimentacao_localizacao)
+
+    def _texto_movimentacao_localizacao(self, dados: DadosRelatorio):
+        yield f"""HISTÓRICO DE MOVIMENTAÇÃO POR LOCALIZAÇÃO: {dados.metadados['localizacao'].upper()} (ID: {dados.metadados['localizacao_id']})
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
 {'='*80}\n
 """
-        if not movimentos_localizacao:
-            return report + "Nenhuma movimentação registrada nesta localização."
-
-        for mov in sorted(movimentos_localizacao, key=lambda m: m.data, reverse=True):
+        vazio = True
+        for mov in dados.linhas:
+            vazio = False
             sinal = '+' if mov.quantidade > 0 else ''
-            report += (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
-                        f"Produto: {mov.produto.nome:<20} | "
-                        f"Qtd: {sinal}{mov.quantidade:<4} | "
-                        f"Tipo: {mov.tipo:<15}\n")
-        return report
-
+            yield (f"Data: {mov.data.strftime('%d/%m/%Y %H:%M')} | "
+                   f"Produto: {mov.produto:<20} | "
+                   f"Qtd: {sinal}{mov.quantidade:<4} | "
+                   f"Tipo: {mov.tipo:<15}\n")
+        if vazio:
+            yield "Nenhuma movimentação registrada nesta localização."
 
-    def gerar_relatorio_vendas_periodo(self, data_inicio: datetime, data_fim: datetime):
-        """Gera um relatório detalhado de vendas dentro de um período de datas."""
-        vendas_periodo = [v for v in self.vendas.values() if data_inicio <= v.data <= data_fim]
+    def linhas_relatorio_movimentacao_localizacao(self, localizacao_id: int):
+        return self.dados_relatorio_movimentacao_localizacao(localizacao_id).texto()
 
-        report = f"""RELATÓRIO DE VENDAS POR PERÍODO
-Período: {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}
+    def gerar_relatorio_movimentacao_localizacao(self, localizacao_id: int):
+        """Gera um extrato de movimentações de todos os produtos em uma localização."""
+        return "".join(self.linhas_relatorio_movimentacao_localizacao(localizacao_id))
+
+    @_relatorio_em_cache('venda', 'devolucao', 'produto')
+    def dados_relatorio_vendas_periodo(self, data_inicio: datetime, data_fim: datetime) -> DadosRelatorio:
+        """Itens vendidos no período (uma linha por item, em ordem cronológica) e o resumo do período nos metadados."""
+        # já vem em ordem cronológica: busca binária em memória ou índice de vendas.data no modo preguiçoso
+        # lucro bruto = receita das vendas do período - custo congelado no momento de cada venda;
+        # as devoluções processadas no período (valendo o preço pelo qual foram vendidas) saem à parte
+        linhas = []
+        # receita e custo somados em centavos
+        total_itens_vendidos, receita_total, custo_total = 0, 0, 0
+        for venda in self.vendas.no_periodo(data_inicio, data_fim):
+            for item in venda.itens:
+                total_itens_vendidos += item.quantidade
+                receita_total += item.subtotal.centavos
+                custo_total += item.quantidade * item.custo_unitario.centavos
+                linhas.append(LinhaItemVendido(venda.id, venda.data, venda.cliente, item.produto.nome,
+                                               item.produto.tipoProduto == 'kit', item.quantidade, item.subtotal))
+
+        # os totais saem da mesma soma que monta as linhas; as devoluções contam no dia da transação financeira
+        itens_devolvidos, valor_devolvido = self.db.execute_query(
+            f"""SELECT COALESCE(SUM(idv.quantidade), 0), COALESCE(SUM(idv.quantidade * {SQL_PRECO_VENDIDO_DEVOLUCAO}), 0)
+                FROM itens_devolucao idv JOIN devolucoes d ON d.id = idv.devolucao_id
+                JOIN produtos p ON p.id = idv.produto_id
+                WHERE d.status = 'concluida'
+                  AND (SELECT MIN(t.data) FROM transacoes t WHERE t.devolucao_id = d.id) BETWEEN ? AND ?""",
+            (para_epoca(data_inicio), para_epoca(data_fim)), fetch='one')
+        metadados = {'data_inicio': data_inicio, 'data_fim': data_fim,
+                     'total_itens_vendidos': total_itens_vendidos, 'receita_total': Dinheiro(receita_total),
+                     'lucro_total': Dinheiro(receita_total - custo_total),
+                     'itens_devolvidos': itens_devolvidos, 'valor_devolvido': Dinheiro(valor_devolvido)}
+        return DadosRelatorio("Relatório de Vendas por Período", linhas, metadados, self._texto_vendas_periodo)
+
+    def _texto_vendas_periodo(self, dados: DadosRelatorio):
+        meta = dados.metadados
+        yield f"""RELATÓRIO DE VENDAS POR PERÍODO
+Período: {meta['data_inicio'].strftime('%d/%m/%Y')} a {meta['data_fim'].strftime('%d/%m/%Y')}
 {'='*70}\n
 """
-        if not vendas_periodo:
-            return report + "Nenhuma venda registrada no período selecionado."
-
-        total_itens_vendidos, receita_total, lucro_total = 0, 0.0, 0.0
+        if not dados.linhas:
+            yield "Nenhuma venda registrada no período selecionado."
+            return
+
+        # os itens de uma mesma venda vêm em sequência
+        for venda_id, itens in groupby(dados.linhas, key=lambda linha: linha.venda_id):
+            itens = list(itens)
+            yield f"Venda #{venda_id} | Data: {itens[0].data.strftime('%d/%m/%Y %H:%M')} | Cliente: {itens[0].cliente}\n"
+            for item in itens:
+                tipo_str = " (Kit)" if item.kit else ""
+                yield f"     - Produto: {item.produto:<25}{tipo_str} | Qtd: {item.quantidade}\n"
+            yield f"   Subtotal Venda: R$ {sum((item.subtotal for item in itens), Dinheiro()):.2f}\n{'-'*20}\n"
+
+        yield f"\n{'-'*30}\nRESUMO DO PERÍODO\n{'-'*30}\n"
+        yield f"Total de Itens Vendidos: {meta['total_itens_vendidos']}\n"
+        yield f"Receita Bruta Total: R$ {meta['receita_total']:.2f}\n"
+        yield f"Lucro Bruto Total: R$ {meta['lucro_total']:.2f}\n"
+        if meta['itens_devolvidos']:
+            yield f"Itens Devolvidos: {meta['itens_devolvidos']} (R$ {meta['valor_devolvido']:.2f})\n"
+
+    def linhas_relatorio_vendas_periodo(self, data_inicio: datetime, data_fim: datetime):
+        return self.dados_relatorio_vendas_periodo(data_inicio, data_fim).texto()
 
-        for venda in sorted(vendas_periodo, key=lambda v: v.data):
-            report += f"Venda #{venda.id} | Data: {venda.data.strftime('%d/%m/%Y %H:%M')} | Cliente: {venda.cliente}\n"
-            for item in venda.itens:
-                lucro_item = item.quantidade * (item.produto.preco_venda - item.produto.preco_compra)
-                total_itens_vendidos += item.quantidade
-                receita_total += item.subtotal
-                lucro_total += lucro_item
-                tipo_str = " (Kit)" if item.produto.tipoProduto == 'kit' else ""
-                report += f"     - Produto: {item.produto.nome:<25}{tipo_str} | Qtd: {item.quantidade}\n"
-            report += f"   Subtotal Venda: R$ {venda.valor_total:.2f}\n{'-'*20}\n"
-
-        report += f"\n{'-'*30}\nRESUMO DO PERÍODO\n{'-'*30}\n"
-        report += f"Total de Itens Vendidos: {total_itens_vendidos}\n"
-        report += f"Receita Bruta Total: R$ {receita_total:.2f}\n"
-        report += f"Lucro Bruto Total: R$ {lucro_total:.2f}\n"
-
-        return report
-    
-    def gerar_relatorio_kits_mais_vendidos(self) -> str:
-        """Gera um relatório com os kits mais vendidos."""
-        vendas_kits = Counter()
-        for v in self.vendas.values():
-            for item in v.itens:
-                if item.produto.tipoProduto == 'kit':
-                    vendas_kits[item.produto.nome] += item.quantidade
-        
-        report = f"""RELATÓRIO DE KITS MAIS VENDIDOS
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+    def gerar_relatorio_vendas_periodo(self, data_inicio: datetime, data_fim: datetime):
+        """Gera um relatório detalhado de vendas dentro de um período de datas."""
+        return "".join(self.linhas_relatorio_vendas_periodo(data_inicio, data_fim))
+
+    @_relatorio_em_cache('venda', 'produto')
+    def dados_relatorio_kits_mais_vendidos(self, data_inicio: datetime | None = None, data_fim: datetime | None = None) -> DadosRelatorio:
+        """Ranking dos kits mais vendidos."""
+        linhas = [LinhaRanking(i, nome, qtd)
+                  for i, (nome, qtd) in enumerate(self._ranking_vendas_resumo(apenas_kits=True, data_inicio=data_inicio, data_fim=data_fim), 1)]
+        return DadosRelatorio("Relatório de Kits Mais Vendidos", linhas,
+                              {'data_inicio': data_inicio, 'data_fim': data_fim},
+                              self._texto_kits_mais_vendidos)
+
+    def _texto_kits_mais_vendidos(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE KITS MAIS VENDIDOS
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
 {'='*60}\n
 """
-        if not vendas_kits:
-            return report + "Nenhuma venda de kit registrada."
+        if not dados.linhas:
+            yield "Nenhuma venda de kit registrada."
+            return
 
-        for i, (nome_kit, qtd) in enumerate(vendas_kits.most_common(), 1):
-            report += f"{i}º. {nome_kit} - {qtd} kits vendidos\n"
-        
-        return report
+        for linha in dados.linhas:
+            yield f"{linha.posicao}º. {linha.nome} - {linha.quantidade} kits vendidos\n"
 
-    def gerar_relatorio_componente_limitante(self) -> str:
-        """Gera um relatório que mostra qual componente está limitando a produção de cada kit."""
-        report = f"""RELATÓRIO DE COMPONENTES LIMITANTES DE KITS
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-{'='*60}\n
-"""
-        kits = [p for p in self.produtos.values() if p.tipoProduto == 'kit']
-        if not kits:
-            return report + "Nenhum kit cadastrado."
-            
-        for kit in kits:
-            report += f"--- Kit: {kit.nome} (Máx: {kit.get_estoque_total()} montagens) ---\n"
+    def linhas_relatorio_kits_mais_vendidos(self, data_inicio: datetime | None = None, data_fim: datetime | None = None):
+        return self.dados_relatorio_kits_mais_vendidos(data_inicio, data_fim).texto()
+
+    def gerar_relatorio_kits_mais_vendidos(self, data_inicio: datetime | None = None, data_fim: datetime | None = None) -> str:
+        """Gera um relatório com os kits mais vendidos."""
+        return "".join(self.linhas_relatorio_kits_mais_vendidos(data_inicio, data_fim))
+
+    @_relatorio_em_cache('produto', 'estoque', 'kit')
+    def dados_relatorio_componente_limitante(self) -> DadosRelatorio:
+        """Uma linha por componente de cada kit, marcando o que limita as montagens."""
+        linhas = []
+        for kit in self.produtos.values():
+            if kit.tipoProduto != 'kit':
+                continue
+            montagens = kit.get_estoque_total()
             if not kit.componentes:
-                report += "   - Sem componentes definidos.\n\n"
+                linhas.append(LinhaComponenteKit(kit.id, kit.nome, montagens, None, 0, 0, 0, False))
                 continue
-
-            componente_limitante = None
-            menor_estoque_relativo = float('inf')
-
+            componentes = []
             for comp in kit.componentes:
                 estoque_total_comp = comp.produto.get_estoque_total()
-                estoque_relativo = estoque_total_comp // comp.quantidade
-                report += f"   - Componente: {comp.produto.nome} (Necessário: {comp.quantidade}, Estoque: {estoque_total_comp}) -> Permite {estoque_relativo} montagens\n"
-                
-                if estoque_relativo < menor_estoque_relativo:
-                    menor_estoque_relativo = estoque_relativo
-                    componente_limitante = comp.produto.nome
+                componentes.append([comp.produto.nome, comp.quantidade, estoque_total_comp, estoque_total_comp // comp.quantidade])
+            # o primeiro com o menor número de montagens é o limitante
+            limitante = min(range(len(componentes)), key=lambda i: componentes[i][3])
+            linhas.extend(LinhaComponenteKit(kit.id, kit.nome, montagens, *dados_comp, i == limitante)
+                          for i, dados_comp in enumerate(componentes))
+        return DadosRelatorio("Relatório de Componentes Limitantes de Kits", linhas, {},
+                              self._texto_componente_limitante)
+
+    def _texto_componente_limitante(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE COMPONENTES LIMITANTES DE KITS
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
+{'='*60}\n
+"""
+        if not dados.linhas:
+            yield "Nenhum kit cadastrado."
+            return
+
+        for _, componentes in groupby(dados.linhas, key=lambda linha: linha.kit_id):
+            componentes = list(componentes)
+            yield f"--- Kit: {componentes[0].kit} (Máx: {componentes[0].montagens_kit} montagens) ---\n"
+            if componentes[0].componente is None:
+                yield "   - Sem componentes definidos.\n\n"
+                continue
+            for comp in componentes:
+                yield f"   - Componente: {comp.componente} (Necessário: {comp.necessario}, Estoque: {comp.estoque}) -> Permite {comp.permite} montagens\n"
+            componente_limitante = next((comp.componente for comp in componentes if comp.limitante), None)
+            yield f"   > Fator Limitante: {componente_limitante or 'N/A'}\n\n"
 
-            report += f"   > Fator Limitante: {componente_limitante or 'N/A'}\n\n"
-        
-        return report
+    def linhas_relatorio_componente_limitante(self):
+        return self.dados_relatorio_componente_limitante().texto()
+
+    def gerar_relatorio_componente_limitante(self) -> str:
+        """Gera um relatório que mostra qual componente está limitando a produção de cada kit."""
+        return "".join(self.linhas_relatorio_componente_limitante())
 
     def iniciar_devolucao(self, venda_id: int, itens_devolucao_info: list[dict], observacoes: str) -> Devolucao:
         """Inicia um novo processo de devolução no banco de dados e em memória."""
@@ -916,22 +1748,27 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
             if not item_vendido or qtd_devolvida > item_vendido.quantidade:
                 raise ValueError(f"Quantidade de devolução para o produto ID {produto_id} excede a quantidade vendida.")
 
-        agora = datetime.now()
-        query_dev = "INSERT INTO devolucoes (venda_original_id, cliente_nome, status, data, observacoes) VALUES (?, ?, ?, ?, ?)"
-        novo_id_dev = self.db.execute_query(query_dev, (venda_id, venda_original.cliente, "solicitada", agora.isoformat(), observacoes))
-
         itens_dev_obj = []
         for item_dev_info in itens_devolucao_info:
             produto = self.produtos[item_dev_info['produto_id']]
-            query_item = "INSERT INTO itens_devolucao (devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto) VALUES (?, ?, ?, ?, ?)"
-            self.db.execute_query(query_item, (novo_id_dev, produto.id, item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao']))
-            itens_dev_obj.append(ItemDevolucao(produto, item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao']))
+            itens_dev_obj.append(ItemDevolucao(produto, item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao'],
+                                               venda_original.preco_vendido(produto)))
+
+        agora = datetime.now()
+        with self.db.transacao():
+            query_dev = "INSERT INTO devolucoes (venda_original_id, cliente_nome, status, data, observacoes) VALUES (?, ?, ?, ?, ?)"
+            novo_id_dev = self.db.execute_query(query_dev, (venda_id, venda_original.cliente, "solicitada", para_epoca(agora), observacoes))
+            self.db.insert_rows(
+                "itens_devolucao", ("devolucao_id", "produto_id", "quantidade", "motivo_devolucao", "condicao_produto"),
+                [(novo_id_dev, item.produto.id, item.quantidade, item.motivo_devolucao, item.condicao_produto) for item in itens_dev_obj]
+            )
         
         nova_devolucao = Devolucao(novo_id_dev, venda_original, venda_original.cliente, itens_dev_obj, "solicitada", agora, observacoes)
         self.devolucoes[novo_id_dev] = nova_devolucao
+        self._invalidar_relatorios('devolucao')
         return nova_devolucao
 
-    def processar_devolucao_e_troca(self, devolucao_id: int, local_retorno_id: int, acao: str, itens_troca_info: list[dict] | None = None) -> tuple[Devolucao, float]:
+    def processar_devolucao_e_troca(self, devolucao_id: int, local_retorno_id: int, acao: str, itens_troca_info: list[dict] | None = None) -> tuple[Devolucao, Dinheiro]:
         """Processa uma devolução, atualizando o estoque e, opcionalmente, gerando uma troca."""
         if not (devolucao := self.devolucoes.get(devolucao_id)):
             raise ValueError("Devolução não encontrada.")
@@ -940,81 +1777,96 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
         if not (local_retorno := self.localizacoes.get(local_retorno_id)):
             raise ValueError("Localização de retorno do estoque inválida.")
 
-        # Passo 1: Retorna os itens devolvidos ao estoque
-        for item in devolucao.itens:
-            produto_devolvido = item.produto
-            # Se um kit for devolvido, o estoque de seus componentes retorna.
-            if produto_devolvido.tipoProduto == 'kit':
-                for comp in produto_devolvido.componentes:
-                    qtd_retorno = item.quantidade * comp.quantidade
-                    self.movimentar_estoque(
-                        produto_id=comp.produto.id,
-                        localizacao_id=local_retorno_id,
-                        quantidade=qtd_retorno,
-                        tipo_movimento=f"Retorno Componente Kit Dev. #{devolucao.id}"
-                    )
-            else: # Produto individual
-                self.movimentar_estoque(
-                    produto_id=item.produto.id,
-                    localizacao_id=local_retorno_id,
-                    quantidade=item.quantidade,
-                    tipo_movimento=f"Devolução #{devolucao.id} - Retorno de Produto"
-                )
-        
         valor_credito = devolucao.valor_total_devolvido
-        valor_troca_paga = 0.0
-
-        # Passo 2: Lida com a ação (reembolso ou troca)
-        if acao == 'troca' and itens_troca_info:
-            # Processa a nova "venda" da troca, mas sem alterar o estoque temporário
-            itens_nova_venda = []
-            for item_troca_info in itens_troca_info:
-                produto = self.produtos.get(item_troca_info['produto_id'])
-                if not produto: raise ValueError(f"Produto de troca com ID {item_troca_info['produto_id']} não encontrado.")
-                itens_nova_venda.append({'produto_id': produto.id, 'quantidade': item_troca_info['quantidade']})
-            
-            # Registra a nova venda da troca e calcula o valor a pagar/creditar
-            nova_venda, _ = self.registrar_venda(itens_nova_venda, devolucao.cliente_nome, local_retorno_id)
-            devolucao.nova_venda_troca = nova_venda
-            
-            valor_total_troca = nova_venda.valor_total
-            valor_troca_paga = max(0, valor_total_troca - valor_credito)
-            tipo_transacao = "pagamento_troca" if valor_troca_paga > 0 else "credito_troca"
-            
-            valor_final_transacao = valor_troca_paga if valor_troca_paga > 0 else (valor_credito - valor_total_troca)
-            
+        valor_troca_paga = Dinheiro()
+        nova_venda = None
+
+        # devolução, troca, transação financeira e mudança de status formam uma única unidade de trabalho
+        with self.db.transacao():
+            # Passo 1: Retorna os itens devolvidos ao estoque
+            movimentos_retorno = []
+            for item in devolucao.itens:
+                produto_devolvido = item.produto
+                # Se um kit for devolvido, o estoque de seus componentes retorna.
+                if produto_devolvido.tipoProduto == 'kit':
+                    for comp in produto_devolvido.componentes:
+                        qtd_retorno = item.quantidade * comp.quantidade
+                        movimentos_retorno.append((comp.produto.id, local_retorno_id, qtd_retorno, f"Retorno Componente Kit Dev. #{devolucao.id}",
+                                                   TipoMovimento.DEVOLUCAO_COMPONENTE_KIT, devolucao.id))
+                else: # Produto individual
+                    movimentos_retorno.append((item.produto.id, local_retorno_id, item.quantidade, f"Devolução #{devolucao.id} - Retorno de Produto",
+                                               TipoMovimento.DEVOLUCAO, devolucao.id))
+            self.movimentar_estoque_em_lote(movimentos_retorno)
+            # nos resumos a devolução vale o mesmo subtotal do reembolso: o preço pelo qual o item foi vendido
+            self._somar_resumo_vendas(datetime.now(), local_retorno_id, [
+                (item.produto.id, 0, Dinheiro(), Dinheiro(), item.quantidade, item.subtotal)
+                for item in devolucao.itens
+            ])
+
+            # Passo 2: Lida com a ação (reembolso ou troca)
+            if acao == 'troca' and itens_troca_info:
+                # Processa a nova "venda" da troca, mas sem alterar o estoque temporário
+                itens_nova_venda = []
+                for item_troca_info in itens_troca_info:
+                    produto = self.produtos.get(item_troca_info['produto_id'])
+                    if not produto: raise ValueError(f"Produto de troca com ID {item_troca_info['produto_id']} não encontrado.")
+                    itens_nova_venda.append({'produto_id': produto.id, 'quantidade': item_troca_info['quantidade']})
+
+                # Registra a nova venda da troca e calcula o valor a pagar/creditar
+                nova_venda, _ = self.registrar_venda(itens_nova_venda, devolucao.cliente_nome, local_retorno_id)
+
+                valor_total_troca = nova_venda.valor_total
+                valor_troca_paga = max(Dinheiro(), valor_total_troca - valor_credito)
+                tipo_transacao = "pagamento_troca" if valor_troca_paga > 0 else "credito_troca"
+
+                valor_final_transacao = valor_troca_paga if valor_troca_paga > 0 else (valor_credito - valor_total_troca)
+
+            else: # Ação é 'reembolso'
+                tipo_transacao, valor_final_transacao = "reembolso", valor_credito
+
             # Insere a transação no banco
             query_trans = "INSERT INTO transacoes (devolucao_id, tipo, valor, data) VALUES (?, ?, ?, ?)"
-            trans_id = self.db.execute_query(query_trans, (devolucao.id, tipo_transacao, valor_final_transacao, datetime.now().isoformat()))
-            devolucao.transacao = Transacao(trans_id, devolucao.id, tipo_transacao, valor_final_transacao)
+            trans_id = self.db.execute_query(query_trans, (devolucao.id, tipo_transacao, valor_final_transacao, para_epoca(datetime.now())))
 
-        else: # Ação é 'reembolso'
-            query_trans = "INSERT INTO transacoes (devolucao_id, tipo, valor, data) VALUES (?, ?, ?, ?)"
-            trans_id = self.db.execute_query(query_trans, (devolucao.id, "reembolso", valor_credito, datetime.now().isoformat()))
-            devolucao.transacao = Transacao(trans_id, devolucao.id, "reembolso", valor_credito)
+            # Passo 3: Atualiza o status da devolução para 'concluida'
+            self.db.execute_query("UPDATE devolucoes SET status = 'concluida' WHERE id = ?", (devolucao.id,))
 
-        # Passo 3: Atualiza o status da devolução para 'concluida'
-        self.db.execute_query("UPDATE devolucoes SET status = 'concluida' WHERE id = ?", (devolucao.id,))
+        # só depois do commit o objeto em memória é atualizado
+        if nova_venda:
+            devolucao.nova_venda_troca = nova_venda
+        devolucao.transacao = Transacao(trans_id, devolucao.id, tipo_transacao, valor_final_transacao)
         devolucao.status = 'concluida'
+        self._invalidar_relatorios('devolucao')
         
         return devolucao, valor_troca_paga
 
-    def gerar_relatorio_devolucoes_por_motivo(self):
-        """gera um relatório de devoluções agrupadas por motivo"""
-        report = f"""RELATÓRIO DE DEVOLUÇÕES POR MOTIVO
-Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-{'='*70}\n
-"""
+    @_relatorio_em_cache('devolucao')
+    def dados_relatorio_devolucoes_por_motivo(self) -> DadosRelatorio:
+        """devoluções agrupadas por motivo, com a quantidade de itens de cada um"""
         motivos = Counter()
         for devolucao in self.devolucoes.values():
             for item in devolucao.itens:
                 motivos[item.motivo_devolucao] += item.quantidade
-        
-        if not motivos:
-            return report + "Nenhuma devolução registrada."
+        linhas = [LinhaMotivoDevolucao(motivo, qtd) for motivo, qtd in motivos.items()]
+        return DadosRelatorio("Relatório de Devoluções por Motivo", linhas, {},
+                              self._texto_devolucoes_por_motivo)
 
-        for motivo, qtd in motivos.items():
-            report += f"Motivo: {motivo:<30} | Quantidade de Itens: {qtd}\n"
-        
-        return report
+    def _texto_devolucoes_por_motivo(self, dados: DadosRelatorio):
+        yield f"""RELATÓRIO DE DEVOLUÇÕES POR MOTIVO
+Data de Geração: {dados.metadados['gerado_em'].strftime('%d/%m/%Y %H:%M:%S')}
+{'='*70}\n
+"""
+        if not dados.linhas:
+            yield "Nenhuma devolução registrada."
+            return
+
+        for linha in dados.linhas:
+            yield f"Motivo: {linha.motivo:<30} | Quantidade de Itens: {linha.quantidade}\n"
+
+    def linhas_relatorio_devolucoes_por_motivo(self):
+        return self.dados_relatorio_devolucoes_por_motivo().texto()
+
+    def gerar_relatorio_devolucoes_por_motivo(self):
+        """gera um relatório de devoluções agrupadas por motivo"""
+        return "".join(self.linhas_relatorio_devolucoes_por_motivo())
     #endregion
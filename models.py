@@ -1,15 +1,168 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from typing import List, Optional, Dict
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from enum import IntEnum
+from collections.abc import MutableMapping
+from array import array
 import copy
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Iterator, NamedTuple
 import json
 import csv
 
 from io import StringIO
+from decimal import Decimal, ROUND_HALF_UP
+from numbers import Number
+
+
+# =============================================
+# DINHEIRO (centavos inteiros)
+# =============================================
+
+class Dinheiro:
+    """
+    Valor em reais guardado como centavos inteiros (é assim que vai pro banco também).
+    Soma, subtração e quantidade x preço são contas de inteiro, então somar milhões de linhas não
+    acumula erro; só a multiplicação/divisão por fração (desconto de 10%, por exemplo) arredonda,
+    meio centavo pra cima. Formata como número em reais: f"R$ {valor:,.2f}".
+    O construtor recebe centavos (int); reais entram pelo de_reais. Soma, subtração e comparação são
+    só entre Dinheiros, fora o 0 inteiro (o começo do sum() e o "valor < 0"): um número solto não
+    tem como dizer se é real ou centavo.
+    """
+    __slots__ = ('centavos',)
+
+    def __init__(self, centavos: int = 0):
+        if not isinstance(centavos, int) or isinstance(centavos, bool):
+            raise TypeError(f"Dinheiro recebe centavos inteiros, não {type(centavos).__name__}; "
+                            "para valores em reais use Dinheiro.de_reais")
+        self.centavos = centavos
+
+    @classmethod
+    def de_reais(cls, valor) -> 'Dinheiro':
+        """12.5, '12.50', Decimal ou Dinheiro -> Dinheiro; o float é lido pelo texto dele (0.1 é 10 centavos, não 10.000000000000000555)"""
+        if isinstance(valor, Dinheiro):
+            return valor
+        if isinstance(valor, int):
+            return cls(valor * 100)
+        return cls(int((Decimal(str(valor)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    def reais(self) -> Decimal:
+        return Decimal(self.centavos).scaleb(-2)
+
+    def _arredondar(self, valor: Decimal) -> 'Dinheiro':
+        return Dinheiro(int(valor.quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    @staticmethod
+    def _centavos_de(outro) -> int | None:
+        """centavos do outro lado de uma soma/comparação: outro Dinheiro ou o 0 inteiro; None para o resto"""
+        if isinstance(outro, Dinheiro):
+            return outro.centavos
+        if type(outro) is int and outro == 0:
+            return 0
+        return None
+
+    # --- contas ---
+    def __add__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return Dinheiro(self.centavos + centavos)
+
+    __radd__ = __add__  # sum() começa do 0
+
+    def __sub__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return Dinheiro(self.centavos - centavos)
+
+    def __rsub__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return Dinheiro(centavos - self.centavos)
+
+    def __mul__(self, fator):
+        """preço x quantidade (exato) ou x fração (arredonda)"""
+        if isinstance(fator, int) and not isinstance(fator, bool):
+            return Dinheiro(self.centavos * fator)
+        if isinstance(fator, Number) and not isinstance(fator, Dinheiro):
+            return self._arredondar(self.centavos * Decimal(str(fator)))
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, divisor):
+        if isinstance(divisor, Dinheiro):
+            return self.centavos / divisor.centavos
+        if isinstance(divisor, Number):
+            return self._arredondar(self.centavos / Decimal(str(divisor)))
+        return NotImplemented
+
+    def __neg__(self):
+        return Dinheiro(-self.centavos)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Dinheiro(abs(self.centavos))
+
+    # --- comparação (com outro Dinheiro ou com 0) ---
+    def __eq__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return self.centavos == centavos
+
+    def __lt__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return self.centavos < centavos
+
+    def __le__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return self.centavos <= centavos
+
+    def __gt__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return self.centavos > centavos
+
+    def __ge__(self, outro):
+        if (centavos := self._centavos_de(outro)) is None:
+            return NotImplemented
+        return self.centavos >= centavos
+
+    def __hash__(self):
+        # Dinheiro(0) == 0, e hash(0) também é 0
+        return hash(self.centavos)
+
+    def __bool__(self):
+        return self.centavos != 0
+
+    # --- conversão e exibição ---
+    def __float__(self):
+        return self.centavos / 100
+
+    def __round__(self, casas=None):
+        return round(self.reais(), casas) if casas is not None else round(self.reais())
+
+    def __format__(self, especificacao):
+        return format(self.reais(), especificacao) if especificacao else str(self)
+
+    def __str__(self):
+        return f"{self.reais():.2f}"
+
+    def __repr__(self):
+        return f"Dinheiro({self.centavos})"
+
+
+def _json_padrao(valor):
+    """default dos json.dumps dos relatórios: dinheiro sai como número, o resto (datas...) como texto"""
+    if isinstance(valor, Dinheiro):
+        return float(valor)
+    return str(valor)
+
 
 # =============================================
 # PADRÃO ESTRUTURAL 1: ADAPTER
@@ -22,6 +175,11 @@ class FormatoRelatorio(ABC):
     def formatar(self, dados: Dict[str, Any]) -> str:
         pass
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        """Escreve o relatório num arquivo aberto (ou qualquer objeto com .write).
+        Os formatos que sabem fazer isso aos poucos sobrescrevem; o padrão monta a string inteira."""
+        destino.write(self.formatar(dados))
+
 
 class RelatorioTexto(FormatoRelatorio):
     """Formato texto simples (formato original)"""
@@ -32,16 +190,69 @@ class RelatorioTexto(FormatoRelatorio):
         except Exception as e:
             return f"Erro ao formatar relatório: {e}"
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        # 'conteudo_em_partes' é o texto ainda por gerar, pedaço por pedaço
+        if 'conteudo_em_partes' not in dados:
+            return super().escrever(dados, destino)
+        for pedaco in dados['conteudo_em_partes']:
+            destino.write(pedaco)
+
 
 class RelatorioJSON(FormatoRelatorio):
     """Formato JSON"""
     
     def formatar(self, dados: Dict[str, Any]) -> str:
         try:
-            return json.dumps(dados, indent=2, ensure_ascii=False)
+            # _json_padrao para dinheiro, datas e outros valores que o json não conhece
+            return json.dumps(dados, indent=2, ensure_ascii=False, default=_json_padrao)
+        except Exception as e:
+            return f"Erro ao formatar relatório: {e}"
+
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        """Mesmo JSON do formatar, mas os 'items' são escritos um por vez (podem vir de um iterador)."""
+        try:
+            def dumps(valor, recuo):
+                return json.dumps(valor, indent=2, ensure_ascii=False, default=_json_padrao).replace("\n", "\n" + " " * recuo)
+
+            destino.write("{")
+            for i, (chave, valor) in enumerate(dados.items()):
+                destino.write(("," if i else "") + "\n  " + dumps(chave, 2) + ": ")
+                if chave != 'items':
+                    destino.write(dumps(valor, 2))
+                    continue
+                destino.write("[")
+                vazio = True
+                for item in valor:
+                    destino.write(("\n    " if vazio else ",\n    ") + dumps(item, 4))
+                    vazio = False
+                destino.write("]" if vazio else "\n  ]")
+            destino.write("\n}" if dados else "}")
+        except Exception as e:
+            print(f"Erro ao escrever relatório JSON: {e}")
+            raise
+
+
+class RelatorioNDJSON(FormatoRelatorio):
+    """Formato NDJSON: um objeto JSON por linha, uma linha por item (bom para ler linha a linha)"""
+
+    def _linhas(self, dados: Dict[str, Any]):
+        for item in dados.get('items', [dados]):
+            yield json.dumps(item, ensure_ascii=False, default=_json_padrao) + "\n"
+
+    def formatar(self, dados: Dict[str, Any]) -> str:
+        try:
+            return "".join(self._linhas(dados))
         except Exception as e:
             return f"Erro ao formatar relatório: {e}"
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        try:
+            for linha in self._linhas(dados):
+                destino.write(linha)
+        except Exception as e:
+            print(f"Erro ao escrever relatório NDJSON: {e}")
+            raise
+
 class RelatorioCSV(FormatoRelatorio):
     """Formato CSV"""
     
@@ -60,6 +271,24 @@ class RelatorioCSV(FormatoRelatorio):
         except Exception as e:
             return f"Erro ao formatar relatório: {e}"
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        """Escreve linha a linha; 'items' pode ser um iterador (o cabeçalho sai das chaves do primeiro item)."""
+        try:
+            if 'items' not in dados:
+                destino.write(dados.get('conteudo', ''))
+                return
+            itens = iter(dados['items'])
+            if (primeiro := next(itens, None)) is None:
+                return
+            writer = csv.DictWriter(destino, fieldnames=primeiro.keys())
+            writer.writeheader()
+            writer.writerow(primeiro)
+            for item in itens:
+                writer.writerow(item)
+        except Exception as e:
+            print(f"Erro ao escrever relatório CSV: {e}")
+            raise
+
 
 class AdaptadorRelatorio:
     """
@@ -76,6 +305,10 @@ class AdaptadorRelatorio:
             return self._formato.formatar(dados)
         except Exception as e:
             return f"Erro ao gerar relatório: {e}"
+
+    def escrever_relatorio(self, dados: Dict[str, Any], destino) -> None:
+        """Escreve o relatório no formato especificado direto em 'destino', sem montar a string inteira"""
+        self._formato.escrever(dados, destino)
     
     def set_formato(self, formato: FormatoRelatorio):
         """Permite trocar o formato """
@@ -129,6 +362,9 @@ class RelatorioDecorator(FormatoRelatorio):
         except Exception as e:
             return f"Erro ao formatar relatório: {e}"
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        self._relatorio.escrever(dados, destino)
+
 
 class RelatorioComCabecalho(RelatorioDecorator):
    
@@ -140,6 +376,10 @@ class RelatorioComCabecalho(RelatorioDecorator):
         except Exception as e: 
             return f"Erro ao formatar relatório com cabeçalho: {e}"
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        destino.write(f"=== {dados.get('titulo', 'Relatório')} ===\nGerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n\n")
+        self._relatorio.escrever(dados, destino)
+
 
 class RelatorioComRodape(RelatorioDecorator):
     def formatar(self, dados: Dict[str, Any]) -> str:
@@ -150,6 +390,149 @@ class RelatorioComRodape(RelatorioDecorator):
         except Exception as e:
             return f"Erro ao formatar relatório com rodapé: {e}"
 
+    def escrever(self, dados: Dict[str, Any], destino) -> None:
+        self._relatorio.escrever(dados, destino)
+        destino.write("\n\n--------------------")
+
+# =============================================
+# DADOS ESTRUTURADOS DE RELATÓRIO
+# =============================================
+
+@dataclass
+class DadosRelatorio:
+    """
+    Resultado de um relatório do gerenciador: linhas tipadas + metadados.
+    O mesmo objeto vira texto, CSV ou JSON sem recalcular nada.
+    O 'gerado_em' não fica guardado: entra nos metadados na hora de gerar o texto ou exportar,
+    então um relatório que veio do cache mostra a hora em que foi visto de novo.
+
+    """
+    titulo: str
+    linhas: list
+    metadados: Dict[str, Any] = field(default_factory=dict)
+    # gera o texto "bonito" do relatório a partir das linhas; sem ele sai uma tabela simples
+    renderizador: Optional[Callable[['DadosRelatorio'], Iterator[str]]] = field(default=None, repr=False, compare=False)
+
+    def iterar_dicts(self) -> Iterator[Dict[str, Any]]:
+        """linhas como dicionários (o formato que os formatos esperam em 'items'), uma por vez"""
+        for linha in self.linhas:
+            yield linha._asdict() if hasattr(linha, '_asdict') else dict(linha)
+
+    def como_dicts(self) -> List[Dict[str, Any]]:
+        return list(self.iterar_dicts())
+
+    def _metadados_na_hora(self) -> Dict[str, Any]:
+        return {'gerado_em': datetime.now(), **self.metadados}
+
+    def texto(self) -> Iterator[str]:
+        """o relatório em texto, pedaço por pedaço"""
+        if erro := self.metadados.get('erro'):
+            yield erro
+            return
+        if self.renderizador:
+            yield from self.renderizador(replace(self, metadados=self._metadados_na_hora()))
+            return
+        yield f"{self.titulo}\n{'='*60}\n"
+        for linha in self.como_dicts():
+            yield " | ".join(f"{chave}: {valor}" for chave, valor in linha.items()) + "\n"
+
+    def para_dict(self, com_texto: bool = True) -> Dict[str, Any]:
+        """dicionário no formato dos FormatoRelatorio: 'conteudo' para o texto e 'items' para as linhas"""
+        dados = {'titulo': self.titulo, 'metadados': self._metadados_na_hora(), 'items': self.como_dicts()}
+        if com_texto:
+            dados['conteudo'] = "".join(self.texto())
+        return dados
+
+    def para_fluxo(self, com_texto: bool = True) -> Dict[str, Any]:
+        """como o para_dict, mas com as linhas e o texto ainda por gerar: é o que os escrever() dos formatos consomem aos poucos"""
+        dados = {'titulo': self.titulo, 'metadados': self._metadados_na_hora(), 'items': self.iterar_dicts()}
+        if com_texto:
+            dados['conteudo_em_partes'] = self.texto()
+        return dados
+
+
+class LinhasSobDemanda:
+    """
+    Linhas de relatório que são geradas de novo a cada iteração em vez de ficarem guardadas numa lista.
+    Para relatórios do tamanho do histórico inteiro.
+
+    """
+    def __init__(self, gerar: Callable[[], Iterator]):
+        self._gerar = gerar
+
+    def __iter__(self):
+        return iter(self._gerar())
+
+    def __bool__(self):
+        return next(iter(self), None) is not None
+
+
+class LinhaEstoqueProduto(NamedTuple):
+    id: int
+    nome: str
+    categoria: str
+    tipo_produto: str
+    estoque_total: int
+    ponto_ressuprimento: int
+    preco_compra: Dinheiro
+    preco_venda: Dinheiro
+    estoque_por_local: Dict[str, int]
+    componentes: List[tuple]  # (quantidade, nome do componente)
+
+
+class LinhaValor(NamedTuple):
+    agrupamento: str  # 'localizacao' ou 'categoria'
+    nome: Optional[str]
+    valor: Dinheiro
+
+
+class LinhaBaixoEstoque(NamedTuple):
+    id: int
+    nome: str
+    estoque_atual: int
+    ponto_ressuprimento: int
+
+
+class LinhaRanking(NamedTuple):
+    posicao: int
+    nome: str
+    quantidade: int
+
+
+class LinhaMovimento(NamedTuple):
+    data: datetime
+    tipo: str
+    produto: str
+    quantidade: int
+    localizacao: str
+
+
+class LinhaItemVendido(NamedTuple):
+    venda_id: int
+    data: datetime
+    cliente: str
+    produto: str
+    kit: bool
+    quantidade: int
+    subtotal: Dinheiro
+
+
+class LinhaComponenteKit(NamedTuple):
+    kit_id: int
+    kit: str
+    montagens_kit: int
+    componente: Optional[str]  # None quando o kit não tem componentes
+    necessario: int
+    estoque: int
+    permite: int
+    limitante: bool
+
+
+class LinhaMotivoDevolucao(NamedTuple):
+    motivo: str
+    quantidade: int
+
+
 @dataclass
 class Fornecedor:
     """dados de contato de um fornecedor"""
@@ -189,6 +572,234 @@ class ComponenteKit:
     produto: 'Produto' # Referência ao objeto Produto do componente
     quantidade: int # Quantidade deste componente necessária para montar UM kit
 
+
+class EstoquePorLocal(defaultdict):
+    """
+    Dicionário nome da localização -> quantidade que mantém o total sempre somado.
+    Cada escrita ajusta 'total' pela diferença, em O(1).
+    """
+    def __init__(self, dados=None):
+        super().__init__(int)
+        self.total = 0
+        if dados:
+            self.update(dados)
+
+    def __setitem__(self, local, quantidade):
+        self.total += quantidade - self.get(local, 0)
+        super().__setitem__(local, quantidade)
+
+    def __delitem__(self, local):
+        self.total -= self[local]
+        super().__delitem__(local)
+
+    def pop(self, local, *padrao):
+        if local in self:
+            quantidade = self[local]
+            del self[local]
+            return quantidade
+        return super().pop(local, *padrao)
+
+    def popitem(self):
+        local, quantidade = super().popitem()
+        self.total -= quantidade
+        return local, quantidade
+
+    def setdefault(self, local, padrao=0):
+        if local not in self:
+            self[local] = padrao
+        return self[local]
+
+    def update(self, *args, **kwargs):
+        for local, quantidade in dict(*args, **kwargs).items():
+            self[local] = quantidade
+
+    def clear(self):
+        super().clear()
+        self.total = 0
+
+    def copy(self):
+        return EstoquePorLocal(self)
+
+    def __reduce__(self):
+        # pickle/deepcopy remontam pelo construtor, então o total é recalculado na volta
+        return (self.__class__, (dict(self),))
+
+
+class MatrizEstoque:
+    """
+    Estoque de todos os produtos numa matriz produto x localização, indexada pelos ids.
+    Cada produto é uma linha (array de inteiros, uma posição por localização) e cada localização
+    uma coluna. O nome da localização só existe no mapeamento de colunas, então renomear é O(1).
+    Os totais por produto (linha) e por localização (coluna) são ajustados a cada escrita.
+    """
+    def __init__(self):
+        self._linhas: dict[int, array] = {}
+        self._total_linha: dict[int, int] = {}
+        self._colunas: dict[int, int] = {}  # localizacao_id -> coluna
+        self._coluna_por_nome: dict[str, int] = {}
+        self._localizacao_da_coluna: list[Optional[int]] = []  # None = coluna livre (localização removida)
+        self._nome_da_coluna: list[Optional[str]] = []
+        self._total_coluna = array('q')
+        self._colunas_livres: list[int] = []
+
+    # --- localizações (colunas) ---
+
+    def adicionar_localizacao(self, localizacao_id: int, nome: str):
+        if localizacao_id in self._colunas:
+            self.renomear_localizacao(localizacao_id, nome)
+            return
+        if self._colunas_livres:
+            coluna = self._colunas_livres.pop()
+            self._localizacao_da_coluna[coluna], self._nome_da_coluna[coluna] = localizacao_id, nome
+        else:
+            # as linhas não crescem agora: uma posição além do fim do array vale 0
+            coluna = len(self._localizacao_da_coluna)
+            self._localizacao_da_coluna.append(localizacao_id)
+            self._nome_da_coluna.append(nome)
+            self._total_coluna.append(0)
+        self._colunas[localizacao_id] = coluna
+        self._coluna_por_nome[nome] = coluna
+
+    def renomear_localizacao(self, localizacao_id: int, nome: str):
+        coluna = self._colunas[localizacao_id]
+        self._coluna_por_nome.pop(self._nome_da_coluna[coluna], None)
+        self._nome_da_coluna[coluna] = nome
+        self._coluna_por_nome[nome] = coluna
+
+    def remover_localizacao(self, localizacao_id: int):
+        """zera a coluna (percorre as linhas uma vez) e deixa ela livre para a próxima localização"""
+        if (coluna := self._colunas.pop(localizacao_id, None)) is None:
+            return
+        for produto_id, linha in self._linhas.items():
+            if coluna < len(linha) and linha[coluna]:
+                self._total_linha[produto_id] -= linha[coluna]
+                linha[coluna] = 0
+        self._total_coluna[coluna] = 0
+        self._coluna_por_nome.pop(self._nome_da_coluna[coluna], None)
+        self._localizacao_da_coluna[coluna] = self._nome_da_coluna[coluna] = None
+        self._colunas_livres.append(coluna)
+
+    def coluna_do_nome(self, nome: str) -> Optional[int]:
+        return self._coluna_por_nome.get(nome)
+
+    # --- células ---
+
+    def get(self, produto_id: int, localizacao_id: int) -> int:
+        coluna = self._colunas.get(localizacao_id)
+        linha = self._linhas.get(produto_id)
+        if coluna is None or linha is None or coluna >= len(linha):
+            return 0
+        return linha[coluna]
+
+    def definir(self, produto_id: int, localizacao_id: int, quantidade: int):
+        self._definir_coluna(produto_id, self._colunas[localizacao_id], quantidade)
+
+    def _definir_coluna(self, produto_id: int, coluna: int, quantidade: int):
+        linha = self._linhas.get(produto_id)
+        if linha is None:
+            linha = self._linhas[produto_id] = array('q')
+            self._total_linha[produto_id] = 0
+        if coluna >= len(linha):
+            linha.extend([0] * (coluna + 1 - len(linha)))
+        diferenca = quantidade - linha[coluna]
+        linha[coluna] = quantidade
+        self._total_linha[produto_id] += diferenca
+        self._total_coluna[coluna] += diferenca
+
+    def _valor_coluna(self, produto_id: int, coluna: int) -> int:
+        linha = self._linhas.get(produto_id)
+        return linha[coluna] if linha is not None and coluna < len(linha) else 0
+
+    # --- produtos (linhas) ---
+
+    def limpar_produto(self, produto_id: int):
+        """tira a linha do produto (estoque zerado em todos os locais)"""
+        if (linha := self._linhas.pop(produto_id, None)) is None:
+            return
+        for coluna, quantidade in enumerate(linha):
+            self._total_coluna[coluna] -= quantidade
+        del self._total_linha[produto_id]
+
+    def itens_produto(self, produto_id: int):
+        """(localizacao_id, quantidade) das posições não zeradas do produto"""
+        for coluna, quantidade in enumerate(self._linhas.get(produto_id, ())):
+            if quantidade:
+                yield self._localizacao_da_coluna[coluna], quantidade
+
+    # --- totais ---
+
+    def total_produto(self, produto_id: int) -> int:
+        return self._total_linha.get(produto_id, 0)
+
+    def total_localizacao(self, localizacao_id: int) -> int:
+        coluna = self._colunas.get(localizacao_id)
+        return self._total_coluna[coluna] if coluna is not None else 0
+
+    def totais_por_localizacao(self) -> dict[int, int]:
+        return {localizacao_id: self._total_coluna[coluna] for localizacao_id, coluna in self._colunas.items()}
+
+    def conferir_totais(self) -> bool:
+        """refaz as somas de linhas e colunas direto dos arrays e compara com os totais mantidos"""
+        colunas = array('q', [0] * len(self._total_coluna))
+        for produto_id, linha in self._linhas.items():
+            if sum(linha) != self._total_linha[produto_id]:
+                return False
+            for coluna, quantidade in enumerate(linha):
+                colunas[coluna] += quantidade
+        return colunas == self._total_coluna
+
+    def visao(self, produto_id: int) -> 'VisaoEstoqueProduto':
+        return VisaoEstoqueProduto(self, produto_id)
+
+
+class VisaoEstoqueProduto(MutableMapping):
+    """
+    O estoque_por_local de um produto gerenciado: nome da localização -> quantidade, lido e escrito
+    direto na linha do produto na MatrizEstoque (não guarda nada). Itera só os locais com quantidade.
+    """
+    __slots__ = ('_matriz', '_produto_id')
+
+    def __init__(self, matriz: MatrizEstoque, produto_id: int):
+        self._matriz = matriz
+        self._produto_id = produto_id
+
+    def _coluna(self, nome: str) -> int:
+        if (coluna := self._matriz.coluna_do_nome(nome)) is None:
+            raise KeyError(nome)
+        return coluna
+
+    def __getitem__(self, nome: str) -> int:
+        return self._matriz._valor_coluna(self._produto_id, self._coluna(nome))
+
+    def __setitem__(self, nome: str, quantidade: int):
+        self._matriz._definir_coluna(self._produto_id, self._coluna(nome), quantidade)
+
+    def __delitem__(self, nome: str):
+        self[nome] = 0
+
+    def __iter__(self):
+        nomes = self._matriz._nome_da_coluna
+        for coluna, quantidade in enumerate(self._matriz._linhas.get(self._produto_id, ())):
+            if quantidade:
+                yield nomes[coluna]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def clear(self):
+        self._matriz.limpar_produto(self._produto_id)
+
+    @property
+    def total(self) -> int:
+        return self._matriz.total_produto(self._produto_id)
+
+    def __deepcopy__(self, memo):
+        # uma cópia do produto (ex.: o protótipo) sai com um estoque próprio, fora da matriz
+        return EstoquePorLocal(dict(self.items()))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self.items())!r})"
+
 # ===================================
 # PADRÃO COMPORTAMENTAL 1: OBSERVER
 # ===================================
@@ -211,16 +822,20 @@ class Produto:
     categoria: str
     fornecedor: Fornecedor
     codigo_barras: str
-    preco_compra: float
-    preco_venda: float
+    preco_compra: Dinheiro
+    preco_venda: Dinheiro
     ponto_ressuprimento: int # Para produtos individuais, é o estoque mínimo
     tipoProduto: str = "individual"  # individual ou kit
-    # Para produtos individuais, armazena a quantidade por nome de localização
-    estoque_por_local: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    # Para produtos individuais, a quantidade por nome de localização (com o total já somado).
+    # Produtos do gerenciador recebem uma VisaoEstoqueProduto da MatrizEstoque; os avulsos usam um EstoquePorLocal
+    estoque_por_local: Dict[str, int] = field(default_factory=EstoquePorLocal)
     # Para kits, armazena a lista de seus componentes
     componentes: List[ComponenteKit] = field(default_factory=list)
     # Lista de observadores
     _observadores_estoque: List[observador_estoque] = field(default_factory=list)
+    # kits: estoque montável da última conta (None = ainda não calculado).
+    # Quem mexe no estoque de um componente chama recalcular_estoque_montavel() nos kits que o usam
+    _estoque_montavel: Optional[int] = field(default=None, repr=False, compare=False)
 
     def adicionar_observador(self, observador: observador_estoque): # <-- Mostrar essa parte
         """ Novo Observador"""
@@ -253,21 +868,32 @@ class Produto:
         """Recalcula o preço de compra de um kit."""
         try:
             if self.tipoProduto == 'kit':
-                self.preco_compra = sum(c.produto.preco_compra * c.quantidade for c in self.componentes)
+                self.preco_compra = sum((c.produto.preco_compra * c.quantidade for c in self.componentes), Dinheiro())
         except Exception as e:
             print(f"Erro ao recalcular preço de compra: {e}")
 
     def get_estoque_total(self) -> int:
         """Calcula o estoque total."""
         if self.tipoProduto == 'individual':
+            if isinstance(self.estoque_por_local, (EstoquePorLocal, VisaoEstoqueProduto)):
+                return self.estoque_por_local.total
             return sum(self.estoque_por_local.values())
         elif self.tipoProduto == 'kit':
-            if not self.componentes:
-                return 0
+            if self._estoque_montavel is None:
+                return self.recalcular_estoque_montavel()
+            return self._estoque_montavel
+
+    def recalcular_estoque_montavel(self) -> int:
+        """Refaz a conta de quantos kits dá pra montar com o estoque atual dos componentes."""
+        if not self.componentes:
+            estoque = 0
+        else:
             try:
-                return min(c.produto.get_estoque_total() // c.quantidade for c in self.componentes)
+                estoque = min(c.produto.get_estoque_total() // c.quantidade for c in self.componentes)
             except ZeroDivisionError:
-                return 0
+                estoque = 0
+        self._estoque_montavel = estoque
+        return estoque
 
     def __str__(self):
         """representação em string para listas e seleções"""
@@ -285,22 +911,39 @@ class AlertaEstoqueBaixo(observador_estoque):
         print(f"  Estoque atual: {estoque_atual} unidades")
         print(f"  Ponto de ressuprimento: {produto.ponto_ressuprimento}")
 
-@dataclass
+# no banco as datas são inteiros com os microssegundos desde 1970-01-01 UTC; na memória continuam datetime
+# sem fuso no horário local (o que datetime.now() devolve). A conversão é feita só na fronteira com o banco
+_EPOCA_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSSEGUNDO = timedelta(microseconds=1)
+
+
+def para_epoca(data: datetime) -> int:
+    """datetime (sem fuso = horário local) -> microssegundos desde 1970 UTC, como é gravado no banco"""
+    return (data.astimezone(timezone.utc) - _EPOCA_UTC) // _MICROSSEGUNDO
+
+
+def de_epoca(valor: int) -> datetime:
+    """microssegundos desde 1970 UTC -> datetime no horário local, sem fuso"""
+    segundos, microssegundos = divmod(valor, 1_000_000)
+    return datetime.fromtimestamp(segundos).replace(microsecond=microssegundos)
+
+
+@dataclass(slots=True)
 class ItemOrdemCompra:
     """nisso, nós vamos representar um item dentro de uma ordem de Compra"""
     # ou seja, um produto que está sendo comprado através do fornecedo
     produto: Produto
     quantidade: int
-    preco_unitario: float
+    preco_unitario: Dinheiro
 
     @property
-    def subtotal(self) -> float:
+    def subtotal(self) -> Dinheiro:
         """calculo do valor subtotal do item da ordem de compra"""
         try:
-            return self.quantidade * self.preco_unitario
+            return self.preco_unitario * self.quantidade
         except Exception as e:  
             print(f"Erro ao calcular subtotal do item da ordem de compra: {e}")
-            return 0.0  
+            return Dinheiro()  
 
 @dataclass
 class OrdemCompra:
@@ -312,12 +955,12 @@ class OrdemCompra:
     data_criacao: datetime = field(default_factory=datetime.now)
 
     @property
-    def valor_total(self) -> float:
+    def valor_total(self) -> Dinheiro:
         try:
-            return sum(item.subtotal for item in self.itens)
+            return sum((item.subtotal for item in self.itens), Dinheiro())
         except Exception as e:
             print(f"Erro ao calcular valor total da ordem de compra: {e}")
-            return 0.0
+            return Dinheiro()
 
     def __str__(self):
         """Representação em string para listas e seleções."""
@@ -332,22 +975,24 @@ class OrdemCompra:
             return f"Erro ao exibir ordem de compra: {e}"
 
 
-@dataclass
+@dataclass(slots=True)
 class ItemVenda:
     produto: Produto
     quantidade: int
-    preco_venda_unitario: float
+    preco_venda_unitario: Dinheiro
+    # preço de compra (nos kits, a soma dos componentes) no momento da venda; é o custo que entra no lucro
+    custo_unitario: Dinheiro = field(default_factory=Dinheiro)
 
     @property
-    def subtotal(self) -> float:
+    def subtotal(self) -> Dinheiro:
         try:
-            return self.quantidade * self.preco_venda_unitario
+            return self.preco_venda_unitario * self.quantidade
         except Exception as e:
             print(f"Erro ao calcular subtotal do item de venda: {e}")
-            return 0.0
+            return Dinheiro()
 
 
-@dataclass
+@dataclass(slots=True)
 class Venda:
     id: int
     cliente: str
@@ -355,12 +1000,16 @@ class Venda:
     data: datetime = field(default_factory=datetime.now)
 
     @property
-    def valor_total(self) -> float:
+    def valor_total(self) -> Dinheiro:
         try:
-            return sum(item.subtotal for item in self.itens)
+            return sum((item.subtotal for item in self.itens), Dinheiro())
         except Exception as e:
             print(f"Erro ao calcular valor total da venda: {e}")
-            return 0.0
+            return Dinheiro()
+
+    def preco_vendido(self, produto: Produto) -> Dinheiro:
+        """preço unitário pelo qual o produto saiu nesta venda (o de hoje, se ele não estiver entre os itens)"""
+        return next((item.preco_venda_unitario for item in self.itens if item.produto.id == produto.id), produto.preco_venda)
 
     def __str__(self):
         try:
@@ -370,31 +1019,33 @@ class Venda:
         except Exception as e:
             return f"Erro ao exibir venda: {e}"
 
-@dataclass
+@dataclass(slots=True)
 class ItemDevolucao:
     """representa um produto específico dentro de um processo de devolução"""
     produto: Produto
     quantidade: int
     motivo_devolucao: str
     condicao_produto: str
+    # preço unitário da venda original (Venda.preco_vendido); é o que vale no reembolso e nos resumos
+    preco_venda_unitario: Dinheiro
 
     @property
-    def subtotal(self) -> float:
+    def subtotal(self) -> Dinheiro:
         """vai caclcular o valor do item devolvido (que é baseado no preço de venda da compra original)"""
         try:
-            return self.quantidade * self.produto.preco_venda
+            return self.preco_venda_unitario * self.quantidade
         except Exception as e:
             print(f"Erro ao calcular subtotal do item de devolução: {e}")
-            return 0.0
+            return Dinheiro()
 
 
-@dataclass
+@dataclass(slots=True)
 class Transacao:
     """representa o movimento financeiro associado a uma devolução oi troca"""
     id: int
     devolucao_id: int
     tipo: str # "reembolso", "credito", "pagamento_troca"
-    valor: float
+    valor: Dinheiro
     data: datetime = field(default_factory=datetime.now)
 
 # ==================================================
@@ -415,12 +1066,12 @@ class Devolucao:
     nova_venda_troca: Optional[Venda] = None
 
     @property
-    def valor_total_devolvido(self) -> float:
+    def valor_total_devolvido(self) -> Dinheiro:
         try:
-            return sum(item.subtotal for item in self.itens)
+            return sum((item.subtotal for item in self.itens), Dinheiro())
         except Exception as e:
             print(f"Erro ao calcular valor total da devolução: {e}")
-            return 0.0
+            return Dinheiro()
 
     def __str__(self):
         valor_formatado = f"R$ {self.valor_total_devolvido:,.2f}"
@@ -452,7 +1103,7 @@ class Processador_de_devolucao(ABC): # <-- Mostrar essa parte
 
 class atendente(Processador_de_devolucao): # <-- Mostrar essa parte
 
-    LIMITE_ATENDENTE = 1000.00
+    LIMITE_ATENDENTE = Dinheiro.de_reais(1000)
 
     def processar(self, devolucao: Devolucao) -> bool:
         try:
@@ -469,7 +1120,7 @@ class atendente(Processador_de_devolucao): # <-- Mostrar essa parte
 
 class Gerente(Processador_de_devolucao): # <-- Mostrar essa parte
 
-    LIMITE_GERENTE = 10000.00
+    LIMITE_GERENTE = Dinheiro.de_reais(10000)
 
     def processar(self, devolucao: Devolucao) -> bool:
         try:
@@ -509,13 +1160,73 @@ class Sistema_de_aprovação_de_devolucao: # <-- Mostrar essa parte
         """Inicia o processamento da devolução pela cadeia"""
         return self.atendente.processar(devolucao)
 
-@dataclass
+class TipoMovimento(IntEnum):
+    """
+    o tipo da movimentação em código (coluna historico_movimentos.tipo_codigo); o texto de 'tipo' continua
+    sendo o que aparece pro usuário. O documento de origem vai em documento_id: a venda, a OC ou a devolução,
+    e nas transferências a localização do outro lado.
+    """
+    OUTRO = 0
+    CARGA_INICIAL = 1
+    ENTRADA_MANUAL = 2
+    ENTRADA_OC = 3
+    VENDA = 4
+    VENDA_COMPONENTE_KIT = 5
+    DEVOLUCAO = 6
+    DEVOLUCAO_COMPONENTE_KIT = 7
+    TRANSFERENCIA_SAIDA = 8
+    TRANSFERENCIA_ENTRADA = 9
+
+
+# textos fixos e prefixos "... #<id>" dos tipos de movimento que o sistema grava
+_TIPOS_FIXOS = {"Carga Inicial": TipoMovimento.CARGA_INICIAL, "Entrada Manual": TipoMovimento.ENTRADA_MANUAL}
+_PREFIXOS_COM_DOCUMENTO = (
+    ("Entrada OC #", TipoMovimento.ENTRADA_OC),
+    ("Venda #", TipoMovimento.VENDA),
+    ("Componente Venda Kit #", TipoMovimento.VENDA_COMPONENTE_KIT),
+    ("Devolução #", TipoMovimento.DEVOLUCAO),
+    ("Retorno Componente Kit Dev. #", TipoMovimento.DEVOLUCAO_COMPONENTE_KIT),
+)
+# transferências citam a localização do outro lado pelo nome
+_PREFIXOS_TRANSFERENCIA = (
+    ("Transferência p/ ", TipoMovimento.TRANSFERENCIA_SAIDA),
+    ("Transferência de ", TipoMovimento.TRANSFERENCIA_ENTRADA),
+)
+
+
+def classificar_tipo_movimento(tipo: str) -> tuple[TipoMovimento, Optional[int]]:
+    """descobre o código e o id do documento a partir do texto do tipo (para quem ainda passa só o texto)"""
+    if tipo in _TIPOS_FIXOS:
+        return _TIPOS_FIXOS[tipo], None
+    for prefixo, codigo in _PREFIXOS_COM_DOCUMENTO:
+        if tipo.startswith(prefixo):
+            numero = tipo[len(prefixo):].split(maxsplit=1)
+            if numero and numero[0].isdigit():
+                return codigo, int(numero[0])
+    # transferências citam a localização pelo nome, então o id tem que vir de quem grava
+    for prefixo, codigo in _PREFIXOS_TRANSFERENCIA:
+        if tipo.startswith(prefixo):
+            return codigo, None
+    return TipoMovimento.OUTRO, None
+
+
+def nome_local_transferencia(tipo: str) -> Optional[str]:
+    """nome da localização do outro lado citada no texto de uma transferência (None se não for transferência)"""
+    for prefixo, _ in _PREFIXOS_TRANSFERENCIA:
+        if tipo.startswith(prefixo):
+            return tipo[len(prefixo):]
+    return None
+
+
+@dataclass(slots=True)
 class HistoricoMovimento:
     produto: Produto
     tipo: str
     quantidade: int
     localizacao: Localizacao
     data: datetime = field(default_factory=datetime.now)
+    tipo_codigo: TipoMovimento = TipoMovimento.OUTRO
+    documento_id: Optional[int] = None
 
 
 # =============================================
@@ -525,39 +1236,39 @@ class HistoricoMovimento:
 class EstrategiaDesconto(ABC):
     """Estratégias de desconto"""
     @abstractmethod
-    def calcular_desconto(self, venda: 'Venda') -> float:
+    def calcular_desconto(self, venda: 'Venda') -> Dinheiro:
         pass
 
 
 class SemDesconto(EstrategiaDesconto):
-    def calcular_desconto(self, venda: 'Venda') -> float:
+    def calcular_desconto(self, venda: 'Venda') -> Dinheiro:
         try:
-            return 0.0
+            return Dinheiro()
         except Exception as e:
             print(f"Erro ao calcular desconto: {e}")
-            return 0.0
+            return Dinheiro()
 class DescontoPorValor(EstrategiaDesconto):
     """Aplica desconto se o valor total da venda for alto"""
-    def calcular_desconto(self, venda: 'Venda') -> float:
+    def calcular_desconto(self, venda: 'Venda') -> Dinheiro:
         try:
-            if venda.valor_total > 1000:
+            if venda.valor_total > Dinheiro.de_reais(1000):
                 return venda.valor_total * 0.1  # 10%
-            return 0.0
+            return Dinheiro()
         except Exception as e:
             print(f"Erro ao calcular desconto por valor: {e}")
-            return 0.0
+            return Dinheiro()
 
 class DescontoPorQuantidade(EstrategiaDesconto):
     """Aplica desconto se a quantidade de itens for alta"""
-    def calcular_desconto(self, venda: 'Venda') -> float:
+    def calcular_desconto(self, venda: 'Venda') -> Dinheiro:
         try:
             total_itens = sum(item.quantidade for item in venda.itens)
             if total_itens >= 10:
                 return venda.valor_total * 0.05  # 5%
-            return 0.0
+            return Dinheiro()
         except Exception as e:
             print(f"Erro ao calcular desconto por quantidade: {e}")
-            return 0.0
+            return Dinheiro()
 
 class CalculadoraDescontos:
     """Contexto que usa a estratégia de desconto"""
@@ -568,7 +1279,7 @@ class CalculadoraDescontos:
         """Permite mudar a estratégia dinamicamente"""
         self._estrategia = nova_estrategia
 
-    def calcular(self, venda: 'Venda') -> float:
+    def calcular(self, venda: 'Venda') -> Dinheiro:
         return self._estrategia.calcular_desconto(venda)
 
 # =====================
@@ -649,15 +1360,15 @@ class ProdutoFactory(ABC):
         categoria: str,
         fornecedor: Fornecedor,
         codigo_barras: str,
-        preco_compra: float,
-        preco_venda: float,
+        preco_compra: Dinheiro | float,
+        preco_venda: Dinheiro | float,
         ponto_ressuprimento: int,
         **kwargs
     ) -> Produto:
         """Método abstrato para criação de produtos"""
         pass
 
-    def _validar_dados_comuns(self, preco_compra: float, preco_venda: float, ponto_ressuprimento: int):
+    def _validar_dados_comuns(self, preco_compra: Dinheiro, preco_venda: Dinheiro, ponto_ressuprimento: int):
         """Valida dados comuns a todos os produtos"""
         try:
             if preco_compra < 0:
@@ -683,13 +1394,14 @@ class ProdutoIndividualFactory(ProdutoFactory):
         categoria: str,
         fornecedor: Fornecedor,
         codigo_barras: str,
-        preco_compra: float,
-        preco_venda: float,
+        preco_compra: Dinheiro | float,
+        preco_venda: Dinheiro | float,
         ponto_ressuprimento: int,
         **kwargs
     ) -> Produto:
         """Cria um produto individual com validações"""
-        
+        preco_compra, preco_venda = Dinheiro.de_reais(preco_compra), Dinheiro.de_reais(preco_venda)
+
         # Validações
         self._validar_dados_comuns(preco_compra, preco_venda, ponto_ressuprimento)
         
@@ -721,8 +1433,8 @@ class ProdutoKitFactory(ProdutoFactory):
         categoria: str,
         fornecedor: Fornecedor,
         codigo_barras: str,
-        preco_compra: float,  # Será recalculado
-        preco_venda: float,
+        preco_compra: Dinheiro | float,  # Será recalculado
+        preco_venda: Dinheiro | float,
         ponto_ressuprimento: int,
         componentes: List[ComponenteKit] = None,
         **kwargs
@@ -754,8 +1466,8 @@ class ProdutoKitFactory(ProdutoFactory):
             categoria=categoria,
             fornecedor=fornecedor,
             codigo_barras=codigo_barras,
-            preco_compra=0,  # Será calculado
-            preco_venda=preco_venda,
+            preco_compra=Dinheiro(),  # Será calculado
+            preco_venda=Dinheiro.de_reais(preco_venda),
             ponto_ressuprimento=ponto_ressuprimento,
             tipoProduto="kit",
             componentes=componentes
@@ -828,7 +1540,7 @@ class VendaBuilder:
         except Exception as e:
             raise e
     def adicionar_item(self, produto: Produto, quantidade: int, 
-                       preco_unitario: Optional[float] = None) -> 'VendaBuilder':
+                       preco_unitario: Optional[Dinheiro | float] = None) -> 'VendaBuilder':
         """
         Adiciona um item à venda.
         Se preco_unitario não for fornecido, usa o preço de venda do produto.
@@ -845,12 +1557,12 @@ class VendaBuilder:
                     f"Disponível: {estoque_disponivel}, Solicitado: {quantidade}"
                 )
         
-            preco = preco_unitario if preco_unitario is not None else produto.preco_venda
+            preco = Dinheiro.de_reais(preco_unitario) if preco_unitario is not None else produto.preco_venda
         
             if preco <= 0:
                 raise ValueError("Preço unitário deve ser maior que zero")
         
-            item = ItemVenda(produto, quantidade, preco)
+            item = ItemVenda(produto, quantidade, preco, produto.preco_compra)
             self._itens.append(item)
             return self
         except Exception as e:
@@ -905,7 +1617,7 @@ class OrdemCompraBuilder:
         return self
 
     def adicionar_item(self, produto: Produto, quantidade: int,
-                       preco_unitario: Optional[float] = None) -> 'OrdemCompraBuilder':
+                       preco_unitario: Optional[Dinheiro | float] = None) -> 'OrdemCompraBuilder':
         """
         Adiciona um item à ordem de compra.
         Se preco_unitario não for fornecido, usa o preço de compra do produto.
@@ -913,7 +1625,7 @@ class OrdemCompraBuilder:
         if quantidade <= 0:
             raise ValueError("Quantidade deve ser maior que zero")
         
-        preco = preco_unitario if preco_unitario is not None else produto.preco_compra
+        preco = Dinheiro.de_reais(preco_unitario) if preco_unitario is not None else produto.preco_compra
         
         if preco < 0:
             raise ValueError("Preço unitário não pode ser negativo")
@@ -996,7 +1708,7 @@ class ProdutoPrototype:
         clone.codigo_barras = novo_codigo_barras
         
         # Limpa o estoque do clone (novo produto, estoque zerado)
-        clone.estoque_por_local = defaultdict(int)
+        clone.estoque_por_local = EstoquePorLocal()
         
         # Aplica ajustes personalizados
         if ajustes:
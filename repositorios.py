@@ -0,0 +1,711 @@
+# repositorios.py
+# Contém os repositórios que leem do banco as tabelas que crescem sem parar
+# (histórico de movimentos, vendas, ordens de compra e devoluções).
+# No modo preguiçoso o GerenciadorEstoque usa esses repositórios no lugar dos dicionários/listas,
+# e os objetos só são montados quando alguém pede por eles, página por página.
+# No modo normal (ansioso) os mesmos repositórios são usados só para carregar tudo de uma vez,
+# e o histórico e as vendas ficam em HistoricoColunar e VendasIndexadas, versões em memória com as
+# mesmas consultas do RepositorioHistorico e do RepositorioVendas.
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import datetime
+from heapq import merge
+
+from config import NUMPY_DISPONIVEL
+from models import (HistoricoMovimento, TipoMovimento, Dinheiro, para_epoca, de_epoca, ItemOrdemCompra, OrdemCompra, ItemVenda, Venda,
+                    Devolucao, ItemDevolucao, Transacao)
+from database import DatabaseManager
+
+TAMANHO_PAGINA_PADRAO = 500 # linhas por consulta; fica bem abaixo do limite de parâmetros do SQLite
+TAMANHO_CACHE_PADRAO = 2000 # objetos mantidos em memória por repositório
+
+if NUMPY_DISPONIVEL:
+    import numpy as np
+
+
+class RepositorioPaginado(Mapping):
+    """
+    Base dos repositórios id -> objeto. Se comporta como um dicionário somente leitura
+    (get, in, len, keys, values, items), mas busca as linhas no banco sob demanda, usando
+    a chave primária, e guarda os objetos mais usados num cache LRU limitado.
+    """
+    tabela = "" # tabela do cabeçalho (vendas, ordens_compra, devolucoes)
+
+    def __init__(self, db: DatabaseManager, tamanho_pagina: int = TAMANHO_PAGINA_PADRAO,
+                 tamanho_cache: int = TAMANHO_CACHE_PADRAO):
+        self.db = db
+        self.tamanho_pagina = tamanho_pagina
+        self.tamanho_cache = tamanho_cache
+        self._cache: OrderedDict = OrderedDict()
+
+    def _carregar_onde(self, condicao: str, params: tuple = ()) -> dict:
+        """monta os objetos (cabeçalho + itens) das linhas que atendem a condição, em ordem de id"""
+        raise NotImplementedError
+
+    def carregar_todos(self) -> dict:
+        """carrega a tabela inteira num dicionário comum (usado no carregamento ansioso)"""
+        return self._carregar_onde("1 = 1")
+
+    # --- cache ---
+    def _guardar(self, chave, objeto):
+        self._cache[chave] = objeto
+        self._cache.move_to_end(chave)
+        while len(self._cache) > self.tamanho_cache:
+            self._cache.popitem(last=False)
+
+    def obter_varios(self, ids) -> dict:
+        """retorna {id: objeto} para os ids pedidos, buscando os que faltam no cache em poucas consultas"""
+        encontrados = {}
+        faltando = []
+        for chave in ids:
+            if chave in self._cache:
+                self._cache.move_to_end(chave)
+                encontrados[chave] = self._cache[chave]
+            else:
+                faltando.append(chave)
+        for inicio in range(0, len(faltando), self.tamanho_pagina):
+            lote = faltando[inicio:inicio + self.tamanho_pagina]
+            marcadores = ", ".join("?" for _ in lote)
+            for chave, objeto in self._carregar_onde(f"id IN ({marcadores})", tuple(lote)).items():
+                self._guardar(chave, objeto)
+                encontrados[chave] = objeto
+        return encontrados
+
+    # --- interface de dicionário ---
+    def __getitem__(self, chave):
+        if chave in self._cache:
+            self._cache.move_to_end(chave)
+            return self._cache[chave]
+        objetos = self._carregar_onde("id = ?", (chave,))
+        if chave not in objetos:
+            raise KeyError(chave)
+        self._guardar(chave, objetos[chave])
+        return objetos[chave]
+
+    def __contains__(self, chave):
+        if chave in self._cache:
+            return True
+        return self.db.execute_query(f"SELECT 1 FROM {self.tabela} WHERE id = ?", (chave,), fetch='one') is not None
+
+    def __len__(self):
+        linha = self.db.execute_query(f"SELECT COUNT(*) FROM {self.tabela}", fetch='one')
+        return linha[0] if linha else 0
+
+    def __bool__(self):
+        return self.db.execute_query(f"SELECT 1 FROM {self.tabela} LIMIT 1", fetch='one') is not None
+
+    def _paginas_de_ids(self):
+        """ids em ordem crescente, uma página por vez (paginação por chave, sem OFFSET)"""
+        ultimo_id = 0
+        while True:
+            linhas = self.db.execute_query(
+                f"SELECT id FROM {self.tabela} WHERE id > ? ORDER BY id LIMIT ?",
+                (ultimo_id, self.tamanho_pagina), fetch='all'
+            )
+            if not linhas:
+                return
+            ids = [linha[0] for linha in linhas]
+            yield ids
+            ultimo_id = ids[-1]
+
+    def __iter__(self):
+        for ids in self._paginas_de_ids():
+            yield from ids
+
+    def values(self):
+        for ids in self._paginas_de_ids():
+            objetos = self.obter_varios(ids)
+            for chave in ids:
+                if chave in objetos:
+                    yield objetos[chave]
+
+    def items(self):
+        for objeto in self.values():
+            yield objeto.id, objeto
+
+    def pagina(self, numero: int, tamanho: int | None = None) -> list:
+        """retorna a página 'numero' (começando em 0) com os registros mais recentes primeiro"""
+        tamanho = tamanho or self.tamanho_pagina
+        linhas = self.db.execute_query(
+            f"SELECT id FROM {self.tabela} ORDER BY id DESC LIMIT ? OFFSET ?",
+            (tamanho, numero * tamanho), fetch='all'
+        ) or []
+        ids = [linha[0] for linha in linhas]
+        objetos = self.obter_varios(ids)
+        return [objetos[chave] for chave in ids if chave in objetos]
+
+    # --- escrita em memória: o banco já foi gravado pelo gerenciador, aqui só mantemos o cache coerente ---
+    def __setitem__(self, chave, objeto):
+        self._guardar(chave, objeto)
+
+    def pop(self, chave, padrao=None):
+        return self._cache.pop(chave, padrao)
+
+    def clear(self):
+        """esquece os objetos em cache (a próxima leitura vai ao banco)"""
+        self._cache.clear()
+
+    def esquecer(self, ids):
+        """tira do cache só os ids que mudaram no banco (recarga incremental)"""
+        for chave in ids:
+            self._cache.pop(chave, None)
+
+
+class RepositorioVendas(RepositorioPaginado):
+    """vendas com seus itens"""
+    tabela = "vendas"
+
+    def __init__(self, db: DatabaseManager, produtos: dict, **kwargs):
+        super().__init__(db, **kwargs)
+        self.produtos = produtos
+
+    def _carregar_onde(self, condicao: str, params: tuple = ()) -> dict:
+        vendas = {}
+        linhas = self.db.execute_query(f"SELECT id, cliente_nome, data FROM vendas WHERE {condicao} ORDER BY id", params, fetch='all')
+        for venda_id, cliente, data in linhas or []:
+            vendas[venda_id] = Venda(venda_id, cliente, [], de_epoca(data))
+        if not vendas:
+            return vendas
+
+        query_itens = f"""SELECT venda_id, produto_id, quantidade, preco_venda_unitario, custo_unitario FROM itens_venda
+                          WHERE venda_id IN (SELECT id FROM vendas WHERE {condicao}) ORDER BY id"""
+        for v_id, p_id, qtd, preco, custo in self.db.execute_query(query_itens, params, fetch='all') or []:
+            if (venda := vendas.get(v_id)) and (produto := self.produtos.get(p_id)):
+                venda.itens.append(ItemVenda(produto, qtd, Dinheiro(preco), Dinheiro(custo)))
+        return vendas
+
+    def no_periodo(self, data_inicio: datetime, data_fim: datetime) -> list[Venda]:
+        """vendas entre as duas datas (inclusive), em ordem cronológica, usando o índice de vendas.data"""
+        linhas = self.db.execute_query(
+            "SELECT id FROM vendas WHERE data BETWEEN ? AND ? ORDER BY data, id",
+            (para_epoca(data_inicio), para_epoca(data_fim)), fetch='all'
+        ) or []
+        ids = [linha[0] for linha in linhas]
+        vendas = self.obter_varios(ids)
+        return [vendas[chave] for chave in ids if chave in vendas]
+
+
+class RepositorioOrdensCompra(RepositorioPaginado):
+    """ordens de compra com seus itens"""
+    tabela = "ordens_compra"
+
+    def __init__(self, db: DatabaseManager, produtos: dict, fornecedores: dict, **kwargs):
+        super().__init__(db, **kwargs)
+        self.produtos = produtos
+        self.fornecedores = fornecedores
+
+    def _carregar_onde(self, condicao: str, params: tuple = ()) -> dict:
+        ordens = {}
+        linhas = self.db.execute_query(f"SELECT id, fornecedor_id, status, data_criacao FROM ordens_compra WHERE {condicao} ORDER BY id", params, fetch='all')
+        for oc_id, forn_id, status, data in linhas or []:
+            if fornecedor := self.fornecedores.get(forn_id):
+                ordens[oc_id] = OrdemCompra(oc_id, fornecedor, [], status, de_epoca(data))
+        if not ordens:
+            return ordens
+
+        query_itens = f"""SELECT ordem_id, produto_id, quantidade, preco_unitario FROM itens_ordem_compra
+                          WHERE ordem_id IN (SELECT id FROM ordens_compra WHERE {condicao}) ORDER BY id"""
+        for oc_id, p_id, qtd, preco in self.db.execute_query(query_itens, params, fetch='all') or []:
+            if (oc := ordens.get(oc_id)) and (produto := self.produtos.get(p_id)):
+                oc.itens.append(ItemOrdemCompra(produto, qtd, Dinheiro(preco)))
+        return ordens
+
+
+class RepositorioDevolucoes(RepositorioPaginado):
+    """devoluções com seus itens e a transação financeira"""
+    tabela = "devolucoes"
+
+    def __init__(self, db: DatabaseManager, produtos: dict, vendas: Mapping, **kwargs):
+        super().__init__(db, **kwargs)
+        self.produtos = produtos
+        # pode ser o dicionário de vendas (modo ansioso) ou o RepositorioVendas (modo preguiçoso)
+        self.vendas = vendas
+
+    def _buscar_vendas(self, ids) -> dict:
+        if isinstance(self.vendas, RepositorioPaginado):
+            return self.vendas.obter_varios(ids)
+        return {venda_id: self.vendas[venda_id] for venda_id in ids if venda_id in self.vendas}
+
+    def _carregar_onde(self, condicao: str, params: tuple = ()) -> dict:
+        linhas = self.db.execute_query(
+            f"SELECT id, venda_original_id, cliente_nome, status, data, observacoes FROM devolucoes WHERE {condicao} ORDER BY id",
+            params, fetch='all'
+        ) or []
+        vendas = self._buscar_vendas({linha[1] for linha in linhas})
+
+        devolucoes = {}
+        for dev_id, venda_id, cliente, status, data, obs in linhas:
+            if venda_original := vendas.get(venda_id):
+                devolucoes[dev_id] = Devolucao(
+                    id=dev_id, venda_original=venda_original, cliente_nome=cliente, itens=[],
+                    status=status, data=de_epoca(data), observacoes=obs
+                )
+        if not devolucoes:
+            return devolucoes
+
+        query_itens = f"""SELECT devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto FROM itens_devolucao
+                          WHERE devolucao_id IN (SELECT id FROM devolucoes WHERE {condicao}) ORDER BY id"""
+        for dev_id, p_id, qtd, motivo, condicao_produto in self.db.execute_query(query_itens, params, fetch='all') or []:
+            if (devolucao := devolucoes.get(dev_id)) and (produto := self.produtos.get(p_id)):
+                devolucao.itens.append(ItemDevolucao(produto, qtd, motivo, condicao_produto,
+                                                     devolucao.venda_original.preco_vendido(produto)))
+
+        query_trans = f"""SELECT id, devolucao_id, tipo, valor, data FROM transacoes
+                          WHERE devolucao_id IN (SELECT id FROM devolucoes WHERE {condicao}) ORDER BY id"""
+        for t_id, dev_id, tipo, valor, data in self.db.execute_query(query_trans, params, fetch='all') or []:
+            if devolucao := devolucoes.get(dev_id):
+                devolucao.transacao = Transacao(t_id, dev_id, tipo, Dinheiro(valor), de_epoca(data))
+        return devolucoes
+
+
+class RepositorioHistorico:
+    """
+    Histórico de movimentações lido do banco sob demanda. Tem a mesma interface de leitura da
+    lista self.historico (iterar, len, bool) e consultas por produto/fornecedor/localização
+    que usam os índices (produto_id, data) e (localizacao_id, data), dos mais recentes para os mais antigos.
+    """
+
+    _COLUNAS = "id, produto_id, localizacao_id, tipo, quantidade, data, tipo_codigo, documento_id"
+
+    def __init__(self, db: DatabaseManager, produtos: dict, localizacoes: dict,
+                 tamanho_pagina: int = TAMANHO_PAGINA_PADRAO):
+        self.db = db
+        self.produtos = produtos
+        self.localizacoes = localizacoes
+        self.tamanho_pagina = tamanho_pagina
+
+    def _construir(self, linhas) -> list[HistoricoMovimento]:
+        movimentos = []
+        for _, p_id, l_id, tipo, qtd, data, tipo_codigo, documento_id in linhas:
+            if (produto := self.produtos.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                movimentos.append(HistoricoMovimento(produto, tipo, qtd, localizacao, de_epoca(data),
+                                                     TipoMovimento(tipo_codigo), documento_id))
+        return movimentos
+
+    def carregar_todos(self) -> list[HistoricoMovimento]:
+        """o histórico inteiro numa lista comum"""
+        return self._construir(self.db.execute_query(f"SELECT {self._COLUNAS} FROM historico_movimentos ORDER BY id", fetch='all') or [])
+
+    def carregar_colunar(self) -> 'HistoricoColunar':
+        """o histórico inteiro num HistoricoColunar (usado no carregamento ansioso); as linhas vão direto
+        para as colunas, sem montar um HistoricoMovimento por linha"""
+        historico = HistoricoColunar(self.produtos, self.localizacoes)
+        historico.carregar_linhas(self.db.execute_query(f"SELECT {self._COLUNAS} FROM historico_movimentos ORDER BY id", fetch='all') or [])
+        return historico
+
+    def linhas_por_ids(self, ids) -> list[tuple]:
+        """as linhas cruas com esses ids, em ordem de id (usado na recarga incremental)"""
+        ids = sorted(ids)
+        linhas = []
+        for inicio in range(0, len(ids), self.tamanho_pagina):
+            lote = ids[inicio:inicio + self.tamanho_pagina]
+            marcadores = ", ".join("?" for _ in lote)
+            linhas.extend(self.db.execute_query(
+                f"SELECT {self._COLUNAS} FROM historico_movimentos WHERE id IN ({marcadores}) ORDER BY id",
+                tuple(lote), fetch='all'
+            ) or [])
+        return linhas
+
+    def por_ids(self, ids) -> list[HistoricoMovimento]:
+        """os movimentos com esses ids, em ordem de id"""
+        return self._construir(self.linhas_por_ids(ids))
+
+    def _recentes_primeiro(self, condicao: str, params: tuple = ()):
+        """gera os movimentos que atendem a condição do mais recente para o mais antigo, página por página"""
+        cursor_data, cursor_id = None, None
+        while True:
+            if cursor_data is None:
+                filtro, filtro_params = condicao, params
+            else:
+                filtro, filtro_params = f"({condicao}) AND (data, id) < (?, ?)", params + (cursor_data, cursor_id)
+            linhas = self.db.execute_query(
+                f"SELECT {self._COLUNAS} FROM historico_movimentos WHERE {filtro} ORDER BY data DESC, id DESC LIMIT ?",
+                filtro_params + (self.tamanho_pagina,), fetch='all'
+            )
+            if not linhas:
+                return
+            yield from self._construir(linhas)
+            cursor_id, cursor_data = linhas[-1][0], linhas[-1][5]
+
+    def por_produto(self, produto_id: int):
+        return self._recentes_primeiro("produto_id = ?", (produto_id,))
+
+    def por_localizacao(self, localizacao_id: int):
+        return self._recentes_primeiro("localizacao_id = ?", (localizacao_id,))
+
+    def por_fornecedor(self, fornecedor_id: int):
+        return self._recentes_primeiro("produto_id IN (SELECT id FROM produtos WHERE fornecedor_id = ?)", (fornecedor_id,))
+
+    def pagina(self, numero: int, tamanho: int | None = None) -> list[HistoricoMovimento]:
+        """página 'numero' (começando em 0) do histórico, mais recentes primeiro"""
+        tamanho = tamanho or self.tamanho_pagina
+        linhas = self.db.execute_query(
+            f"SELECT {self._COLUNAS} FROM historico_movimentos ORDER BY data DESC, id DESC LIMIT ? OFFSET ?",
+            (tamanho, numero * tamanho), fetch='all'
+        )
+        return self._construir(linhas or [])
+
+    # --- interface de lista ---
+    def __iter__(self):
+        ultimo_id = 0
+        while True:
+            linhas = self.db.execute_query(
+                f"SELECT {self._COLUNAS} FROM historico_movimentos WHERE id > ? ORDER BY id LIMIT ?",
+                (ultimo_id, self.tamanho_pagina), fetch='all'
+            )
+            if not linhas:
+                return
+            yield from self._construir(linhas)
+            ultimo_id = linhas[-1][0]
+
+    def __len__(self):
+        linha = self.db.execute_query("SELECT COUNT(*) FROM historico_movimentos", fetch='one')
+        return linha[0] if linha else 0
+
+    def __bool__(self):
+        return self.db.execute_query("SELECT 1 FROM historico_movimentos LIMIT 1", fetch='one') is not None
+
+    # o gerenciador grava a linha no banco antes de chamar append/remove, então não há nada a guardar aqui
+    def append(self, movimento: HistoricoMovimento):
+        pass
+
+    def remove(self, movimento: HistoricoMovimento):
+        pass
+
+    def clear(self):
+        pass
+
+    # as linhas de produtos/localizações apagados já saem do banco em cascata
+    def esquecer_produto(self, produto_id: int):
+        pass
+
+    def esquecer_localizacao(self, localizacao_id: int):
+        pass
+
+    @staticmethod
+    def _periodo(desde: datetime | None, ate: datetime | None) -> tuple[str, tuple]:
+        """cláusula WHERE (ou vazia) e parâmetros para limitar a consulta ao período"""
+        condicoes, params = [], []
+        if desde is not None:
+            condicoes.append("data >= ?")
+            params.append(para_epoca(desde))
+        if ate is not None:
+            condicoes.append("data <= ?")
+            params.append(para_epoca(ate))
+        return (f"WHERE {' AND '.join(condicoes)}" if condicoes else ""), tuple(params)
+
+    def fluxo_liquido_por_produto(self, desde: datetime | None = None, ate: datetime | None = None) -> dict[int, int]:
+        """soma das quantidades movimentadas (entradas - saídas) de cada produto, agregada no banco"""
+        onde, params = self._periodo(desde, ate)
+        linhas = self.db.execute_query(f"SELECT produto_id, SUM(quantidade) FROM historico_movimentos {onde} GROUP BY produto_id",
+                                       params, fetch='all')
+        return dict(linhas or [])
+
+    def por_documento(self, tipo_codigo: int, documento_id: int) -> list[HistoricoMovimento]:
+        """os movimentos gerados por um documento, pelo índice (tipo_codigo, documento_id)"""
+        return self._construir(self.db.execute_query(
+            f"SELECT {self._COLUNAS} FROM historico_movimentos WHERE tipo_codigo = ? AND documento_id = ? ORDER BY id",
+            (int(tipo_codigo), documento_id), fetch='all') or [])
+
+    def quantidade_por_tipo(self, desde: datetime | None = None, ate: datetime | None = None) -> dict[TipoMovimento, int]:
+        """soma das quantidades movimentadas por TipoMovimento, agregada no banco"""
+        onde, params = self._periodo(desde, ate)
+        linhas = self.db.execute_query(f"SELECT tipo_codigo, SUM(quantidade) FROM historico_movimentos {onde} GROUP BY tipo_codigo",
+                                       params, fetch='all')
+        return {TipoMovimento(codigo): total for codigo, total in linhas or []}
+
+
+class HistoricoColunar:
+    """
+    Histórico de movimentações em memória (modo normal), guardado em colunas paralelas de array em vez de
+    um objeto por movimento: produto_id, localizacao_id, quantidade, data (microssegundos desde 1970) e o
+    TipoMovimento, id do documento de origem (0 = nenhum) e o texto do tipo, que é guardado uma vez só em
+    self._textos e referenciado pela posição.
+    Os HistoricoMovimento só são montados quando alguém percorre o histórico. Para as consultas por produto e
+    por localização, mantém os números das linhas de cada grupo em ordem de data, então elas custam o tamanho
+    da resposta. filtrar() e fluxo_liquido_por_produto() varrem as colunas direto (com NumPy, se tiver).
+    """
+
+    def __init__(self, produtos: dict, localizacoes: dict, movimentos=()):
+        self.produtos = produtos
+        self.localizacoes = localizacoes
+        self.clear()
+        self.extend(movimentos)
+
+    # --- colunas ---
+    def _codigo_texto(self, tipo: str) -> int:
+        if (codigo := self._codigos_texto.get(tipo)) is None:
+            codigo = self._codigos_texto[tipo] = len(self._textos)
+            self._textos.append(tipo)
+        return codigo
+
+    def _inserir(self, grupos: dict, chave: int, linha: int):
+        grupo = grupos.get(chave)
+        if grupo is None:
+            grupo = grupos[chave] = array('I')
+        # quase sempre o movimento é o mais novo e cai no fim; empates ficam na ordem de gravação
+        if not grupo or self._data[grupo[-1]] <= self._data[linha]:
+            grupo.append(linha)
+        else:
+            grupo.insert(bisect_right(grupo, self._data[linha], key=self._data.__getitem__), linha)
+
+    def _colunas(self) -> tuple:
+        return (self._produto, self._localizacao, self._quantidade, self._data, self._texto, self._tipo_codigo, self._documento)
+
+    def _anexar(self, produto_id: int, localizacao_id: int, tipo: str, quantidade: int, data: int,
+                tipo_codigo: int = TipoMovimento.OUTRO, documento_id: int | None = None):
+        linha = len(self._data)
+        self._produto.append(produto_id)
+        self._localizacao.append(localizacao_id)
+        self._quantidade.append(quantidade)
+        self._data.append(data)
+        self._texto.append(self._codigo_texto(tipo))
+        self._tipo_codigo.append(tipo_codigo)
+        self._documento.append(documento_id or 0)
+        self._inserir(self._por_produto, produto_id, linha)
+        self._inserir(self._por_localizacao, localizacao_id, linha)
+
+    def _movimento(self, linha: int) -> HistoricoMovimento:
+        return HistoricoMovimento(self.produtos[self._produto[linha]], self._textos[self._texto[linha]],
+                                  self._quantidade[linha], self.localizacoes[self._localizacao[linha]],
+                                  de_epoca(self._data[linha]), TipoMovimento(self._tipo_codigo[linha]),
+                                  self._documento[linha] or None)
+
+    def _manter_linhas(self, manter):
+        """refaz as colunas e os grupos só com as linhas em que manter(linha, produto_id, localizacao_id) é verdadeiro"""
+        colunas, textos = self._colunas(), self._textos
+        self.clear()
+        for linha, (produto_id, localizacao_id, quantidade, data, texto, tipo_codigo, documento_id) in enumerate(zip(*colunas)):
+            if manter(linha, produto_id, localizacao_id):
+                self._anexar(produto_id, localizacao_id, textos[texto], quantidade, data, tipo_codigo, documento_id)
+
+    def carregar_linhas(self, linhas):
+        """acrescenta linhas (id, produto_id, localizacao_id, tipo, quantidade, data, tipo_codigo, documento_id) lidas do banco"""
+        for _, p_id, l_id, tipo, qtd, data, tipo_codigo, documento_id in linhas:
+            if p_id in self.produtos and l_id in self.localizacoes:
+                # a data já vem do banco no formato da coluna, sem conversão nenhuma
+                self._anexar(p_id, l_id, tipo, qtd, data, tipo_codigo, documento_id)
+
+    def esquecer_produto(self, produto_id: int):
+        """tira as linhas de um produto apagado (no banco elas saem em cascata)"""
+        if produto_id in self._por_produto:
+            self._manter_linhas(lambda linha, p_id, l_id: p_id != produto_id)
+
+    def esquecer_localizacao(self, localizacao_id: int):
+        if localizacao_id in self._por_localizacao:
+            self._manter_linhas(lambda linha, p_id, l_id: l_id != localizacao_id)
+
+    def descartar_orfaos(self):
+        """tira as linhas cujo produto ou localização não existe mais em memória"""
+        self._manter_linhas(lambda linha, p_id, l_id: p_id in self.produtos and l_id in self.localizacoes)
+
+    # --- consultas, do mais recente para o mais antigo ---
+    def por_produto(self, produto_id: int):
+        return map(self._movimento, reversed(self._por_produto.get(produto_id, ())))
+
+    def por_localizacao(self, localizacao_id: int):
+        return map(self._movimento, reversed(self._por_localizacao.get(localizacao_id, ())))
+
+    def por_fornecedor(self, fornecedor_id: int):
+        # junta os grupos dos produtos ATUAIS do fornecedor, que já estão em ordem de data
+        grupos = [reversed(self._por_produto[p.id]) for p in self.produtos.values()
+                  if p.id in self._por_produto and p.fornecedor and p.fornecedor.id == fornecedor_id]
+        return map(self._movimento, merge(*grupos, key=lambda linha: (self._data[linha], linha), reverse=True))
+
+    # --- varreduras nas colunas ---
+    def filtrar(self, produto_id: int | None = None, localizacao_id: int | None = None, tipo: str | None = None,
+                desde: datetime | None = None, ate: datetime | None = None,
+                tipo_codigo: int | None = None, documento_id: int | None = None) -> list[int]:
+        """números das linhas (em ordem de gravação) que atendem a todos os filtros informados"""
+        if tipo is not None and tipo not in self._codigos_texto:
+            return []
+        # (coluna, valor procurado) de cada filtro de igualdade informado
+        iguais = [(coluna, valor) for coluna, valor in ((self._produto, produto_id), (self._localizacao, localizacao_id),
+                                                        (self._texto, self._codigos_texto.get(tipo)),
+                                                        (self._tipo_codigo, tipo_codigo), (self._documento, documento_id))
+                  if valor is not None]
+        inicio = para_epoca(desde) if desde is not None else None
+        fim = para_epoca(ate) if ate is not None else None
+        if NUMPY_DISPONIVEL:
+            mascara = np.ones(len(self._data), dtype=bool)
+            for coluna, valor in iguais:
+                mascara &= np.frombuffer(coluna, dtype=coluna.typecode) == valor
+            datas = np.frombuffer(self._data, dtype=np.int64)
+            if inicio is not None:
+                mascara &= datas >= inicio
+            if fim is not None:
+                mascara &= datas <= fim
+            return np.flatnonzero(mascara).tolist()
+        return [linha for linha, data in enumerate(self._data)
+                if (inicio is None or data >= inicio) and (fim is None or data <= fim)
+                and all(coluna[linha] == valor for coluna, valor in iguais)]
+
+    def por_documento(self, tipo_codigo: int, documento_id: int) -> list[HistoricoMovimento]:
+        """os movimentos gerados por um documento (ex: TipoMovimento.VENDA e o id da venda), em ordem de gravação"""
+        return [self._movimento(linha) for linha in self.filtrar(tipo_codigo=tipo_codigo, documento_id=documento_id)]
+
+    def quantidade_por_tipo(self, desde: datetime | None = None, ate: datetime | None = None) -> dict[TipoMovimento, int]:
+        """soma das quantidades movimentadas por TipoMovimento"""
+        linhas = range(len(self._data)) if desde is None and ate is None else self.filtrar(desde=desde, ate=ate)
+        if NUMPY_DISPONIVEL:
+            codigos = np.frombuffer(self._tipo_codigo, dtype=np.uint8)[linhas]
+            quantidades = np.frombuffer(self._quantidade, dtype=self._quantidade.typecode)[linhas]
+            somas = np.zeros(len(TipoMovimento), dtype=np.int64)
+            np.add.at(somas, codigos, quantidades)
+            presentes = np.bincount(codigos, minlength=len(TipoMovimento))
+            return {TipoMovimento(codigo): int(somas[codigo]) for codigo in np.flatnonzero(presentes).tolist()}
+        totais = {}
+        for linha in linhas:
+            codigo = TipoMovimento(self._tipo_codigo[linha])
+            totais[codigo] = totais.get(codigo, 0) + self._quantidade[linha]
+        return totais
+
+    def fluxo_liquido_por_produto(self, desde: datetime | None = None, ate: datetime | None = None) -> dict[int, int]:
+        """soma das quantidades movimentadas (entradas - saídas) de cada produto, numa passada só"""
+        if desde is None and ate is None:
+            linhas = None
+        else:
+            linhas = self.filtrar(desde=desde, ate=ate)
+        if NUMPY_DISPONIVEL:
+            produtos = np.frombuffer(self._produto, dtype=self._produto.typecode)
+            quantidades = np.frombuffer(self._quantidade, dtype=self._quantidade.typecode)
+            if linhas is not None:
+                produtos, quantidades = produtos[linhas], quantidades[linhas]
+            ids, posicoes = np.unique(produtos, return_inverse=True)
+            somas = np.zeros(len(ids), dtype=np.int64)
+            np.add.at(somas, posicoes, quantidades)
+            return dict(zip(ids.tolist(), somas.tolist()))
+        fluxo = {}
+        for linha in (range(len(self._data)) if linhas is None else linhas):
+            produto_id = self._produto[linha]
+            fluxo[produto_id] = fluxo.get(produto_id, 0) + self._quantidade[linha]
+        return fluxo
+
+    # --- interface de lista ---
+    def append(self, movimento: HistoricoMovimento):
+        self._anexar(movimento.produto.id, movimento.localizacao.id, movimento.tipo, movimento.quantidade,
+                     para_epoca(movimento.data), movimento.tipo_codigo, movimento.documento_id)
+
+    def extend(self, movimentos):
+        for movimento in movimentos:
+            self.append(movimento)
+
+    def remove(self, movimento: HistoricoMovimento):
+        """tira a linha igual ao movimento; procura de trás pra frente, quem sai (desfazer) costuma ser o último"""
+        chave = (movimento.produto.id, movimento.localizacao.id, movimento.quantidade, para_epoca(movimento.data),
+                 self._codigos_texto.get(movimento.tipo))
+        for linha in range(len(self._data) - 1, -1, -1):
+            if (self._produto[linha], self._localizacao[linha], self._quantidade[linha], self._data[linha], self._texto[linha]) == chave:
+                break
+        else:
+            raise ValueError("movimento não está no histórico")
+        if linha < len(self._data) - 1:
+            # no meio do histórico os números das linhas seguintes mudam, então refaz tudo
+            self._manter_linhas(lambda outra, p_id, l_id: outra != linha)
+            return
+        for coluna in self._colunas():
+            coluna.pop()
+        for grupos, chave_grupo in ((self._por_produto, chave[0]), (self._por_localizacao, chave[1])):
+            grupo = grupos[chave_grupo]
+            grupo.pop(grupo.index(linha) if grupo[-1] != linha else -1)
+            if not grupo:
+                del grupos[chave_grupo]
+
+    def clear(self):
+        # ids e quantidades em 32 bits (4 bytes por linha cada); só a data precisa de 64
+        self._produto = array('i')
+        self._localizacao = array('i')
+        self._quantidade = array('i')
+        self._data = array('q')
+        self._texto = array('I')
+        self._tipo_codigo = array('B')
+        self._documento = array('i')
+        self._textos: list[str] = []
+        self._codigos_texto: dict[str, int] = {}
+        self._por_produto: dict[int, array] = {}
+        self._por_localizacao: dict[int, array] = {}
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self._movimento(linha) for linha in range(*indice.indices(len(self._data)))]
+        if indice < 0:
+            indice += len(self._data)
+        if not 0 <= indice < len(self._data):
+            raise IndexError("índice fora do histórico")
+        return self._movimento(indice)
+
+    def __iter__(self):
+        return map(self._movimento, range(len(self._data)))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __bool__(self):
+        return bool(self._data)
+
+
+class VendasIndexadas(dict):
+    """
+    Dicionário id -> Venda (modo normal) que mantém também uma lista ordenada de (data, id).
+    no_periodo() acha o começo e o fim do período por busca binária, então custa O(log n + k)
+    em vez de varrer todas as vendas já feitas.
+    """
+
+    def __init__(self, vendas=None):
+        super().__init__()
+        self._por_data: list[tuple[datetime, int]] = []
+        if vendas:
+            self.update(vendas)
+
+    def _retirar_do_indice(self, venda_id):
+        chave = (self[venda_id].data, venda_id)
+        del self._por_data[bisect_left(self._por_data, chave)]
+
+    def __setitem__(self, venda_id, venda: Venda):
+        if venda_id in self:
+            self._retirar_do_indice(venda_id)
+        super().__setitem__(venda_id, venda)
+        insort(self._por_data, (venda.data, venda_id))
+
+    def __delitem__(self, venda_id):
+        self._retirar_do_indice(venda_id)
+        super().__delitem__(venda_id)
+
+    def pop(self, venda_id, *padrao):
+        if venda_id in self:
+            self._retirar_do_indice(venda_id)
+        return super().pop(venda_id, *padrao)
+
+    def popitem(self):
+        venda_id, venda = super().popitem()
+        del self._por_data[bisect_left(self._por_data, (venda.data, venda_id))]
+        return venda_id, venda
+
+    def setdefault(self, venda_id, venda=None):
+        if venda_id not in self:
+            self[venda_id] = venda
+        return self[venda_id]
+
+    def update(self, *args, **kwargs):
+        for venda_id, venda in dict(*args, **kwargs).items():
+            self[venda_id] = venda
+
+    def clear(self):
+        super().clear()
+        self._por_data.clear()
+
+    def copy(self):
+        return VendasIndexadas(self)
+
+    def __reduce__(self):
+        # pickle remonta pelo construtor, que refaz o índice
+        return (self.__class__, (dict(self),))
+
+    def no_periodo(self, data_inicio: datetime, data_fim: datetime) -> list[Venda]:
+        """vendas entre as duas datas (inclusive), em ordem cronológica"""
+        inicio = bisect_left(self._por_data, (data_inicio,))
+        fim = bisect_right(self._por_data, (data_fim, float('inf')))
+        return [self[venda_id] for _, venda_id in self._por_data[inicio:fim]]
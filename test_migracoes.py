@@ -0,0 +1,180 @@
+"""
+Testes das migrações que reescrevem colunas de bancos já existentes (datas e dinheiro).
+Essas migrações apagam a coluna antiga, então não tem volta: aqui um banco com o esquema da
+versão 0 (datas em texto ISO, dinheiro em REAL) passa pelo aplicar_migracoes() e os valores
+convertidos são conferidos com contas feitas à parte, sem usar as funções de models que a migração usa.
+
+Roda com `python -m pytest` ou `python -m unittest` a partir da pasta do projeto.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from database import (DatabaseManager, MIGRACOES, TABELAS_DADOS, COLUNAS_DATA, COLUNAS_DINHEIRO,
+                      ENTIDADES_LOG_ALTERACOES)
+
+# esquema da versão 0, como o create_tables gravava antes das migrações
+ESQUEMA_V0 = """
+CREATE TABLE fornecedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL, empresa TEXT, telefone TEXT, email TEXT, morada TEXT
+);
+CREATE TABLE localizacoes (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL UNIQUE, endereco TEXT);
+CREATE TABLE produtos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL, descricao TEXT, categoria TEXT, codigo_barras TEXT,
+    preco_compra REAL NOT NULL, preco_venda REAL NOT NULL, ponto_ressuprimento INTEGER NOT NULL,
+    fornecedor_id INTEGER NOT NULL, tipo_produto TEXT NOT NULL DEFAULT 'individual',
+    FOREIGN KEY (fornecedor_id) REFERENCES fornecedores (id) ON DELETE CASCADE
+);
+CREATE TABLE componentes_kit (
+    kit_produto_id INTEGER NOT NULL, componente_produto_id INTEGER NOT NULL, quantidade INTEGER NOT NULL,
+    PRIMARY KEY (kit_produto_id, componente_produto_id),
+    FOREIGN KEY (kit_produto_id) REFERENCES produtos (id) ON DELETE CASCADE,
+    FOREIGN KEY (componente_produto_id) REFERENCES produtos (id) ON DELETE CASCADE
+);
+CREATE TABLE estoque (
+    produto_id INTEGER NOT NULL, localizacao_id INTEGER NOT NULL, quantidade INTEGER NOT NULL,
+    PRIMARY KEY (produto_id, localizacao_id),
+    FOREIGN KEY (produto_id) REFERENCES produtos (id) ON DELETE CASCADE,
+    FOREIGN KEY (localizacao_id) REFERENCES localizacoes (id) ON DELETE CASCADE
+);
+CREATE TABLE historico_movimentos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, produto_id INTEGER NOT NULL, localizacao_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL, quantidade INTEGER NOT NULL, data TEXT NOT NULL,
+    FOREIGN KEY (produto_id) REFERENCES produtos (id) ON DELETE CASCADE,
+    FOREIGN KEY (localizacao_id) REFERENCES localizacoes (id) ON DELETE CASCADE
+);
+CREATE TABLE ordens_compra (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, fornecedor_id INTEGER NOT NULL, status TEXT NOT NULL, data_criacao TEXT NOT NULL,
+    FOREIGN KEY (fornecedor_id) REFERENCES fornecedores(id) ON DELETE CASCADE
+);
+CREATE TABLE itens_ordem_compra (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ordem_id INTEGER NOT NULL, produto_id INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL, preco_unitario REAL NOT NULL,
+    FOREIGN KEY (ordem_id) REFERENCES ordens_compra(id) ON DELETE CASCADE,
+    FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE
+);
+CREATE TABLE vendas (id INTEGER PRIMARY KEY AUTOINCREMENT, cliente_nome TEXT NOT NULL, data TEXT NOT NULL);
+CREATE TABLE itens_venda (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, venda_id INTEGER NOT NULL, produto_id INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL, preco_venda_unitario REAL NOT NULL,
+    FOREIGN KEY (venda_id) REFERENCES vendas(id) ON DELETE CASCADE,
+    FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE
+);
+CREATE TABLE devolucoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, venda_original_id INTEGER NOT NULL, cliente_nome TEXT NOT NULL,
+    status TEXT NOT NULL, data TEXT NOT NULL, observacoes TEXT,
+    FOREIGN KEY (venda_original_id) REFERENCES vendas(id)
+);
+CREATE TABLE itens_devolucao (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, devolucao_id INTEGER NOT NULL, produto_id INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL, motivo_devolucao TEXT NOT NULL, condicao_produto TEXT NOT NULL,
+    FOREIGN KEY (devolucao_id) REFERENCES devolucoes(id) ON DELETE CASCADE,
+    FOREIGN KEY (produto_id) REFERENCES produtos(id)
+);
+CREATE TABLE transacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, devolucao_id INTEGER NOT NULL, tipo TEXT NOT NULL,
+    valor REAL NOT NULL, data TEXT NOT NULL,
+    FOREIGN KEY (devolucao_id) REFERENCES devolucoes(id) ON DELETE CASCADE
+);
+"""
+
+# as datas eram gravadas com datetime.now().isoformat(): horário local, sem fuso
+DATA_VENDA = datetime(2024, 3, 10, 14, 30, 15, 123456)
+DATA_DEVOLUCAO = datetime(2024, 3, 12, 9, 5, 0, 7)
+DATA_ORDEM = datetime(2023, 12, 31, 23, 59, 59, 999999)
+
+
+def microssegundos_utc(data: datetime) -> int:
+    """a conta esperada, feita sem passar por models.para_epoca"""
+    return int(data.replace(microsecond=0).timestamp()) * 1_000_000 + data.microsecond
+
+
+class TestMigracoesBancoAntigo(unittest.TestCase):
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.db = DatabaseManager(os.path.join(pasta.name, "antigo.db"))
+        self.db.connect()
+        self.addCleanup(self.db.close)
+        self._popular_versao_0()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.db.aplicar_migracoes()
+
+    def _popular_versao_0(self):
+        conn = self.db.conn
+        conn.executescript(ESQUEMA_V0)
+        conn.executescript(
+            f"""
+            INSERT INTO fornecedores (id, nome, empresa) VALUES (1, 'F', 'F Ltda');
+            INSERT INTO localizacoes (id, nome) VALUES (1, 'Loja');
+            INSERT INTO produtos (id, nome, categoria, codigo_barras, preco_compra, preco_venda, ponto_ressuprimento, fornecedor_id)
+                VALUES (1, 'Caneta', 'Papelaria', '789', 2.675, 10.005, 1, 1);
+            INSERT INTO estoque VALUES (1, 1, 8);
+            INSERT INTO ordens_compra (id, fornecedor_id, status, data_criacao) VALUES (1, 1, 'pendente', '{DATA_ORDEM.isoformat()}');
+            INSERT INTO itens_ordem_compra (ordem_id, produto_id, quantidade, preco_unitario) VALUES (1, 1, 10, 2.675);
+            INSERT INTO vendas (id, cliente_nome, data) VALUES (1, 'Cliente', '{DATA_VENDA.isoformat()}');
+            INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_venda_unitario) VALUES (1, 1, 2, 10.005);
+            INSERT INTO historico_movimentos (produto_id, localizacao_id, tipo, quantidade, data)
+                VALUES (1, 1, 'Venda #1', -2, '{DATA_VENDA.isoformat()}'),
+                       (1, 1, 'Devolução #1 - Retorno de Produto', 1, '{DATA_DEVOLUCAO.isoformat()}');
+            INSERT INTO devolucoes (id, venda_original_id, cliente_nome, status, data, observacoes)
+                VALUES (1, 1, 'Cliente', 'concluida', '{DATA_DEVOLUCAO.isoformat()}', '');
+            INSERT INTO itens_devolucao (devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto)
+                VALUES (1, 1, 1, 'defeito', 'ok');
+            INSERT INTO transacoes (devolucao_id, tipo, valor, data) VALUES (1, 'reembolso', 1.005, '{DATA_DEVOLUCAO.isoformat()}');
+            """
+        )
+
+    def _valor(self, query, params=()):
+        return self.db.conn.execute(query, params).fetchone()[0]
+
+    def test_chega_na_ultima_versao_com_banco_integro(self):
+        self.assertEqual(self.db.versao_esquema(), MIGRACOES[-1][0])
+        self.assertEqual(self._valor("PRAGMA integrity_check"), "ok")
+        self.assertEqual(self.db.conn.execute("PRAGMA foreign_key_check").fetchall(), [])
+
+    def test_datas_viram_microssegundos_utc(self):
+        for tabela, coluna in COLUNAS_DATA:
+            self.assertEqual(self._valor(f"SELECT DISTINCT typeof({coluna}) FROM {tabela}"), "integer", tabela)
+        self.assertEqual(self._valor("SELECT data FROM vendas"), microssegundos_utc(DATA_VENDA))
+        self.assertEqual(self.db.conn.execute("SELECT data FROM historico_movimentos ORDER BY id").fetchall(),
+                         [(microssegundos_utc(DATA_VENDA),), (microssegundos_utc(DATA_DEVOLUCAO),)])
+        self.assertEqual(self._valor("SELECT data_criacao FROM ordens_compra"), microssegundos_utc(DATA_ORDEM))
+        self.assertEqual(self._valor("SELECT data FROM devolucoes"), microssegundos_utc(DATA_DEVOLUCAO))
+        self.assertEqual(self._valor("SELECT data FROM transacoes"), microssegundos_utc(DATA_DEVOLUCAO))
+
+    def test_dinheiro_vira_centavos_arredondando_meio_centavo_pra_cima(self):
+        for tabela, coluna in COLUNAS_DINHEIRO:
+            self.assertEqual(self._valor(f"SELECT DISTINCT typeof({coluna}) FROM {tabela}"), "integer", tabela)
+        # 2.675, 10.005 e 1.005 ficam um tiquinho abaixo do meio centavo no float; vale o texto digitado
+        self.assertEqual(self.db.conn.execute("SELECT preco_compra, preco_venda FROM produtos").fetchone(), (268, 1001))
+        self.assertEqual(self._valor("SELECT preco_unitario FROM itens_ordem_compra"), 268)
+        self.assertEqual(self.db.conn.execute("SELECT preco_venda_unitario, custo_unitario FROM itens_venda").fetchone(), (1001, 268))
+        self.assertEqual(self._valor("SELECT valor FROM transacoes"), 101)
+        # os resumos são somados em reais antes da conversão: 2 x 10.005, 2 x 2.675 e 1 x 10.005
+        for tabela in ("resumo_vendas_diario_produto", "resumo_vendas_diario_local"):
+            self.assertEqual(
+                self.db.conn.execute(f"SELECT SUM(receita), SUM(custo), SUM(valor_devolvido) FROM {tabela}").fetchone(),
+                (2001, 535, 1001), tabela
+            )
+
+    def test_triggers_continuam_disparando(self):
+        # as colunas substituídas saem e voltam com os triggers de UPDATE suspensos; todos precisam estar de volta
+        esperados = 3 * len(TABELAS_DADOS) + 3 * len(ENTIDADES_LOG_ALTERACOES) + 1
+        self.assertEqual(self._valor("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'"), esperados)
+        for tabela, coluna in COLUNAS_DATA + COLUNAS_DINHEIRO:
+            if tabela not in TABELAS_DADOS:
+                continue  # os resumos não têm triggers
+            contador_antes = self._valor("SELECT contador FROM controle_alteracoes")
+            seq_antes = self.db.ultima_alteracao()
+            self.db.conn.execute(f"UPDATE {tabela} SET {coluna} = {coluna} + 1")
+            self.assertGreater(self._valor("SELECT contador FROM controle_alteracoes"), contador_antes, tabela)
+            self.assertGreater(self.db.ultima_alteracao(), seq_antes, tabela)
+
+
+if __name__ == "__main__":
+    unittest.main()